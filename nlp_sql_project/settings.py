@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -121,3 +122,177 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# LexiBase NL-to-SQL pipeline
+
+# Saved llama.cpp states for evaluated prompt prefixes (system prompt + schema),
+# keyed by the prefix text. Bounded by entry count and total state size.
+LEXIBASE_PREFIX_CACHE_ENABLED = True
+LEXIBASE_PREFIX_CACHE_ENTRIES = 8
+LEXIBASE_PREFIX_CACHE_BYTES = 512 * 1024 * 1024
+
+# Parsed schemas of uploaded databases, keyed by (path, inode, size, mtime, schema_version).
+LEXIBASE_SCHEMA_CACHE_ENTRIES = 64
+
+# Question-to-SQL memoization, keyed by the normalized question and the database fingerprint.
+# Set LEXIBASE_QUESTION_CACHE_PATH to a file path to persist entries across restarts.
+LEXIBASE_QUESTION_CACHE_ENABLED = True
+LEXIBASE_QUESTION_CACHE_ENTRIES = 1024
+LEXIBASE_QUESTION_CACHE_TTL = 24 * 60 * 60
+LEXIBASE_QUESTION_CACHE_PATH = None
+LEXIBASE_QUESTION_CACHE_DISK_ENTRIES = 100000
+# The disk store is trimmed to its entry limit once every this many writes.
+LEXIBASE_QUESTION_CACHE_PRUNE_EVERY = 1000
+
+# Result sets of executed SELECTs, keyed by canonical SQL and database fingerprint.
+LEXIBASE_RESULT_CACHE_ENTRIES = 256
+LEXIBASE_RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Abort generation as soon as the streamed output contains a complete, parseable SELECT.
+LEXIBASE_EARLY_STOP_ENABLED = True
+
+# Constrain decoding with a GBNF grammar for read-only SELECT/WITH statements,
+# specialized to the table and column names of the active database.
+LEXIBASE_GRAMMAR_ENABLED = False
+LEXIBASE_GRAMMAR_CACHE_ENTRIES = 16
+
+# Schemas larger than this many tokens are pruned to the top-k tables relevant to
+# the question (BM25 over table/column names and sampled values) plus FK neighbors.
+LEXIBASE_SCHEMA_TOKEN_BUDGET = 2048
+LEXIBASE_SCHEMA_TOP_K = 8
+LEXIBASE_SCHEMA_INDEX_ENTRIES = 32
+
+# Inference scheduler: model workers (each with its own llama context), the number
+# of queued requests before new ones get 503 + Retry-After, and the per-request deadline.
+LEXIBASE_INFERENCE_WORKERS = 1
+LEXIBASE_INFERENCE_QUEUE_SIZE = 8
+LEXIBASE_INFERENCE_TIMEOUT = 120
+# "thread" runs workers on in-process llama contexts; "process" gives each worker its
+# own model process with LEXIBASE_MODEL_THREADS_PER_WORKER threads pinned to its CPUs.
+LEXIBASE_INFERENCE_BACKEND = 'thread'
+# When no other worker is idle, a worker runs up to this many queued jobs with the same
+# schema prefix one after another, skipping the prefix restore. Each job still decodes alone.
+LEXIBASE_INFERENCE_PREFIX_GROUP_SIZE = 4
+LEXIBASE_MODEL_THREADS_PER_WORKER = None
+
+# Pooled read-only SQLite connections per uploaded database.
+LEXIBASE_DB_POOL_SIZE = 4
+LEXIBASE_DB_POOL_IDLE_SECONDS = 600
+LEXIBASE_SQLITE_MMAP_BYTES = 256 * 1024 * 1024
+LEXIBASE_SQLITE_CACHE_KIB = 64 * 1024
+
+# Result pagination and streaming exports.
+LEXIBASE_RESULT_PAGE_SIZE = 100
+LEXIBASE_RESULT_MAX_PAGE_SIZE = 1000
+LEXIBASE_EXPORT_BATCH_ROWS = 1000
+
+# Query execution guardrails. The plan policy is 'reject', 'warn' or 'off'.
+LEXIBASE_QUERY_TIME_LIMIT = 10
+LEXIBASE_QUERY_MAX_VM_STEPS = 500_000_000
+LEXIBASE_QUERY_PROGRESS_INTERVAL = 10_000
+LEXIBASE_EXPORT_TIME_LIMIT = 300
+LEXIBASE_QUERY_PLAN_POLICY = 'reject'
+LEXIBASE_QUERY_SCAN_WARN_ROWS = 1_000_000
+LEXIBASE_QUERY_MAX_PLAN_ROWS = 100_000_000
+
+# Rewrite generated SQL with sqlglot's optimizer before it runs.
+LEXIBASE_SQL_REWRITE_ENABLED = True
+
+# Optional DuckDB engine for large analytical queries (needs the duckdb package
+# and its sqlite extension). LEXIBASE_DUCKDB_THREADS=None uses every core.
+LEXIBASE_DUCKDB_ENABLED = True
+LEXIBASE_DUCKDB_MIN_ROWS = 1_000_000
+LEXIBASE_DUCKDB_THREADS = None
+LEXIBASE_DUCKDB_MEMORY_LIMIT = '1GB'
+
+# In-memory hot tier: databases opened at least MIN_ACCESSES times that fit are
+# copied into memory, within a global budget, least recently used demoted first.
+LEXIBASE_HOT_TIER_ENABLED = True
+LEXIBASE_HOT_TIER_BUDGET_BYTES = 512 * 1024 * 1024
+LEXIBASE_HOT_TIER_MAX_DB_BYTES = 128 * 1024 * 1024
+LEXIBASE_HOT_TIER_MIN_ACCESSES = 8
+
+# Content-addressed upload store: identical uploads share one read-only file,
+# kept until the last session referencing it ends.
+# LEXIBASE_UPLOAD_DIR = BASE_DIR / 'temp_uploads'
+LEXIBASE_UPLOAD_QUICK_CHECK = True  # Run PRAGMA quick_check on each new (not deduplicated) upload.
+# Disk quotas: one upload per session, and the whole store; over the global quota
+# databases no session uses are evicted first, then the least recently used.
+LEXIBASE_UPLOAD_SESSION_QUOTA_BYTES = 512 * 1024 * 1024
+LEXIBASE_UPLOAD_GLOBAL_QUOTA_BYTES = 10 * 1024 * 1024 * 1024
+
+# Background janitor: releases databases whose sessions expired, deletes stray
+# files and closes idle pools. 0 disables the thread; `manage.py sweep_uploads`
+# runs the same sweep (e.g. from cron).
+LEXIBASE_JANITOR_INTERVAL = 600
+
+# Model startup: 'eager' loads the model in every process at startup (including
+# manage.py commands), 'lazy' on first use with a one-token warm-up, 'remote'
+# sends generation to one shared `manage.py run_model_server` process over a
+# Unix socket, so workers do not each map their own model.
+LEXIBASE_MODEL_STARTUP = 'lazy'
+LEXIBASE_MODEL_WARMUP = True
+LEXIBASE_MODEL_CONTEXT_SIZE = 4096
+LEXIBASE_MODEL_SOCKET = BASE_DIR / 'lexibase-model.sock'
+
+# Batch API (/batch/): questions per request, and threads running the generated
+# queries concurrently. The thread count defaults to LEXIBASE_DB_POOL_SIZE, so
+# each thread reuses a pooled connection; set it only to decouple the two.
+LEXIBASE_BATCH_MAX_QUESTIONS = 50
+# LEXIBASE_BATCH_EXECUTION_THREADS = 4
+# Scripts authenticate with "Authorization: Bearer <token>" instead of a CSRF
+# token; without a token set, only browser sessions (with CSRF) can use the API.
+LEXIBASE_BATCH_API_TOKEN = os.environ.get('LEXIBASE_BATCH_API_TOKEN')
+
+# Observability: per-stage latency, token and cache metrics are served at
+# /metrics in the Prometheus text format. Disabling them skips all recording.
+LEXIBASE_METRICS_ENABLED = True
+
+# Application logs go to the console. At INFO each question logs one line with
+# its stage timings; DEBUG adds per-step detail, WARNING keeps the hot path quiet.
+LEXIBASE_LOG_LEVEL = os.environ.get('LEXIBASE_LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {
+            'format': '{asctime} {levelname} {name}: {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'plain',
+        },
+    },
+    'loggers': {
+        'query_interface': {
+            'handlers': ['console'],
+            'level': LEXIBASE_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
+# Simple questions ("how many X", "list all X", "top 5 X by Y", "average Y per Z")
+# are answered by a rule-based translator matched against the schema in
+# microseconds; anything it is less confident about than the threshold (0-1)
+# goes to the LLM. Extra synonyms map question words to schema terms.
+LEXIBASE_FAST_PATH_ENABLED = True
+LEXIBASE_FAST_PATH_MIN_CONFIDENCE = 0.85
+# LEXIBASE_FAST_PATH_SYNONYMS = {'headcount': 'employee'}
+
+# Uploads are profiled once into a compressed sidecar file next to the database:
+# row counts, column types, distinct counts, frequent values of low-cardinality
+# text columns and numeric ranges. Prompts get the values relevant to each
+# question, and the engine router and plan checks use the row counts, without
+# querying the database. Column statistics read at most PROFILE_SAMPLE_ROWS rows
+# per table.
+LEXIBASE_PROFILE_ENABLED = True
+LEXIBASE_PROFILE_SAMPLE_ROWS = 1_000_000
+LEXIBASE_PROFILE_MAX_CATEGORIES = 100
+LEXIBASE_PROFILE_TOP_VALUES = 10
+LEXIBASE_PROFILE_PROMPT_COLUMNS = 8
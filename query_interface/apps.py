@@ -1,13 +1,25 @@
 # query_interface/apps.py
+import logging
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+MODEL_STARTUP_MODES = ('eager', 'lazy', 'remote')
 
 class QueryInterfaceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'query_interface'
 
     def ready(self):
-        # This method runs once when the Django server starts.
-        from .core_nlp import llm_handler
-        print("---- [App Ready] Triggering NLP Model Pre-loading ----")
-        llm_handler.load_model()
-        print("---- [App Ready] NLP Model is pre-loaded and ready. ----")
\ No newline at end of file
+        # This runs once per process, for the server and for every manage.py command,
+        # so it stays cheap unless the deployment asked for eager model loading.
+        mode = getattr(settings, 'LEXIBASE_MODEL_STARTUP', 'lazy')
+        if mode not in MODEL_STARTUP_MODES:
+            raise ImproperlyConfigured(f"LEXIBASE_MODEL_STARTUP must be one of {MODEL_STARTUP_MODES}, not {mode!r}.")
+        if mode == 'eager':
+            from .core_nlp import llm_handler
+            logger.info("Pre-loading the NLP model.")
+            llm_handler.load_model()
+            logger.info("NLP model is pre-loaded and ready.")
@@ -0,0 +1,120 @@
+# query_interface/core_nlp/batch_runner.py
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+
+from . import fast_path, inference_scheduler, metrics
+from .inference_scheduler import SchedulerBusy
+from .prompt_builder import create_text_to_sql_prompt, get_schema_info, get_sql_grammar
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_QUESTIONS = getattr(settings, 'LEXIBASE_BATCH_MAX_QUESTIONS', 50)
+# One thread per pooled connection, so concurrent queries reuse warm connections.
+BATCH_EXECUTION_THREADS = getattr(
+    settings, 'LEXIBASE_BATCH_EXECUTION_THREADS', getattr(settings, 'LEXIBASE_DB_POOL_SIZE', 4)
+)
+BUSY_RETRY_SECONDS = 1.0
+
+
+def _inference_window(scheduler) -> int:
+    """Jobs a batch keeps queued at once: enough to fill every worker's same-prefix group,
+    while leaving half the queue to interactive requests."""
+    return max(1, min(scheduler.workers * scheduler.group_size, scheduler.max_queue // 2))
+
+def _failure(index: int, question: str, error, stage: str, sql: str = None, route: str = 'llm') -> dict:
+    """A result for a question that failed in `stage`: 'generation' (no SQL yet) or 'execution'."""
+    return {
+        'index': index, 'question': question, 'sql': sql, 'cached': route == 'cache', 'route': route,
+        'error': str(error), 'error_stage': stage, 'busy': isinstance(error, SchedulerBusy), 'results': None,
+    }
+
+def run_batch(questions: list, db_path: str, fingerprint: str, execute, use_cache: bool = True):
+    """
+    Translates and runs a list of questions against one database, yielding one
+    result dict per question as soon as it completes (so not in input order;
+    each carries its `index`).
+
+    The schema and grammar are read once and every prompt shares their prefix.
+    Questions the question cache or the fast path can answer run straight away;
+    the rest are submitted to the inference scheduler a window at a time, so
+    a worker runs them back to back on one restored prefix. Each generated query
+    runs on a thread pool as soon as its SQL arrives, while the rest are still
+    generating. `execute(question, sql, generated)` runs one query (`generated`
+    when its SQL came from the model) and returns its results dict.
+    """
+    scheduler = inference_scheduler.scheduler
+    executor = ThreadPoolExecutor(max_workers=BATCH_EXECUTION_THREADS, thread_name_prefix='batch-query')
+    to_generate = deque()
+    running = {}  # future -> (index, sql, route, inference job or None)
+    try:
+        with metrics.span('prompt_build'):
+            get_schema_info(db_path)
+            grammar = get_sql_grammar(db_path)
+            for index, question in enumerate(questions):
+                sql, route = fast_path.route(question, db_path, fingerprint, use_cache=use_cache, use_fast_path=use_cache)
+                if sql is not None:
+                    running[executor.submit(execute, question, sql, False)] = (index, sql, route, None)
+                else:
+                    to_generate.append((index, create_text_to_sql_prompt(question, db_path)))
+        logger.debug("Batch of %s questions: %s answered without the model, %s to generate.", len(questions), len(running), len(to_generate))
+
+        window = _inference_window(scheduler)
+        generating = 0
+        busy_since = None
+        while to_generate or running:
+            while to_generate and generating < window:
+                index, prompt = to_generate[0]
+                try:
+                    job = scheduler.submit(prompt, grammar=grammar)
+                except SchedulerBusy as e:
+                    # Other users filled the queue. Retry as our own jobs finish, giving up
+                    # on a question after it has waited as long as a job may run.
+                    busy_since = busy_since or time.monotonic()
+                    if time.monotonic() - busy_since > scheduler.default_timeout:
+                        to_generate.popleft()
+                        busy_since = None
+                        yield _failure(index, questions[index], e, 'generation')
+                        continue
+                    break
+                to_generate.popleft()
+                busy_since = None
+                running[job.future] = (index, None, 'llm', job)
+                generating += 1
+            if not running:
+                time.sleep(BUSY_RETRY_SECONDS)
+                continue
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, sql, route, job = running.pop(future)
+                question = questions[index]
+                if job is not None:
+                    generating -= 1
+                    try:
+                        sql = future.result()
+                    except Exception as e:
+                        yield _failure(index, question, e, 'generation')
+                        continue
+                    metrics.record_route('llm', time.monotonic() - job.submitted)
+                    running[executor.submit(execute, question, sql, True)] = (index, sql, route, None)
+                    continue
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.exception("Batch query %s failed: %s", index, e)
+                    yield _failure(index, question, e, 'execution', sql, route)
+                    continue
+                yield {
+                    'index': index, 'question': question, 'sql': sql, 'cached': route == 'cache', 'route': route,
+                    'error': results['error'], 'error_stage': 'execution' if results['error'] else None, 'busy': False,
+                    'results': results,
+                }
+    finally:
+        # Reached early if the client disconnected; stop generating for it.
+        for _, _, _, job in running.values():
+            if job is not None:
+                job.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,98 @@
+# query_interface/core_nlp/cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache bounded by entry count and,
+    optionally, by the total size (in bytes) reported for its values and by
+    a time-to-live (in seconds) after which entries expire.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        """Stores a value, evicting old entries until the cache fits its budgets."""
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Never let a single oversized value flush the whole cache.
+                self._remove(key)
+                return False
+            self._remove(key)
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, size, expires_at)
+            self.total_bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+            ):
+                _, (_, old_size, _) = self._data.popitem(last=False)
+                self.total_bytes -= old_size
+                self.evictions += 1
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._remove(key)
+            return default if entry is None else entry[0]
+
+    def invalidate(self, predicate):
+        """Removes every entry whose key satisfies `predicate`. Returns the number removed."""
+        with self._lock:
+            doomed = [key for key in self._data if predicate(key)]
+            for key in doomed:
+                self._remove(key)
+            return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+        return entry
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,48 @@
+# query_interface/core_nlp/db_fingerprint.py
+import hashlib
+import os
+import re
+
+SQLITE_HEADER_MAGIC = b"SQLite format 3\x00"
+CONTENT_OBJECT_SUFFIX = ".sqlite3"
+_CONTENT_OBJECT_RE = re.compile(r'^([0-9a-f]{64})' + re.escape(CONTENT_OBJECT_SUFFIX) + '$')
+
+def content_object_name(content_hash: str) -> str:
+    """File name of a content-addressed upload: its SHA-256 plus a suffix."""
+    return content_hash + CONTENT_OBJECT_SUFFIX
+
+def content_hash_from_path(db_path: str):
+    """Returns the SHA-256 a content-addressed upload is stored under, or None for other files."""
+    match = _CONTENT_OBJECT_RE.match(os.path.basename(db_path))
+    return match.group(1) if match else None
+
+def read_schema_version(db_path: str) -> int:
+    """
+    Reads the schema cookie (the value `PRAGMA schema_version` returns) directly
+    from the 100-byte database header, without opening a SQLite connection.
+    Returns -1 if the file is not a SQLite database.
+    """
+    with open(db_path, 'rb') as f:
+        header = f.read(100)
+    if len(header) < 100 or not header.startswith(SQLITE_HEADER_MAGIC):
+        return -1
+    return int.from_bytes(header[40:44], 'big')
+
+def get_db_fingerprint(db_path: str) -> str:
+    """
+    Returns a cheap fingerprint of a database file. Content-addressed uploads are
+    immutable, so their content hash is the fingerprint and identical uploads
+    share every downstream cache. Other files use (path, inode, size, mtime,
+    schema_version); any change to the file yields a new value.
+    """
+    content_hash = content_hash_from_path(db_path)
+    if content_hash is not None:
+        return content_hash
+    stat = os.stat(db_path)
+    schema_version = read_schema_version(db_path)
+    raw_key = f"{os.path.realpath(db_path)}|{stat.st_ino}|{stat.st_size}|{stat.st_mtime_ns}|{schema_version}"
+    return hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+
+def quote_identifier(name: str) -> str:
+    """Quotes a table or column name for safe interpolation into SQLite statements."""
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,122 @@
+# query_interface/core_nlp/db_pool.py
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from django.conf import settings
+
+from . import hot_tier
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Read-only connections to one database file, kept open between requests so
+    SQLite's page cache and statement cache survive. A connection is only ever
+    used by one thread at a time. `source_uri` points the pool at an in-memory
+    hot-tier copy instead of the file.
+    """
+
+    def __init__(self, db_path: str, max_size: int, source_uri: str = None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.source_uri = source_uri
+        self.file_id = self._stat_file_id(db_path)
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_file_id(db_path: str):
+        stat = os.stat(db_path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _open(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.source_uri or f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        con.execute("PRAGMA query_only = ON;")
+        con.execute(f"PRAGMA mmap_size = {int(getattr(settings, 'LEXIBASE_SQLITE_MMAP_BYTES', 256 * 1024 * 1024))};")
+        # A negative cache_size is a budget in KiB rather than in pages.
+        con.execute(f"PRAGMA cache_size = -{int(getattr(settings, 'LEXIBASE_SQLITE_CACHE_KIB', 64 * 1024))};")
+        con.execute("PRAGMA temp_store = MEMORY;")
+        return con
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            self.last_used = time.monotonic()
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, con: sqlite3.Connection):
+        with self._lock:
+            if not self.closed and len(self._idle) < self.max_size:
+                self._idle.append(con)
+                return
+        con.close()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for con in idle:
+            con.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _evict_idle_pools(now: float) -> int:
+    max_idle = getattr(settings, 'LEXIBASE_DB_POOL_IDLE_SECONDS', 600)
+    evicted = 0
+    for db_path, pool in list(_pools.items()):
+        if now - pool.last_used > max_idle:
+            logger.debug("Closing idle pool for %s", db_path)
+            del _pools[db_path]
+            pool.close()
+            evicted += 1
+    return evicted
+
+def evict_idle_pools() -> int:
+    """Closes pools unused for LEXIBASE_DB_POOL_IDLE_SECONDS. Returns how many were closed."""
+    with _pools_lock:
+        return _evict_idle_pools(time.monotonic())
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """
+    Returns the pool for a database file, replacing it if the file has changed or
+    the database has moved into (or out of) the in-memory hot tier.
+    """
+    hot = hot_tier.lookup(db_path)
+    source_uri = hot.uri if hot is not None else None
+    with _pools_lock:
+        _evict_idle_pools(time.monotonic())
+        pool = _pools.get(db_path)
+        if pool is not None and (pool.file_id != ConnectionPool._stat_file_id(db_path) or pool.source_uri != source_uri):
+            pool.close()
+            pool = None
+        if pool is None:
+            pool = ConnectionPool(db_path, getattr(settings, 'LEXIBASE_DB_POOL_SIZE', 4), source_uri)
+            _pools[db_path] = pool
+        return pool
+
+@contextlib.contextmanager
+def connection(db_path: str):
+    """Borrows a pooled read-only connection to `db_path` for the duration of the block."""
+    pool = get_pool(db_path)
+    con = pool.acquire()
+    try:
+        yield con
+    finally:
+        pool.release(con)
+
+def close_database(db_path: str):
+    """Closes every pooled connection to a database and drops its hot-tier copy, e.g. before its file is deleted."""
+    with _pools_lock:
+        pool = _pools.pop(db_path, None)
+    if pool is not None:
+        pool.close()
+    hot_tier.hot_tier.discard(db_path)
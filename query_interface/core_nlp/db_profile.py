@@ -0,0 +1,227 @@
+# query_interface/core_nlp/db_profile.py
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from django.conf import settings
+
+from .cache import LRUCache
+from .db_fingerprint import get_db_fingerprint, quote_identifier
+from .db_pool import connection
+from .schema_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENABLED = getattr(settings, 'LEXIBASE_PROFILE_ENABLED', True)
+# Row counts are exact; column statistics are computed over at most this many rows per table.
+PROFILE_SAMPLE_ROWS = getattr(settings, 'LEXIBASE_PROFILE_SAMPLE_ROWS', 1_000_000)
+# Text columns with at most PROFILE_MAX_CATEGORIES distinct values keep their most frequent values.
+PROFILE_MAX_CATEGORIES = getattr(settings, 'LEXIBASE_PROFILE_MAX_CATEGORIES', 100)
+PROFILE_TOP_VALUES = getattr(settings, 'LEXIBASE_PROFILE_TOP_VALUES', 10)
+# Columns whose values are added to a prompt, most relevant first.
+PROFILE_PROMPT_COLUMNS = getattr(settings, 'LEXIBASE_PROFILE_PROMPT_COLUMNS', 8)
+MAX_VALUE_LENGTH = 100
+PROFILE_VERSION = 1
+PROFILE_SUFFIX = '.profile.json.gz'
+
+# Loaded profiles keyed by the database fingerprint, like the schema cache.
+profile_cache = LRUCache(max_entries=getattr(settings, 'LEXIBASE_PROFILE_CACHE_ENTRIES', 64))
+
+
+def profile_path(db_path: str) -> str:
+    """The profile sidecar of a database: a file next to it with PROFILE_SUFFIX appended."""
+    return db_path + PROFILE_SUFFIX
+
+def column_affinity(declared_type: str) -> str:
+    """SQLite's type affinity for a declared column type (see "Determination Of Column Affinity")."""
+    declared_type = (declared_type or '').upper()
+    if 'INT' in declared_type:
+        return 'integer'
+    if any(marker in declared_type for marker in ('CHAR', 'CLOB', 'TEXT')):
+        return 'text'
+    if not declared_type or 'BLOB' in declared_type:
+        return 'blob'
+    if any(marker in declared_type for marker in ('REAL', 'FLOA', 'DOUB')):
+        return 'real'
+    return 'numeric'  # Also DATE and DATETIME, which usually hold ISO-8601 text.
+
+def _plain(value):
+    # BLOBs in a numeric column would not survive JSON; a range without them is still useful.
+    return None if isinstance(value, bytes) else value
+
+def _profile_table(cursor, table: str) -> dict:
+    quoted = quote_identifier(table)
+    columns = cursor.execute(f"PRAGMA table_info({quoted});").fetchall()
+    rows = cursor.execute(f"SELECT COUNT(*) FROM {quoted};").fetchone()[0]
+    sampled = rows > PROFILE_SAMPLE_ROWS
+    source = f"(SELECT * FROM {quoted} LIMIT {int(PROFILE_SAMPLE_ROWS)})" if sampled else quoted
+    profile = {'rows': rows, 'sampled': sampled, 'columns': {}}
+    if not columns:
+        return profile
+
+    # One pass computes every column's distinct and null counts, plus ranges where they make sense.
+    aggregates, ranged = [], []
+    for column in columns:
+        name, affinity = quote_identifier(column[1]), column_affinity(column[2])
+        aggregates += [f"COUNT(DISTINCT {name})", f"COUNT({name})"]
+        if affinity in ('integer', 'real', 'numeric'):
+            aggregates += [f"MIN({name})", f"MAX({name})"]
+            ranged.append(column[1])
+    values = iter(cursor.execute(f"SELECT COUNT(*), {', '.join(aggregates)} FROM {source};").fetchone())
+    profiled_rows = next(values)
+    for column in columns:
+        distinct, non_null = next(values), next(values)
+        stats = {'type': column[2], 'distinct': distinct, 'nulls': profiled_rows - non_null}
+        if column[1] in ranged:
+            stats['min'], stats['max'] = _plain(next(values)), _plain(next(values))
+        profile['columns'][column[1]] = stats
+
+    for column in columns:
+        stats = profile['columns'][column[1]]
+        if column_affinity(column[2]) not in ('text', 'blob') or not 0 < stats['distinct'] <= PROFILE_MAX_CATEGORIES:
+            continue
+        name = quote_identifier(column[1])
+        top = cursor.execute(
+            f"SELECT {name}, COUNT(*) FROM {source} WHERE typeof({name}) = 'text' AND length({name}) <= ? "
+            f"GROUP BY {name} ORDER BY COUNT(*) DESC, {name} LIMIT ?;",
+            (MAX_VALUE_LENGTH, PROFILE_TOP_VALUES),
+        ).fetchall()
+        if top:
+            stats['top_values'] = [[value, count] for value, count in top]
+    return profile
+
+def _read_profile(db_path: str, fingerprint: str) -> dict:
+    tables = {}
+    with connection(db_path) as con:
+        cursor = con.cursor()
+        try:
+            names = cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;"
+            ).fetchall()
+            for (name,) in names:
+                tables[name] = _profile_table(cursor, name)
+        finally:
+            cursor.close()
+    return {'version': PROFILE_VERSION, 'fingerprint': fingerprint, 'created': time.time(), 'tables': tables}
+
+def _write_profile(path: str, profile: dict):
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with gzip.open(temp_path, 'wb') as compressed:
+            compressed.write(json.dumps(profile, separators=(',', ':'), default=str).encode('utf-8'))
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _load_profile(db_path: str, fingerprint: str):
+    try:
+        with gzip.open(profile_path(db_path), 'rb') as f:
+            profile = json.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable profile for %s: %s", db_path, e)
+        return None
+    # A sidecar left behind by an earlier version of the file describes other data.
+    if profile.get('version') != PROFILE_VERSION or profile.get('fingerprint') != fingerprint:
+        logger.debug("Ignoring stale profile for %s.", db_path)
+        return None
+    return profile
+
+def build_profile(db_path: str, force: bool = False):
+    """
+    Profiles a database and stores the result in its sidecar file, unless a
+    current profile already exists (e.g. for a deduplicated upload). Meant for
+    upload time: it reads every table once. Returns the profile, or None when
+    profiling is disabled.
+    """
+    if not PROFILE_ENABLED:
+        return None
+    fingerprint = get_db_fingerprint(db_path)
+    if not force:
+        profile = get_profile(db_path)
+        if profile is not None:
+            return profile
+    start = time.perf_counter()
+    profile = _read_profile(db_path, fingerprint)
+    try:
+        _write_profile(profile_path(db_path), profile)
+    except OSError as e:
+        # Read-only directories still get the in-process copy.
+        logger.warning("Could not write profile for %s: %s", db_path, e)
+    profile_cache.put(fingerprint, profile)
+    logger.info(
+        "Profiled %s tables of %s in %.1fms.", len(profile['tables']), db_path, (time.perf_counter() - start) * 1000
+    )
+    return profile
+
+def get_profile(db_path: str):
+    """
+    Returns the precomputed profile of a database, loading its sidecar on first
+    use, or None if it has not been profiled. Never queries the database itself.
+    """
+    if not PROFILE_ENABLED or not db_path:
+        return None
+    fingerprint = get_db_fingerprint(db_path)
+    profile = profile_cache.get(fingerprint)
+    if profile is None:
+        profile = _load_profile(db_path, fingerprint)
+        if profile is not None:
+            profile_cache.put(fingerprint, profile)
+    return profile
+
+def get_row_counts(db_path: str):
+    """Returns {table: row count} from the profile, or None if there is none."""
+    profile = get_profile(db_path)
+    if profile is None:
+        return None
+    return {name: table['rows'] for name, table in profile['tables'].items()}
+
+def _sql_literal(value) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+def describe_relevant_values(db_path: str, question: str) -> str:
+    """
+    Renders the profiled values of the columns a question refers to, either by
+    name or by mentioning one of their frequent values, so the model can write
+    exact WHERE literals ('Sales', not 'sales') and sensible ranges. Returns ''
+    when there is no profile or nothing in it is relevant.
+    """
+    profile = get_profile(db_path)
+    if profile is None:
+        return ''
+    question_terms = set(tokenize(question))
+    if not question_terms:
+        return ''
+    candidates = []
+    for table, table_profile in profile['tables'].items():
+        for column, stats in table_profile['columns'].items():
+            top_values = stats.get('top_values') or []
+            column_terms = tokenize(column)
+            if not top_values and column_terms[-1:] == ['id']:
+                continue  # The range of a key says nothing about the data.
+            value_hits = sum(1 for value, _ in top_values if question_terms.issuperset(tokenize(value) or ['']))
+            name_hits = len(question_terms.intersection(column_terms))
+            # A mentioned value identifies the column far better than its name does.
+            score = 2 * value_hits + name_hits
+            if not score or not (top_values or 'min' in stats):
+                continue
+            candidates.append((score, table, column, stats))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    lines = []
+    for _, table, column, stats in candidates[:PROFILE_PROMPT_COLUMNS]:
+        if stats.get('top_values'):
+            values = ", ".join(_sql_literal(value) for value, _ in stats['top_values'])
+            more = f" ({stats['distinct']} distinct)" if stats['distinct'] > len(stats['top_values']) else ""
+            lines.append(f"- {table}.{column}: {values}{more}")
+        elif stats.get('min') is not None:
+            lines.append(f"- {table}.{column}: from {_sql_literal(stats['min'])} to {_sql_literal(stats['max'])}")
+    if not lines:
+        return ''
+    return "Values stored in the relevant columns:\n" + "\n".join(lines)
@@ -0,0 +1,147 @@
+# query_interface/core_nlp/duckdb_engine.py
+import logging
+import threading
+from django.conf import settings
+from sqlglot import exp
+
+from .db_fingerprint import get_db_fingerprint
+from .query_guard import QueryBudgetExceeded
+from .query_rewriter import apply_page_limit
+
+logger = logging.getLogger(__name__)
+
+try:
+    import duckdb
+except ImportError:  # DuckDB is optional; without it every query runs on SQLite.
+    duckdb = None
+
+DUCKDB_ENABLED = getattr(settings, 'LEXIBASE_DUCKDB_ENABLED', True)
+DUCKDB_THREADS = getattr(settings, 'LEXIBASE_DUCKDB_THREADS', None)
+DUCKDB_MEMORY_LIMIT = getattr(settings, 'LEXIBASE_DUCKDB_MEMORY_LIMIT', '1GB')
+
+# Functions whose SQLite and DuckDB semantics match after transpilation. Anything
+# else (date modifiers, integer division, SQLite-only functions) stays on SQLite.
+PORTABLE_FUNCTIONS = (
+    exp.Count, exp.Sum, exp.Avg, exp.Min, exp.Max, exp.Round, exp.Abs,
+    exp.Lower, exp.Upper, exp.Length, exp.Coalesce, exp.Nullif, exp.Cast, exp.Case, exp.If,
+    exp.RowNumber, exp.Rank, exp.DenseRank,
+)
+
+
+class DuckDBError(Exception):
+    """Raised when a query cannot run on DuckDB; the caller falls back to SQLite."""
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+_disabled_reason = None
+
+def is_available() -> bool:
+    return DUCKDB_ENABLED and duckdb is not None and _disabled_reason is None
+
+def is_portable(query) -> bool:
+    """True if the query only uses constructs that behave the same on DuckDB."""
+    for node in query.find_all(exp.Func, exp.Div):
+        if isinstance(node, exp.Div) or not isinstance(node, PORTABLE_FUNCTIONS):
+            return False
+        # SQLite's two-argument min()/max() are scalar functions, not aggregates.
+        if isinstance(node, (exp.Min, exp.Max)) and node.expressions:
+            return False
+    return True
+
+def transpile(query) -> str:
+    """Renders a SQLite AST as DuckDB SQL, keeping SQLite's case-insensitive LIKE."""
+    try:
+        query = query.transform(
+            lambda node: exp.ILike(this=node.this, expression=node.expression) if isinstance(node, exp.Like) else node
+        )
+        return query.sql(dialect="duckdb")
+    except Exception as e:
+        raise DuckDBError(f"Could not transpile the query to DuckDB: {e}") from e
+
+def _connect(db_path: str):
+    config = {'memory_limit': DUCKDB_MEMORY_LIMIT}
+    if DUCKDB_THREADS:
+        config['threads'] = DUCKDB_THREADS
+    con = duckdb.connect(database=':memory:', config=config)
+    try:
+        quoted_path = db_path.replace("'", "''")
+        con.execute(f"ATTACH '{quoted_path}' AS source (TYPE sqlite, READ_ONLY);")
+    except Exception:
+        con.close()
+        raise
+    return con
+
+def _get_connection(db_path: str):
+    """Returns the DuckDB instance attached to `db_path`, re-attaching if the file has changed."""
+    global _disabled_reason
+    fingerprint = get_db_fingerprint(db_path)
+    with _connections_lock:
+        entry = _connections.get(db_path)
+        if entry is not None and entry[0] == fingerprint:
+            return entry[1]
+        if entry is not None:
+            entry[1].close()
+        try:
+            con = _connect(db_path)
+        except duckdb.IOException as e:
+            # Usually the sqlite extension is missing and cannot be downloaded; stop trying.
+            _disabled_reason = str(e)
+            logger.warning("Disabling the DuckDB engine: %s", e)
+            raise DuckDBError(str(e)) from e
+        except duckdb.Error as e:
+            raise DuckDBError(str(e)) from e
+        _connections[db_path] = (fingerprint, con)
+        return con
+
+def stable_order(query):
+    """
+    Appends every output column (by position) to a SELECT's ORDER BY. DuckDB's
+    parallel hash aggregates, DISTINCT and joins emit rows in a different order on
+    every run, so without a total order LIMIT/OFFSET pages would repeat or skip
+    rows. Returns None when the output columns are not known (`*`, set operations).
+    """
+    if not isinstance(query, exp.Select) or query.is_star or not query.expressions:
+        return None
+    positions = [exp.Ordered(this=exp.Literal.number(i)) for i in range(1, len(query.expressions) + 1)]
+    return query.order_by(*positions, append=True, copy=True)
+
+def fetch_page(db_path: str, query, page: int, page_size: int, time_limit: float = None):
+    """
+    Runs one page of a query on DuckDB over the attached SQLite file. Returns
+    (executed_sql, columns, rows, has_next); columns is None if nothing had to run.
+    Raises DuckDBError for queries whose pages cannot be made deterministic.
+    """
+    ordered = stable_order(query)
+    if ordered is None:
+        raise DuckDBError("The query's row order cannot be made deterministic for paging.")
+    paged = apply_page_limit(ordered, page_size + 1, (page - 1) * page_size)
+    if paged is None:
+        return None, None, [], False
+    executed_sql = transpile(paged)
+    # Each cursor is a separate connection to the shared instance, so requests do not serialize.
+    cursor = _get_connection(db_path).cursor()
+    timer = threading.Timer(time_limit, cursor.interrupt) if time_limit else None
+    try:
+        cursor.execute("USE source;")
+        if timer is not None:
+            timer.start()
+        cursor.execute(executed_sql)
+        rows = cursor.fetchmany(page_size + 1)
+        columns = [description[0] for description in cursor.description]
+    except duckdb.InterruptException as e:
+        raise QueryBudgetExceeded(f"The query exceeded its time limit of {time_limit} seconds.") from e
+    except duckdb.Error as e:
+        raise DuckDBError(str(e)) from e
+    finally:
+        if timer is not None:
+            timer.cancel()
+        cursor.close()
+    return executed_sql, columns, rows[:page_size], len(rows) > page_size
+
+def close_database(db_path: str):
+    """Detaches and closes the DuckDB instance for a database, e.g. before its file is deleted."""
+    with _connections_lock:
+        entry = _connections.pop(db_path, None)
+    if entry is not None:
+        entry[1].close()
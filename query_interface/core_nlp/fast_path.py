@@ -0,0 +1,345 @@
+# query_interface/core_nlp/fast_path.py
+import difflib
+import logging
+import re
+import time
+from django.conf import settings
+
+from . import metrics, question_cache
+from .db_fingerprint import quote_identifier
+from .prompt_builder import get_schema_info
+from .schema_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = getattr(settings, 'LEXIBASE_FAST_PATH_ENABLED', True)
+# Questions whose best template match scores below this go to the LLM.
+FAST_PATH_MIN_CONFIDENCE = getattr(settings, 'LEXIBASE_FAST_PATH_MIN_CONFIDENCE', 0.85)
+
+# Match scores. A name's last words ("employee" for query_interface_employee)
+# and synonyms are nearly as good as the full name; fuzzy matches are scaled by
+# their similarity on top of FUZZY_SCORE.
+SUFFIX_ALIAS_SCORE = 0.95
+SYNONYM_SCORE = 0.95
+FUZZY_SCORE = 0.9
+FUZZY_CUTOFF = 0.8
+# Two candidates scoring within this margin make a slot ambiguous.
+AMBIGUITY_MARGIN = 0.05
+MAX_LIMIT = 1000
+
+# Question terms (after plural folding) and the schema term they usually mean.
+SYNONYMS = {
+    'staff': 'employee', 'worker': 'employee', 'personnel': 'employee', 'employe': 'employee',
+    'client': 'customer', 'buyer': 'customer', 'shopper': 'customer',
+    'good': 'product', 'article': 'product',
+    'purchase': 'order',
+    'pay': 'salary', 'wage': 'salary', 'earning': 'salary', 'compensation': 'salary',
+    'cost': 'price',
+    'dept': 'department', 'team': 'department',
+    'role': 'job title', 'position': 'job title',
+    'qty': 'quantity',
+    **getattr(settings, 'LEXIBASE_FAST_PATH_SYNONYMS', {}),
+}
+
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8,
+    'nine': 9, 'ten': 10, 'twenty': 20, 'fifty': 50, 'hundred': 100,
+}
+AGGREGATES = {
+    'average': 'AVG', 'avg': 'AVG', 'mean': 'AVG',
+    'total': 'SUM', 'sum': 'SUM', 'sum of': 'SUM',
+    'maximum': 'MAX', 'max': 'MAX', 'highest': 'MAX', 'largest': 'MAX',
+    'minimum': 'MIN', 'min': 'MIN', 'lowest': 'MIN', 'smallest': 'MIN',
+}
+NUMERIC_TYPE_MARKERS = ('INT', 'REAL', 'FLOA', 'DOUB', 'NUM', 'DEC')
+# SQLite keywords that cannot be used as bare identifiers.
+RESERVED_WORDS = {
+    'all', 'and', 'as', 'asc', 'between', 'by', 'case', 'check', 'column', 'constraint', 'create',
+    'default', 'delete', 'desc', 'distinct', 'drop', 'else', 'end', 'exists', 'foreign', 'from',
+    'group', 'having', 'in', 'index', 'insert', 'into', 'is', 'join', 'key', 'like', 'limit', 'not',
+    'null', 'offset', 'on', 'or', 'order', 'primary', 'references', 'select', 'set', 'table', 'then',
+    'to', 'transaction', 'union', 'unique', 'update', 'values', 'when', 'where',
+}
+
+_LEAD = r"(?:(?:list|show|display|get|give|return|find|fetch)(?: me)?|what(?: is|'s| are)|tell me)"
+_GROUP = r"(?: (?:per|by|for each|in each|for every|across|grouped by) (?P<group>.+?))?"
+_NUMBER = r"(?P<n>\d+|" + "|".join(NUMBER_WORDS) + ")"
+_AGGREGATE = "(?P<agg>" + "|".join(sorted(AGGREGATES, key=len, reverse=True)) + ")"
+
+TEMPLATES = (
+    ('count', re.compile(
+        r"^(?:how many|(?:what is |what's )?the (?:total )?number of|number of|count(?: of)?(?: all)?(?: the)?) "
+        r"(?P<table>.+?)(?: (?:are there|do we have|are there in total|exist|in total|are in the database|are stored))?"
+        + _GROUP + "$"
+    )),
+    ('aggregate', re.compile(
+        rf"^(?:{_LEAD} |calculate |compute )?(?:the )?{_AGGREGATE} (?P<column>.+?)"
+        r"(?: (?:of|for|among) (?:all )?(?:the )?(?P<table>(?!each |every ).+?))?" + _GROUP + "$"
+    )),
+    ('top', re.compile(
+        rf"^(?:{_LEAD} )?(?:the )?(?P<direction>top|bottom|first|last) {_NUMBER} (?P<table>.+?) "
+        r"(?:by|ranked by|ordered by|sorted by|with the (?P<extreme>highest|most|largest|lowest|least|smallest)) "
+        r"(?P<column>.+?)$"
+    )),
+    ('distinct', re.compile(
+        rf"^{_LEAD}(?: all)?(?: the)? (?:distinct|different|unique) (?P<column>.+?)"
+        r"(?: (?:of|for|in|from|among) (?:all )?(?:the )?(?P<table>.+?))?$"
+    )),
+    ('list_columns', re.compile(
+        rf"^{_LEAD}(?: all)?(?: the)? (?P<columns>.+?) (?:of|for|from) (?:all |every )?(?:the )?(?P<table>.+?)$"
+    )),
+    ('list', re.compile(
+        rf"^{_LEAD}(?: all| every)?(?: of)?(?: the)? (?P<table>.+?)(?: records| rows| entries)?$"
+    )),
+)
+
+
+def _identifier(name: str) -> str:
+    if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', name) and name.lower() not in RESERVED_WORDS:
+        return name
+    return quote_identifier(name)
+
+def _aliases(name: str) -> dict:
+    """The phrases a question might use for a table or column name, with their scores."""
+    terms = tokenize(name)
+    aliases = {}
+    for start in range(len(terms) - 1, -1, -1):
+        aliases[' '.join(terms[start:])] = 1.0 if start == 0 else SUFFIX_ALIAS_SCORE
+    return aliases
+
+def _add_aliases(alias_map: dict, key, name: str):
+    for alias, score in _aliases(name).items():
+        alias_map.setdefault(alias, []).append((key, score))
+
+def build_lexicon(info: dict) -> dict:
+    """Maps the phrases that may name each table and column of a schema to them."""
+    tables, columns, all_columns, numeric, rendered = {}, {}, {}, set(), {}
+    for table, names in info['tables'].items():
+        if table.startswith('sqlite_'):
+            continue
+        _add_aliases(tables, table, table)
+        rendered[table] = _identifier(table)
+        columns[table] = {}
+        types = info['column_types'].get(table, {})
+        for column in names:
+            _add_aliases(columns[table], column, column)
+            _add_aliases(all_columns, (table, column), column)
+            rendered[(table, column)] = _identifier(column)
+            if any(marker in (types.get(column) or '').upper() for marker in NUMERIC_TYPE_MARKERS):
+                numeric.add((table, column))
+    return {'tables': tables, 'columns': columns, 'all_columns': all_columns, 'numeric': numeric, 'rendered': rendered}
+
+def get_lexicon(db_path: str) -> dict:
+    info = get_schema_info(db_path)
+    if info['fast_path_lexicon'] is None:
+        info['fast_path_lexicon'] = build_lexicon(info)
+    return info['fast_path_lexicon']
+
+def match_phrase(phrase: str, alias_map: dict) -> list:
+    """Returns [(key, score)] for every name the phrase may refer to, best first."""
+    terms = tokenize(phrase)
+    if not terms:
+        return []
+    variants = [(' '.join(terms), 1.0)]
+    canonical = [SYNONYMS.get(term, term) for term in terms]
+    if canonical != terms:
+        variants.append((' '.join(canonical), SYNONYM_SCORE))
+    scores = {}
+    for variant, variant_score in variants:
+        for key, alias_score in alias_map.get(variant, ()):
+            scores[key] = max(scores.get(key, 0.0), variant_score * alias_score)
+    if not scores:
+        # Only exact misses pay for fuzzy matching (typos, "employes").
+        for variant, variant_score in variants:
+            for alias in difflib.get_close_matches(variant, alias_map.keys(), n=3, cutoff=FUZZY_CUTOFF):
+                similarity = difflib.SequenceMatcher(None, variant, alias).ratio()
+                for key, alias_score in alias_map[alias]:
+                    score = variant_score * alias_score * similarity * FUZZY_SCORE
+                    scores[key] = max(scores.get(key, 0.0), score)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def _pick(candidates: list):
+    """Returns the best (key, score), or (None, 0.0) if there is none or it is ambiguous."""
+    if not candidates or (len(candidates) > 1 and candidates[1][1] >= candidates[0][1] - AMBIGUITY_MARGIN):
+        return None, 0.0
+    return candidates[0]
+
+def _resolve_columns(lexicon: dict, table_phrase, column_phrases: list):
+    """
+    Resolves a table phrase (or None) and column phrases to (table, [columns], score).
+    Without a table phrase, the table is the one holding every column.
+    """
+    if table_phrase:
+        table, score = _pick(match_phrase(table_phrase, lexicon['tables']))
+        if table is None:
+            return None, [], 0.0
+        resolved = []
+        for phrase in column_phrases:
+            column, column_score = _pick(match_phrase(phrase, lexicon['columns'][table]))
+            if column is None:
+                return None, [], 0.0
+            resolved.append(column)
+            score *= column_score
+        return table, resolved, score
+
+    by_table = None
+    for phrase in column_phrases:
+        matches = {}
+        for (table, column), score in match_phrase(phrase, lexicon['all_columns']):
+            if score > matches.get(table, (None, 0.0))[1]:
+                matches[table] = (column, score)
+        by_table = matches if by_table is None else {
+            table: (columns + [matches[table][0]], score * matches[table][1])
+            for table, (columns, score) in by_table.items() if table in matches
+        }
+        if by_table is matches:
+            by_table = {table: ([column], score) for table, (column, score) in matches.items()}
+    ranked = sorted(((table, entry) for table, entry in (by_table or {}).items()), key=lambda item: item[1][1], reverse=True)
+    if ranked and (len(ranked) == 1 or ranked[1][1][1] < ranked[0][1][1] - AMBIGUITY_MARGIN):
+        table, (columns, score) = ranked[0]
+        return table, columns, score
+    # The table may lead the first phrase instead ("the average order total").
+    words = column_phrases[0].split()
+    for split in range(1, len(words)):
+        table, columns, score = _resolve_columns(
+            lexicon, ' '.join(words[:split]), [' '.join(words[split:])] + column_phrases[1:],
+        )
+        if table is not None:
+            return table, columns, score
+    return None, [], 0.0
+
+def _render(lexicon: dict, table: str, columns=()) -> tuple:
+    rendered = lexicon['rendered']
+    return rendered[table], [rendered[(table, column)] for column in columns]
+
+
+def _count(match, lexicon: dict):
+    table, score = _pick(match_phrase(match['table'], lexicon['tables']))
+    if table is None:
+        return None
+    if not match['group']:
+        return f"SELECT COUNT(*) FROM {_render(lexicon, table)[0]}", score
+    group, group_score = _pick(match_phrase(match['group'], lexicon['columns'][table]))
+    if group is None:
+        return None
+    table_sql, (group_sql,) = _render(lexicon, table, [group])
+    return f"SELECT {group_sql}, COUNT(*) FROM {table_sql} GROUP BY {group_sql}", score * group_score
+
+def _aggregate(match, lexicon: dict):
+    function = AGGREGATES[match['agg']]
+    phrases = [match['column']] + ([match['group']] if match['group'] else [])
+    table, columns, score = _resolve_columns(lexicon, match['table'], phrases)
+    if table is None:
+        return None
+    if function in ('AVG', 'SUM') and (table, columns[0]) not in lexicon['numeric']:
+        return None
+    table_sql, columns_sql = _render(lexicon, table, columns)
+    if match['group']:
+        return (
+            f"SELECT {columns_sql[1]}, {function}({columns_sql[0]}) FROM {table_sql} GROUP BY {columns_sql[1]}",
+            score,
+        )
+    return f"SELECT {function}({columns_sql[0]}) FROM {table_sql}", score
+
+def _top(match, lexicon: dict):
+    limit = int(match['n']) if match['n'].isdigit() else NUMBER_WORDS[match['n']]
+    if not 0 < limit <= MAX_LIMIT:
+        return None
+    table, columns, score = _resolve_columns(lexicon, match['table'], [match['column']])
+    if table is None:
+        return None
+    positional = match['direction'] in ('first', 'last')
+    if match['extreme']:
+        # "with the highest Y" ranks by Y; "bottom"/"last" takes the other end.
+        ascending = (match['extreme'] in ('lowest', 'least', 'smallest')) != (match['direction'] in ('bottom', 'last'))
+    elif positional:
+        # "first 5 X by name/hire date" reads the column in its natural (ascending) order.
+        ascending = match['direction'] == 'first'
+    else:
+        ascending = match['direction'] == 'bottom'
+    if not positional and not match['extreme'] and (table, columns[0]) not in lexicon['numeric']:
+        return None  # Whether "top 5 by name" (or by date) means A-Z or Z-A is for the model to judge.
+    table_sql, (column_sql,) = _render(lexicon, table, columns)
+    order = 'ASC' if ascending else 'DESC'
+    return f"SELECT * FROM {table_sql} ORDER BY {column_sql} {order} LIMIT {limit}", score
+
+def _distinct(match, lexicon: dict):
+    table, columns, score = _resolve_columns(lexicon, match['table'], [match['column']])
+    if table is None:
+        return None
+    table_sql, (column_sql,) = _render(lexicon, table, columns)
+    return f"SELECT DISTINCT {column_sql} FROM {table_sql}", score
+
+def _list_columns(match, lexicon: dict):
+    phrases = [phrase for phrase in re.split(r'\s*(?:,|\band\b|&)\s*', match['columns']) if phrase]
+    table, columns, score = _resolve_columns(lexicon, match['table'], phrases)
+    if table is None:
+        return None
+    table_sql, columns_sql = _render(lexicon, table, columns)
+    return f"SELECT {', '.join(columns_sql)} FROM {table_sql}", score
+
+def _list(match, lexicon: dict):
+    table, score = _pick(match_phrase(match['table'], lexicon['tables']))
+    if table is None:
+        return None
+    return f"SELECT * FROM {_render(lexicon, table)[0]}", score
+
+BUILDERS = {
+    'count': _count, 'aggregate': _aggregate, 'top': _top,
+    'distinct': _distinct, 'list_columns': _list_columns, 'list': _list,
+}
+
+
+def normalize_question(question: str) -> str:
+    text = re.sub(r'\s+', ' ', question.strip().lower())
+    text = re.sub(r'[\s?.!]+$', '', text)
+    text = re.sub(r'^(?:please |(?:can|could|would) you )+', '', text)
+    return re.sub(r' please$', '', text)
+
+def translate(question: str, db_path: str):
+    """
+    Translates a simply structured question ("how many X", "list all X", "top N X
+    by Y", "average Y per Z") by template and slot filling against the cached
+    schema. Returns {'sql', 'template', 'confidence'} for the most confident
+    match, or None if no template matches at FAST_PATH_MIN_CONFIDENCE.
+    """
+    try:
+        lexicon = get_lexicon(db_path)
+    except Exception as e:
+        logger.warning("Fast path unavailable: %s", e)
+        return None
+    text = normalize_question(question)
+    best = None
+    for name, pattern in TEMPLATES:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        result = BUILDERS[name](match, lexicon)
+        if result is not None and (best is None or result[1] > best['confidence']):
+            best = {'sql': result[0], 'template': name, 'confidence': round(result[1], 3)}
+    if best is None or best['confidence'] < FAST_PATH_MIN_CONFIDENCE:
+        return None
+    return best
+
+def route(question: str, db_path: str, fingerprint: str, use_cache: bool = True, use_fast_path: bool = True) -> tuple:
+    """
+    Finds SQL for a question without the LLM where possible. Returns (sql, 'cache')
+    for a memoized question, (sql, 'fast_path') for a confident template match,
+    or (None, 'llm') if the question needs the model; the caller then records the
+    LLM route's latency with metrics.record_route().
+    """
+    started = time.perf_counter()
+    if use_cache:
+        sql = question_cache.get_cached_sql(question, fingerprint, db_path)
+        metrics.count_cache('question', sql is not None)
+        if sql is not None:
+            metrics.record_route('cache', time.perf_counter() - started)
+            return sql, 'cache'
+    if use_fast_path and FAST_PATH_ENABLED:
+        with metrics.span('fast_path'):
+            result = translate(question, db_path)
+        if result is not None:
+            logger.debug("Fast path '%s' (confidence %s): %s", result['template'], result['confidence'], result['sql'])
+            metrics.record_route('fast_path', time.perf_counter() - started)
+            return result['sql'], 'fast_path'
+    return None, 'llm'
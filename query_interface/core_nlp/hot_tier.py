@@ -0,0 +1,170 @@
+# query_interface/core_nlp/hot_tier.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+HOT_TIER_ENABLED = getattr(settings, 'LEXIBASE_HOT_TIER_ENABLED', True)
+HOT_TIER_BUDGET_BYTES = getattr(settings, 'LEXIBASE_HOT_TIER_BUDGET_BYTES', 512 * 1024 * 1024)
+HOT_TIER_MAX_DB_BYTES = getattr(settings, 'LEXIBASE_HOT_TIER_MAX_DB_BYTES', 128 * 1024 * 1024)
+# A database is promoted on its Nth connection request (a question makes two or three),
+# so one-off uploads never pay for a copy.
+HOT_TIER_MIN_ACCESSES = getattr(settings, 'LEXIBASE_HOT_TIER_MIN_ACCESSES', 8)
+
+
+def _file_id(db_path: str):
+    stat = os.stat(db_path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class HotDatabase:
+    """
+    An in-memory copy of a database file, loaded with the backup API into a
+    named shared-cache memory database. The holder connection keeps it alive;
+    readers open the same URI, so every pooled connection shares one copy.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.file_id = _file_id(db_path)
+        name = hashlib.sha1(f"{db_path}:{self.file_id}".encode('utf-8')).hexdigest()[:20]
+        self.uri = f"file:lexibase-hot-{name}?mode=memory&cache=shared"
+        self._holder = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        disk = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+        try:
+            disk.backup(self._holder)
+        finally:
+            disk.close()
+        page_count = self._holder.execute("PRAGMA page_count;").fetchone()[0]
+        page_size = self._holder.execute("PRAGMA page_size;").fetchone()[0]
+        self.size = page_count * page_size
+
+    def close(self):
+        # The memory is freed once the last reader connection is closed too.
+        self._holder.close()
+
+
+class HotTier:
+    """
+    Keeps the most recently used, frequently queried databases in memory within a
+    global byte budget, demoting the least recently used back to disk when a new
+    database needs room.
+    """
+
+    def __init__(self, budget_bytes: int, max_db_bytes: int, min_accesses: int):
+        self.budget_bytes = budget_bytes
+        self.max_db_bytes = max_db_bytes
+        self.min_accesses = min_accesses
+        self._resident = OrderedDict()
+        self._accesses = {}
+        # Databases being copied into memory; their size is already counted in resident_bytes.
+        self._loading = set()
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.promotions = 0
+        self.demotions = 0
+
+    def lookup(self, db_path: str):
+        """
+        Returns the HotDatabase serving `db_path`, promoting the file if it has
+        become hot and fits, or None if reads should go to disk. The copy is made
+        outside the lock, so other databases' checkouts never wait for it; reads of
+        `db_path` itself go to disk until it is published.
+        """
+        with self._lock:
+            hot = self._resident.get(db_path)
+            if hot is not None:
+                if hot.file_id == _file_id(db_path):
+                    self._resident.move_to_end(db_path)
+                    self.hits += 1
+                    return hot
+                self._demote(db_path)  # The file changed under us; the copy is stale.
+            self.misses += 1
+            if db_path in self._loading:
+                return None
+            self._accesses[db_path] = self._accesses.get(db_path, 0) + 1
+            if self._accesses[db_path] < self.min_accesses:
+                return None
+            size = os.path.getsize(db_path)
+            if size > min(self.max_db_bytes, self.budget_bytes):
+                return None
+            while self._resident and self.resident_bytes + size > self.budget_bytes:
+                self._demote(next(iter(self._resident)))
+            # Reserve the room now so concurrent promotions respect the budget.
+            self._loading.add(db_path)
+            self.resident_bytes += size
+
+        try:
+            hot = HotDatabase(db_path)
+        except sqlite3.Error as e:
+            logger.error("Could not load %s into memory: %s", db_path, e)
+            hot = None
+
+        with self._lock:
+            self.resident_bytes -= size
+            if db_path not in self._loading:  # Discarded while it was being copied.
+                if hot is not None:
+                    hot.close()
+                return None
+            self._loading.discard(db_path)
+            if hot is None:
+                return None
+            self._resident[db_path] = hot
+            self.resident_bytes += hot.size
+            self.promotions += 1
+            logger.debug("Promoted %s (%s bytes). Resident: %s bytes.", db_path, hot.size, self.resident_bytes)
+            return hot
+
+    def _demote(self, db_path: str):
+        hot = self._resident.pop(db_path)
+        self.resident_bytes -= hot.size
+        self.demotions += 1
+        hot.close()
+        logger.debug("Demoted %s. Resident: %s bytes.", db_path, self.resident_bytes)
+
+    def discard(self, db_path: str):
+        """Forgets a database entirely, e.g. when its session ends."""
+        with self._lock:
+            self._accesses.pop(db_path, None)
+            self._loading.discard(db_path)
+            if db_path in self._resident:
+                self._demote(db_path)
+
+    def is_resident(self, db_path: str) -> bool:
+        with self._lock:
+            return db_path in self._resident
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'databases': len(self._resident),
+                'resident_bytes': self.resident_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'promotions': self.promotions,
+                'demotions': self.demotions,
+            }
+
+
+hot_tier = HotTier(HOT_TIER_BUDGET_BYTES, HOT_TIER_MAX_DB_BYTES, HOT_TIER_MIN_ACCESSES)
+metrics.register(metrics.Gauge(
+    'lexibase_hot_tier_resident_bytes', "Bytes of databases held in memory by the hot tier.", lambda: hot_tier.resident_bytes,
+))
+
+def lookup(db_path: str):
+    return hot_tier.lookup(db_path) if HOT_TIER_ENABLED else None
+
+def get_hot_tier_stats() -> dict:
+    return hot_tier.stats()
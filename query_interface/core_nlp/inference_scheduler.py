@@ -0,0 +1,362 @@
+# query_interface/core_nlp/inference_scheduler.py
+import asyncio
+import contextvars
+import hashlib
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from asgiref.sync import sync_to_async
+from collections import deque
+from concurrent.futures import Future
+from django.conf import settings
+
+from . import llm_handler, metrics
+from .model_pool import ProcessModelBackend, RemoteModelBackend, ThreadModelBackend, cpu_slices
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerBusy(Exception):
+    """Raised when the inference queue is full. `retry_after` is a suggested wait in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"The model is busy. Please retry in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class InferenceTimeout(Exception):
+    """Raised when a job misses its deadline, either while queued or while generating."""
+
+
+class InferenceCancelled(Exception):
+    """Raised when a job is cancelled, e.g. because the client disconnected."""
+
+
+class InferenceJob:
+    """
+    One prompt waiting for (or undergoing) generation. The final SQL or error is
+    delivered through `future`. Streaming jobs also receive every generated token
+    on a thread-safe queue, readable with iter_tokens() or aiter_tokens().
+    """
+
+    _END_OF_STREAM = object()
+
+    def __init__(self, prompt: str, grammar: str, timeout: float, stream: bool = False):
+        self.prompt = prompt
+        self.grammar = grammar
+        # Jobs sharing a prompt prefix (same schema) can be grouped onto one worker.
+        self.prefix_key = hashlib.sha1(llm_handler.split_prompt(prompt)[0].encode('utf-8')).hexdigest()
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + timeout
+        # Metrics recorded by the worker are attributed to the submitting request's trace.
+        self.context = contextvars.copy_context()
+        self.future = Future()
+        # Token counts and stage timings reported by the backend, once generation finishes.
+        self.stats = None
+        self.cancelled = threading.Event()
+        self.tokens = queue.Queue() if stream else None
+        if stream:
+            self.future.add_done_callback(lambda _: self.tokens.put(self._END_OF_STREAM))
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def publish_token(self, text: str):
+        if self.tokens is not None:
+            self.tokens.put(text)
+
+    def iter_tokens(self):
+        """Yields generated tokens until the job finishes (blocking)."""
+        while True:
+            token = self.tokens.get()
+            if token is self._END_OF_STREAM:
+                return
+            yield token
+
+    async def aiter_tokens(self):
+        """Async variant of iter_tokens(); waiting happens off the event loop."""
+        while True:
+            token = await sync_to_async(self.tokens.get, thread_sensitive=False)()
+            if token is self._END_OF_STREAM:
+                return
+            yield token
+
+    def result(self):
+        """
+        Blocks until the job finishes and returns the generated SQL. If the job
+        misses its deadline the waiter gives up and cancels it, so the worker
+        stops generating for a request nobody is waiting on.
+        """
+        try:
+            # The worker enforces the deadline; the extra second only covers hand-off.
+            return self.future.result(timeout=max(0.0, self.deadline - time.monotonic()) + 1.0)
+        except TimeoutError:
+            self.cancel()
+            raise InferenceTimeout("SQL generation exceeded its deadline.") from None
+
+    async def aresult(self):
+        """
+        Async variant of result(). A waiter that is cancelled, e.g. because Django
+        saw the client disconnect, cancels the job as well.
+        """
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(self.future)),
+                timeout=max(0.0, self.deadline - time.monotonic()) + 1.0,
+            )
+        except TimeoutError:
+            self.cancel()
+            raise InferenceTimeout("SQL generation exceeded its deadline.") from None
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+
+class InferenceScheduler:
+    """
+    A bounded queue in front of a fixed number of model workers, so requests never
+    contend on one llama context and excess load is rejected up front.
+
+    With the "thread" backend each worker drives an in-process context (the first
+    reuses the load_model() singleton unless `threads_per_worker` or `context_size`
+    is given). With the "process" backend each worker
+    owns a model process with a pinned thread count. With the "remote" backend
+    each worker forwards jobs to the shared model server. `context_size` overrides
+    LEXIBASE_MODEL_CONTEXT_SIZE for the contexts the workers create. When no other
+    worker is idle, a worker takes up to `group_size` queued jobs that share a prompt
+    prefix and runs them one after another on a context that already holds that
+    prefix. This is not batched decoding: each job still decodes as a single
+    sequence, and the only saving is the prefix restore between jobs.
+    If `warmup_prompt` is given, every worker generates it once after loading its
+    model, before taking jobs; wait_until_ready() waits for that.
+    """
+
+    def __init__(self, workers: int, max_queue: int, default_timeout: float,
+                 backend: str = 'thread', group_size: int = 1, threads_per_worker: int = None,
+                 context_size: int = None, warmup_prompt: str = None):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.backend = backend
+        self.group_size = max(1, group_size)
+        # The load_model() singleton uses every core, so only the default split can share it.
+        self._shares_singleton = threads_per_worker is None and context_size is None
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.context_size = context_size
+        self.warmup_prompt = warmup_prompt
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._backends = []
+        self._stopping = False
+        self._idle = 0
+        self._ready = 0
+        self._start_lock = threading.Lock()
+        self._average_job_seconds = 5.0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping = False
+            self._ready = 0
+            cpu_sets = cpu_slices(self.workers, self.threads_per_worker)
+            for worker_id in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop, args=(worker_id, cpu_sets[worker_id]),
+                    name=f"inference-worker-{worker_id}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, prompt: str, grammar: str = None, timeout: float = None, stream: bool = False) -> InferenceJob:
+        """Queues a prompt for generation, raising SchedulerBusy if the queue is full."""
+        self.start()
+        job = InferenceJob(prompt, grammar, timeout or self.default_timeout, stream)
+        with self._condition:
+            if len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy(self.estimate_wait_seconds())
+            self._pending.append(job)
+            self._condition.notify()
+            logger.debug("Job queued. Queue depth: %s", len(self._pending))
+        return job
+
+    def wait_until_ready(self, timeout: float = None) -> bool:
+        """Starts the workers and waits until each has loaded (and warmed up) its model."""
+        self.start()
+        with self._condition:
+            return self._condition.wait_for(lambda: self._ready >= self.workers, timeout)
+
+    def shutdown(self):
+        """Stops the workers after their current jobs and closes their model backends."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        for backend in self._backends:
+            backend.close()
+        self._threads, self._backends = [], []
+
+    def estimate_wait_seconds(self) -> int:
+        return max(1, math.ceil(len(self._pending) * self._average_job_seconds / self.workers))
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'workers': self.workers,
+                'backend': self.backend,
+                'queue_depth': len(self._pending),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'cancelled': self.cancelled,
+                'average_job_seconds': round(self._average_job_seconds, 3),
+            }
+
+    def _count(self, outcome: str):
+        # Workers finish jobs concurrently, so counters are only updated under the lock.
+        with self._condition:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def _create_backend(self, worker_id: int, cpu_ids):
+        if self.backend == 'process':
+            return ProcessModelBackend(worker_id, self.threads_per_worker, cpu_ids, n_ctx=self.context_size)
+        if self.backend == 'remote':
+            return RemoteModelBackend(worker_id)
+        if worker_id == 0 and self._shares_singleton:
+            llm_handler.load_model()
+            return ThreadModelBackend()
+        return ThreadModelBackend(llm_handler.create_model(n_threads=self.threads_per_worker, n_ctx=self.context_size))
+
+    def _take_jobs(self):
+        """
+        Waits for work and returns the oldest job, plus queued jobs with the same
+        prompt prefix if no other worker is idle and could start on them now. The
+        caller runs them sequentially.
+        """
+        with self._condition:
+            self._idle += 1
+            try:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+            finally:
+                self._idle -= 1
+            if self._stopping:
+                return []
+            jobs = [self._pending.popleft()]
+            if self._idle:
+                return jobs
+            for job in list(self._pending):
+                if len(jobs) >= self.group_size:
+                    break
+                if job.prefix_key == jobs[0].prefix_key:
+                    self._pending.remove(job)
+                    jobs.append(job)
+            return jobs
+
+    def _worker_loop(self, worker_id: int, cpu_ids):
+        load_error = None
+        try:
+            backend = self._create_backend(worker_id, cpu_ids)
+            self._backends.append(backend)
+        except Exception as e:
+            logger.error("Worker %s could not load the model: %s", worker_id, e)
+            backend, load_error = None, e
+        if backend is not None and self.warmup_prompt:
+            try:
+                for _ in backend.stream(self.warmup_prompt):
+                    pass
+            except Exception as e:
+                logger.warning("Worker %s warm-up failed: %s", worker_id, e)
+        with self._condition:
+            self._ready += 1
+            self._condition.notify_all()
+        while True:
+            jobs = self._take_jobs()
+            if not jobs:
+                return
+            if len(jobs) > 1:
+                logger.debug("Worker %s running %s same-prefix jobs in a row.", worker_id, len(jobs))
+            for job in jobs:
+                self._run_job(job, backend, load_error)
+
+    def _run_job(self, job: InferenceJob, backend, load_error=None):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        if load_error is not None:
+            job.future.set_exception(load_error)
+            return
+        if job.cancelled.is_set():
+            self._count('cancelled')
+            job.future.set_exception(InferenceCancelled("The request was cancelled."))
+            return
+        if time.monotonic() > job.deadline:
+            self._count('timed_out')
+            job.future.set_exception(InferenceTimeout("The request expired while waiting for a free model worker."))
+            return
+        started = time.monotonic()
+        job.context.run(metrics.record_span, 'queue_wait', started - job.submitted)
+        events = backend.stream(job.prompt, grammar=job.grammar)
+        try:
+            for kind, value in events:
+                if job.cancelled.is_set():
+                    raise InferenceCancelled("The request was cancelled.")
+                if time.monotonic() > job.deadline:
+                    raise InferenceTimeout("SQL generation exceeded its deadline.")
+                if kind == "sql":
+                    job.future.set_result(value)
+                elif kind == "stats":
+                    job.stats = value
+                    job.context.run(metrics.record_generation, value)
+                else:
+                    job.publish_token(value)
+        except InferenceCancelled as e:
+            self._count('cancelled')
+            logger.debug("Job cancelled after %.2fs.", time.monotonic() - started)
+            job.future.set_exception(e)
+        except InferenceTimeout as e:
+            self._count('timed_out')
+            job.future.set_exception(e)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            with self._condition:
+                self.completed += 1
+                self._average_job_seconds = 0.8 * self._average_job_seconds + 0.2 * (time.monotonic() - started)
+        finally:
+            # Stops generation (and releases the context) if we left the loop early.
+            events.close()
+
+
+scheduler = InferenceScheduler(
+    workers=getattr(settings, 'LEXIBASE_INFERENCE_WORKERS', 1),
+    max_queue=getattr(settings, 'LEXIBASE_INFERENCE_QUEUE_SIZE', 8),
+    default_timeout=getattr(settings, 'LEXIBASE_INFERENCE_TIMEOUT', 120),
+    # In remote startup mode no worker loads a model; they all talk to the model server.
+    backend='remote' if llm_handler.MODEL_STARTUP == 'remote' else getattr(settings, 'LEXIBASE_INFERENCE_BACKEND', 'thread'),
+    group_size=getattr(settings, 'LEXIBASE_INFERENCE_PREFIX_GROUP_SIZE', 4),
+    threads_per_worker=getattr(settings, 'LEXIBASE_MODEL_THREADS_PER_WORKER', None),
+)
+metrics.register(metrics.Gauge(
+    'lexibase_inference_queue_depth', "Jobs waiting for a model worker.", lambda: len(scheduler._pending),
+))
+
+def warm_up():
+    """
+    Starts the workers, and so loads their models, without queuing a job. In lazy
+    startup mode the first page view calls this, so the model is usually ready by
+    the time the first question is submitted.
+    """
+    scheduler.start()
+
+def submit(prompt: str, grammar: str = None, timeout: float = None, stream: bool = False) -> InferenceJob:
+    return scheduler.submit(prompt, grammar=grammar, timeout=timeout, stream=stream)
@@ -1,29 +1,108 @@
-from llama_cpp import Llama
+import contextlib
+import hashlib
+import logging
 import os
+import queue
 import re
+import sqlglot
+import threading
+import time
 from django.conf import settings
 
+from .cache import LRUCache
+from .metrics import METRICS_ENABLED
+
+logger = logging.getLogger(__name__)
+
 llm_instance = None
 
+# 'eager' loads the model in every process at startup, 'lazy' on first use (the
+# first page view starts loading it in the background) and 'remote' never loads
+# it in-process: generation goes to a shared `manage.py run_model_server` process.
+MODEL_STARTUP = getattr(settings, 'LEXIBASE_MODEL_STARTUP', 'lazy')
+MODEL_CONTEXT_SIZE = getattr(settings, 'LEXIBASE_MODEL_CONTEXT_SIZE', 4096)
+
+# Everything before the user turn (system instructions, examples and schema) is
+# identical for every question asked against the same database, so its evaluated
+# KV state is saved and restored instead of being recomputed on each request.
+PROMPT_PREFIX_END_MARKER = "<|user|>"
+
+prefix_cache = LRUCache(
+    max_entries=getattr(settings, 'LEXIBASE_PREFIX_CACHE_ENTRIES', 8),
+    max_bytes=getattr(settings, 'LEXIBASE_PREFIX_CACHE_BYTES', 512 * 1024 * 1024),
+)
+prefix_cache_time_saved = 0.0
+
+# The llama context is stateful (restored prefix + generation), so only one
+# request may drive it at a time.
+llm_lock = threading.Lock()
+
+MAX_GENERATION_TOKENS = 512
+
+# Compiled LlamaGrammar objects, keyed by a hash of the GBNF text.
+grammar_cache = LRUCache(max_entries=getattr(settings, 'LEXIBASE_GRAMMAR_CACHE_ENTRIES', 16))
+
+# Counters for generations cut short once a complete statement was emitted.
+early_stop_stats = {'requests': 0, 'early_stops': 0, 'tokens_generated': 0, 'tokens_saved': 0}
+stats_lock = threading.Lock()
+
+def create_model(n_threads: int = -1, n_ctx: int = None):
+    """
+    Creates a new llama context for the GGUF model. The weights are memory-mapped,
+    so additional contexts share them and only add their own KV cache.
+    """
+    # Imported here so processes that never load the model (management commands,
+    # remote mode) do not pay for importing llama.cpp.
+    from llama_cpp import Llama
+    model_filename = "Phi-3-mini-4k-instruct-q4.gguf"
+    model_path = os.path.join(settings.BASE_DIR, 'query_interface', 'llm_models', model_filename)
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"FATAL: Model file not found at {model_path}")
+    
+    logger.info("Loading model from %s", model_path)
+    model = Llama(
+        model_path=model_path,
+        n_ctx=n_ctx or MODEL_CONTEXT_SIZE,
+        n_gpu_layers=0,
+        n_threads=n_threads,
+        verbose=False
+    )
+    logger.info("Model loading complete.")
+    if getattr(settings, 'LEXIBASE_MODEL_WARMUP', True):
+        warm_up(model)
+    return model
+
+def warm_up(model):
+    """
+    Runs a one-token generation so the memory-mapped weights are paged in and
+    the compute buffers allocated before the first real question arrives.
+    """
+    start = time.perf_counter()
+    model("SELECT", max_tokens=1, echo=False)
+    logger.info("Model warmed up in %.2fs.", time.perf_counter() - start)
+
+_load_lock = threading.Lock()
+
 def load_model():
     """Loads the GGUF model from the filesystem, ensuring it's a singleton."""
     global llm_instance
-    if llm_instance is None:
-        model_filename = "Phi-3-mini-4k-instruct-q4.gguf"
-        model_path = os.path.join(settings.BASE_DIR, 'query_interface', 'llm_models', model_filename)
+    with _load_lock:
+        if llm_instance is None:
+            llm_instance = create_model()
 
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"FATAL: Model file not found at {model_path}")
-        
-        print(f"DEBUG: Attempting to load model from: {model_path}")
-        llm_instance = Llama(
-            model_path=model_path,
-            n_ctx=4096,
-            n_gpu_layers=0,
-            n_threads=-1,
-            verbose=False
-        )
-        print("DEBUG: Model loading complete.")
+def get_model_status() -> dict:
+    return {'startup': MODEL_STARTUP, 'loaded_in_process': llm_instance is not None}
+
+def count_tokens(text: str):
+    """Returns the number of model tokens in `text`, or None if the model is not loaded."""
+    if llm_instance is None:
+        # The model server process itself has the model loaded and never gets here.
+        if MODEL_STARTUP == 'remote':
+            from .model_server import remote_count_tokens
+            return remote_count_tokens(text)
+        return None
+    return len(llm_instance.tokenize(text.encode('utf-8'), add_bos=False, special=True))
 
 def clean_and_extract_sql(raw_text: str) -> str:
     """
@@ -170,28 +249,142 @@ def is_valid_sql_structure(sql_text: str) -> bool:
     
     return False
 
-def generate_sql_from_prompt(prompt: str) -> str:
-    """Sends the prompt to the pre-loaded LLM and returns the cleaned SQL."""
-    print("DEBUG: [LLM Handler] Received prompt. Generating SQL...")
+_SQL_START_RE = re.compile(r'(?:^|\n)[ \t]*(WITH|SELECT)\b', re.IGNORECASE)
 
-    if llm_instance is None:
-        raise Exception("LLM has not been loaded. Please restart the server.")
-    
-    response = llm_instance(
-        prompt,
-        max_tokens=512,
-        stop=["<|end|>"],
-        echo=False
+def is_complete_select(sql_text: str) -> bool:
+    """True if `sql_text` is exactly one SELECT statement that sqlglot can parse."""
+    if not is_valid_sql_structure(sql_text):
+        return False
+    try:
+        parsed = sqlglot.parse(sql_text, read="sqlite")
+    except sqlglot.errors.SqlglotError:
+        return False
+    return len(parsed) == 1 and isinstance(parsed[0], sqlglot.exp.Select)
+
+class SqlBoundaryDetector:
+    """
+    Watches streamed model output and reports the first complete SELECT as soon
+    as its closing boundary (a ';' outside string literals, a blank line or a
+    closing code fence) has been generated, so generation can be aborted there.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._start = None
+        self._pos = 0
+        self._quote = None
+
+    def feed(self, chunk: str):
+        """Adds a chunk of output; returns the complete statement once one is closed, else None."""
+        self.text += chunk
+        if self._start is None:
+            match = _SQL_START_RE.search(self.text)
+            if match is None:
+                return None
+            self._start = self._pos = match.start(1)
+
+        text = self.text
+        while self._pos < len(text):
+            i = self._pos
+            char = text[i]
+            # Multi-character boundaries need lookahead; wait for the next chunk.
+            if char in '\n`' and i + 3 > len(text):
+                return None
+            self._pos += 1
+            if self._quote:
+                if char == self._quote:
+                    self._quote = None
+            elif char in '\'"':
+                self._quote = char
+            elif char == ';' or text.startswith('\n\n', i) or text.startswith('```', i):
+                candidate = text[self._start:i].strip()
+                if is_complete_select(candidate):
+                    return candidate
+        return None
+
+def get_generation_stats() -> dict:
+    """Returns early-termination counters: requests, early stops, tokens generated and saved."""
+    return dict(early_stop_stats)
+
+def split_prompt(prompt: str):
+    """Splits a prompt into its reusable prefix and the per-question suffix."""
+    marker_index = prompt.rfind(PROMPT_PREFIX_END_MARKER)
+    if marker_index <= 0:
+        return "", prompt
+    return prompt[:marker_index], prompt[marker_index:]
+
+def _context_holds(llm, tokens) -> bool:
+    """Whether the context's evaluated tokens start with `tokens`."""
+    input_ids = getattr(llm, 'input_ids', None)
+    if input_ids is None or llm.n_tokens < len(tokens):
+        return False
+    return list(input_ids[:len(tokens)]) == list(tokens)
+
+def restore_prompt_prefix(llm, prefix: str):
+    """
+    Puts the evaluated KV state of `prefix` into the llama context, either by
+    restoring a saved state or by evaluating the prefix and saving the result.
+    The completion call that follows then only evaluates the tokens after it.
+    Returns whether the prefix cache was hit, or None if it was not consulted.
+    """
+    global prefix_cache_time_saved
+    if not prefix or not getattr(settings, 'LEXIBASE_PREFIX_CACHE_ENABLED', True):
+        return None
+
+    key = hashlib.sha1(prefix.encode('utf-8')).hexdigest()
+    entry = prefix_cache.get(key)
+    if entry is not None:
+        start = time.perf_counter()
+        # Consecutive jobs on one context usually share the prefix; llama_cpp then
+        # reuses the tokens already evaluated and only trims what came after them.
+        if not _context_holds(llm, entry['tokens']):
+            llm.load_state(entry['state'])
+        restore_seconds = time.perf_counter() - start
+        saved = max(0.0, entry['eval_seconds'] - restore_seconds)
+        with stats_lock:
+            prefix_cache_time_saved += saved
+        logger.debug("Prefix cache hit (%s tokens, saved %.2fs).", entry['n_tokens'], saved)
+        return True
+
+    start = time.perf_counter()
+    prefix_tokens = llm.tokenize(prefix.encode('utf-8'), add_bos=True, special=True)
+    llm.reset()
+    llm.eval(prefix_tokens)
+    eval_seconds = time.perf_counter() - start
+    state = llm.save_state()
+    stored = prefix_cache.put(
+        key,
+        {'state': state, 'eval_seconds': eval_seconds, 'n_tokens': len(prefix_tokens), 'tokens': prefix_tokens},
+        size=state.llama_state_size,
     )
+    logger.debug("Prefix cache miss (%s tokens evaluated in %.2fs, stored=%s).", len(prefix_tokens), eval_seconds, stored)
+    return False
+
+def get_prefix_cache_stats() -> dict:
+    """Returns hit/miss counters, memory use and cumulative time saved by the prefix cache."""
+    stats = prefix_cache.stats()
+    stats['time_saved_seconds'] = round(prefix_cache_time_saved, 3)
+    return stats
 
-    raw_output = response['choices'][0]['text'].strip()
-    print(f"DEBUG: [LLM Handler] Raw output from model: '{raw_output}'")
+def compile_grammar(grammar_text: str):
+    """Returns a compiled LlamaGrammar for GBNF text, reusing earlier compilations."""
+    from llama_cpp import LlamaGrammar
+    key = hashlib.sha1(grammar_text.encode('utf-8')).hexdigest()
+    grammar = grammar_cache.get(key)
+    if grammar is None:
+        grammar = LlamaGrammar.from_string(grammar_text, verbose=False)
+        grammar_cache.put(key, grammar)
+    return grammar
+
+def extract_final_sql(raw_output: str) -> str:
+    """Turns raw model output into the final SQL string, raising if none can be found."""
+    logger.debug("Raw output from model: '%s'", raw_output)
 
     # Extract and clean the SQL
     final_sql = clean_and_extract_sql(raw_output)
     
     if not final_sql:
-        print("WARNING: [LLM Handler] No valid SQL found in response, attempting fallback...")
+        logger.warning("No valid SQL found in response, attempting fallback...")
         # Last resort: try to find any SELECT statement
         lines = raw_output.split('\n')
         for line in lines:
@@ -199,9 +392,143 @@ def generate_sql_from_prompt(prompt: str) -> str:
                 final_sql = line.strip()
                 break
     
-    print(f"DEBUG: [LLM Handler] Final cleaned SQL: '{final_sql}'")
+    logger.debug("Final cleaned SQL: '%s'", final_sql)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Prefix cache stats: %s", get_prefix_cache_stats())
     
     if not final_sql:
         raise Exception("Could not extract valid SQL from LLM response")
     
-    return final_sql
\ No newline at end of file
+    return final_sql
+
+def stream_sql_from_prompt(prompt: str, grammar: str = None, llm=None):
+    """
+    Streams generation for the prompt. Yields ("token", text) for every chunk
+    as the model produces it, then one ("stats", dict) event with token counts
+    and stage timings, then a single ("sql", final_sql) event.
+    If a GBNF `grammar` is given, decoding is constrained to it. `llm` selects a
+    context owned exclusively by the caller; by default the shared singleton is
+    used under `llm_lock`.
+    """
+    logger.debug("Received prompt. Streaming SQL generation...")
+
+    if llm is not None:
+        yield from _stream_sql(llm, prompt, grammar, contextlib.nullcontext())
+        return
+    if llm_instance is None:
+        raise Exception("LLM has not been loaded. Please restart the server.")
+    yield from _stream_sql_on_shared_model(prompt, grammar)
+
+_GENERATION_FAILED = object()
+
+def _stream_sql_on_shared_model(prompt: str, grammar: str = None):
+    """
+    Generates on the singleton in a separate thread that holds `llm_lock` only
+    while the model runs, and yields its events from a queue, so a slow consumer
+    never keeps other requests from the model. Closing the generator stops generation.
+    """
+    events = queue.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        generation = _stream_sql(llm_instance, prompt, grammar, llm_lock)
+        try:
+            for event in generation:
+                if stopped.is_set():
+                    break
+                events.put(event)
+        except Exception as e:
+            events.put((_GENERATION_FAILED, e))
+        finally:
+            generation.close()
+            events.put(None)
+
+    threading.Thread(target=produce, name='llm-generation', daemon=True).start()
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            if event[0] is _GENERATION_FAILED:
+                raise event[1]
+            yield event
+    finally:
+        stopped.set()
+
+def _stream_sql(llm, prompt: str, grammar: str, context_lock):
+    prefix, _ = split_prompt(prompt)
+    detector = SqlBoundaryDetector() if getattr(settings, 'LEXIBASE_EARLY_STOP_ENABLED', True) else None
+    early_sql = None
+    tokens_generated = 0
+    # Held while the model runs; closing the generator releases it.
+    with context_lock:
+        started = time.perf_counter()
+        first_token_at = None
+        prefix_cache_hit = restore_prompt_prefix(llm, prefix)
+        # The full prompt is passed; llama_cpp skips the tokens already in the context.
+        completion = llm(
+            prompt,
+            max_tokens=MAX_GENERATION_TOKENS,
+            stop=["<|end|>"],
+            echo=False,
+            stream=True,
+            grammar=compile_grammar(grammar) if grammar else None
+        )
+        chunks = []
+        try:
+            for chunk in completion:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                text = chunk['choices'][0]['text']
+                tokens_generated += 1
+                chunks.append(text)
+                yield "token", text
+                if detector is not None:
+                    early_sql = detector.feed(text)
+                    if early_sql:
+                        break
+        finally:
+            completion.close()
+        finished_at = time.perf_counter()
+        first_token_at = first_token_at or finished_at
+        prompt_tokens = None
+        if METRICS_ENABLED:
+            # Done after generation, so it never delays the first token.
+            prompt_tokens = len(llm.tokenize(prompt.encode('utf-8'), add_bos=True, special=True))
+
+    # The remaining budget is an upper bound: the model might have stopped on its own sooner.
+    tokens_saved = MAX_GENERATION_TOKENS - tokens_generated if early_sql else 0
+    with stats_lock:
+        early_stop_stats['requests'] += 1
+        early_stop_stats['tokens_generated'] += tokens_generated
+        if early_sql:
+            early_stop_stats['early_stops'] += 1
+            early_stop_stats['tokens_saved'] += tokens_saved
+    if early_sql:
+        logger.debug("Complete SELECT after %s tokens; stopped early, saved up to %s tokens.", tokens_generated, tokens_saved)
+        sql = re.sub(r';\s*$', '', early_sql)
+    else:
+        raw_output = "".join(chunks).strip()
+        constrained_sql = re.sub(r';\s*$', '', raw_output) if grammar else ""
+        # Grammar-constrained output is already pure SQL unless it ran out of tokens mid-statement.
+        if constrained_sql and is_complete_select(constrained_sql):
+            sql = constrained_sql
+        else:
+            sql = extract_final_sql(raw_output)
+    # Plain data, so model processes and the model server can send it back over their pipes.
+    yield "stats", {
+        'prompt_tokens': prompt_tokens,
+        'generated_tokens': tokens_generated,
+        'prompt_seconds': first_token_at - started,
+        'generation_seconds': finished_at - first_token_at,
+        'extraction_seconds': time.perf_counter() - finished_at,
+        'prefix_cache_hit': prefix_cache_hit,
+        'early_stop': bool(early_sql),
+    }
+    yield "sql", sql
+
+def generate_sql_from_prompt(prompt: str, grammar: str = None) -> str:
+    """Sends the prompt to the pre-loaded LLM and returns the cleaned SQL."""
+    for kind, value in stream_sql_from_prompt(prompt, grammar=grammar):
+        if kind == "sql":
+            return value
@@ -0,0 +1,237 @@
+# query_interface/core_nlp/metrics.py
+import bisect
+import contextlib
+import contextvars
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = getattr(settings, 'LEXIBASE_METRICS_ENABLED', True)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+# Cache and fast-path answers take microseconds, so routes need finer low buckets.
+ROUTE_BUCKETS = (0.00001, 0.0001, 0.0005) + LATENCY_BUCKETS
+
+
+def _format_labels(labelnames, values, extra=()) -> str:
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label combination."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations per label combination."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            # Buckets are stored non-cumulatively and summed on export.
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(bound))])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {entry[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(float(entry[-2]))}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {entry[-1]}"
+
+
+class Gauge:
+    """A value read from a callback (e.g. a queue depth) each time metrics are exported."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning("Could not read gauge %s: %s", self.name, e)
+            return
+        yield f"{self.name} {_format_value(value)}"
+
+
+_registry = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render() -> str:
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = register(Histogram(
+    'lexibase_stage_seconds', "Time spent in each stage of the NL-to-SQL pipeline.", ['stage'],
+))
+PROMPT_TOKENS = register(Histogram(
+    'lexibase_prompt_tokens', "Tokens in each prompt sent to the model.", buckets=TOKEN_BUCKETS,
+))
+GENERATED_TOKENS = register(Histogram(
+    'lexibase_generated_tokens', "Tokens generated per SQL generation.", buckets=TOKEN_BUCKETS,
+))
+TOKENS_PER_SECOND = register(Histogram(
+    'lexibase_generation_tokens_per_second', "Decoding speed of each SQL generation.", buckets=RATE_BUCKETS,
+))
+RESULT_ROWS = register(Histogram(
+    'lexibase_result_rows', "Rows returned per executed result page.", buckets=ROW_BUCKETS,
+))
+CACHE_REQUESTS = register(Counter(
+    'lexibase_cache_requests_total', "Cache lookups by cache and outcome (hit or miss).", ['cache', 'result'],
+))
+REQUESTS = register(Counter(
+    'lexibase_requests_total', "NL-to-SQL requests by endpoint and outcome.", ['endpoint', 'outcome'],
+))
+ROUTES = register(Counter(
+    'lexibase_routes_total', "Questions answered per route (cache, fast_path or llm).", ['route'],
+))
+ROUTE_SECONDS = register(Histogram(
+    'lexibase_route_seconds', "Seconds from question to SQL, per route.", ['route'], buckets=ROUTE_BUCKETS,
+))
+
+_trace = contextvars.ContextVar('lexibase_trace', default=None)
+
+@contextlib.contextmanager
+def trace(endpoint: str):
+    """
+    Collects the spans of one request and logs them as a single line at INFO
+    level when the request finishes; the whole request is itself a span.
+    """
+    spans = {}
+    token = _trace.set(spans)
+    start = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+        elapsed = time.perf_counter() - start
+        if METRICS_ENABLED:
+            STAGE_SECONDS.observe(elapsed, stage=f'{endpoint}_request')
+        if logger.isEnabledFor(logging.INFO):
+            timings = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in spans.items())
+            logger.info("%s request took %.1fms: %s", endpoint, elapsed * 1000, timings)
+
+def record_span(stage: str, seconds: float):
+    """Records a stage duration measured elsewhere (e.g. in a model process)."""
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = _trace.get()
+    if spans is not None:
+        spans[stage] = spans.get(stage, 0.0) + seconds
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Times the enclosed block as one stage of the pipeline."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+def record_rows(count: int):
+    if METRICS_ENABLED:
+        RESULT_ROWS.observe(count)
+
+def count_request(endpoint: str, outcome: str):
+    if METRICS_ENABLED:
+        REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+
+def count_cache(cache: str, hit: bool):
+    if METRICS_ENABLED:
+        CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+def record_route(route: str, seconds: float):
+    """Records which route produced a question's SQL and how long it took."""
+    if METRICS_ENABLED:
+        ROUTES.inc(route=route)
+        ROUTE_SECONDS.observe(seconds, route=route)
+
+def record_generation(stats: dict):
+    """Records the statistics a model backend reports for one generation."""
+    record_span('prompt_eval', stats['prompt_seconds'])
+    record_span('generation', stats['generation_seconds'])
+    record_span('sql_extraction', stats['extraction_seconds'])
+    if stats.get('prefix_cache_hit') is not None:
+        count_cache('prefix', stats['prefix_cache_hit'])
+    if not METRICS_ENABLED:
+        return
+    if stats.get('prompt_tokens') is not None:
+        PROMPT_TOKENS.observe(stats['prompt_tokens'])
+    GENERATED_TOKENS.observe(stats['generated_tokens'])
+    if stats['generation_seconds'] > 0:
+        TOKENS_PER_SECOND.observe(stats['generated_tokens'] / stats['generation_seconds'])
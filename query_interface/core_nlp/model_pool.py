@@ -0,0 +1,163 @@
+# query_interface/core_nlp/model_pool.py
+import logging
+import multiprocessing
+import os
+
+from . import llm_handler, model_server
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadModelBackend:
+    """Runs generation in the calling thread on an in-process llama context."""
+
+    def __init__(self, llm=None):
+        # None means the shared llm_handler singleton, used under llm_handler.llm_lock.
+        self.llm = llm
+
+    def stream(self, prompt: str, grammar: str = None):
+        return llm_handler.stream_sql_from_prompt(prompt, grammar=grammar, llm=self.llm)
+
+    def close(self):
+        pass
+
+
+def _model_process_main(conn, cancel_event, n_threads: int, cpu_ids, n_ctx: int = None):
+    """Entry point of a model process: load one context, then serve prompts from the pipe."""
+    if cpu_ids and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpu_ids)
+    try:
+        model = llm_handler.create_model(n_threads=n_threads, n_ctx=n_ctx)
+    except Exception as e:
+        conn.send(('error', f"Could not load model: {e}"))
+        return
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        prompt, grammar = request
+        events = llm_handler.stream_sql_from_prompt(prompt, grammar=grammar, llm=model)
+        try:
+            for kind, value in events:
+                if cancel_event.is_set():
+                    conn.send(('cancelled', None))
+                    break
+                conn.send((kind, value))
+        except Exception as e:
+            conn.send(('error', str(e)))
+        finally:
+            events.close()
+
+
+class ProcessModelBackend:
+    """
+    A model context in a dedicated process with a fixed thread count, optionally
+    pinned to a set of CPUs. The GGUF weights are memory-mapped, so all processes
+    share one copy of them in the page cache.
+    """
+
+    def __init__(self, worker_id: int, n_threads: int, cpu_ids=None, n_ctx: int = None):
+        context = multiprocessing.get_context('spawn')
+        self._conn, child_conn = context.Pipe()
+        self._cancel = context.Event()
+        self.process = context.Process(
+            target=_model_process_main,
+            args=(child_conn, self._cancel, n_threads, cpu_ids, n_ctx),
+            name=f"model-process-{worker_id}",
+            daemon=True,
+        )
+        self.process.start()
+        kind, value = self._conn.recv()
+        if kind == 'error':
+            raise RuntimeError(value)
+        logger.debug("Worker %s ready (pid %s, %s threads, cpus %s).", worker_id, value, n_threads, cpu_ids)
+
+    def stream(self, prompt: str, grammar: str = None):
+        self._cancel.clear()
+        self._conn.send((prompt, grammar))
+        finished = False
+        try:
+            while True:
+                kind, value = self._conn.recv()
+                if kind == 'error':
+                    finished = True
+                    raise Exception(value)
+                if kind in ('sql', 'cancelled'):
+                    finished = True
+                if kind != 'cancelled':
+                    yield kind, value
+                if finished:
+                    return
+        finally:
+            if not finished:
+                # The consumer stopped early: stop the child and drain its remaining events.
+                self._cancel.set()
+                while self._conn.recv()[0] not in ('sql', 'cancelled', 'error'):
+                    pass
+
+    def close(self):
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class RemoteModelBackend:
+    """
+    Sends prompts to the shared model server (`manage.py run_model_server`) over
+    its Unix socket, so Django workers do not load a model of their own. The
+    connection is opened on first use and re-opened after the server restarts.
+    """
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self._conn = None
+
+    def stream(self, prompt: str, grammar: str = None):
+        if self._conn is None:
+            self._conn = model_server.connect()
+        finished = False
+        try:
+            self._conn.send(('generate', prompt, grammar))
+            while True:
+                kind, value = self._conn.recv()
+                if kind == 'error':
+                    finished = True
+                    raise Exception(value)
+                if kind in ('sql', 'cancelled'):
+                    finished = True
+                if kind != 'cancelled':
+                    yield kind, value
+                if finished:
+                    return
+        except (OSError, EOFError) as e:
+            self.close()
+            finished = True
+            raise model_server.ModelServerUnavailable(f"Lost the connection to the model server: {e}") from e
+        finally:
+            if not finished:
+                # The consumer stopped early: tell the server and drain its remaining events.
+                self._conn.send(('cancel',))
+                while self._conn.recv()[0] not in ('sql', 'cancelled', 'error'):
+                    pass
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def cpu_slices(workers: int, threads_per_worker: int):
+    """Splits the CPUs available to this process into one contiguous slice per worker."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if len(cpus) < workers * threads_per_worker:
+        return [None] * workers  # Oversubscribed: let the OS schedule.
+    return [set(cpus[i * threads_per_worker:(i + 1) * threads_per_worker]) for i in range(workers)]
@@ -0,0 +1,107 @@
+# query_interface/core_nlp/model_server.py
+import hashlib
+import logging
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from multiprocessing import AuthenticationError
+from django.conf import settings
+
+from . import llm_handler
+
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = str(getattr(settings, 'LEXIBASE_MODEL_SOCKET', os.path.join(settings.BASE_DIR, 'lexibase-model.sock')))
+
+
+class ModelServerUnavailable(Exception):
+    """Raised when the model server socket cannot be reached."""
+
+
+def _authkey() -> bytes:
+    # Only processes configured with this project's secret key may use the model.
+    return hashlib.sha256(f"lexibase-model-server:{settings.SECRET_KEY}".encode('utf-8')).digest()
+
+def connect(socket_path: str = None):
+    """Opens a connection to the model server, raising ModelServerUnavailable if it is not running."""
+    socket_path = socket_path or SOCKET_PATH
+    try:
+        return Client(socket_path, family='AF_UNIX', authkey=_authkey())
+    except (OSError, EOFError, AuthenticationError) as e:
+        raise ModelServerUnavailable(
+            f"The model server is not reachable at {socket_path} (start it with `manage.py run_model_server`): {e}"
+        ) from e
+
+def remote_count_tokens(text: str):
+    """Counts tokens with the server's model; returns None if the server is unavailable."""
+    try:
+        conn = connect()
+    except ModelServerUnavailable:
+        return None
+    try:
+        conn.send(('count_tokens', text))
+        return conn.recv()[1]
+    except (OSError, EOFError):
+        return None
+    finally:
+        conn.close()
+
+def _generate(conn, prompt: str, grammar: str):
+    """Streams one generation to a client, stopping if it sends ('cancel',)."""
+    events = llm_handler.stream_sql_from_prompt(prompt, grammar=grammar)
+    try:
+        for kind, value in events:
+            if conn.poll() and conn.recv()[0] == 'cancel':
+                conn.send(('cancelled', None))
+                return
+            conn.send((kind, value))
+    except (OSError, EOFError):
+        raise  # The client is gone; _serve_client closes the connection.
+    except Exception as e:
+        conn.send(('error', str(e)))
+    finally:
+        events.close()
+
+def _serve_client(conn):
+    try:
+        while True:
+            request = conn.recv()
+            if request[0] == 'generate':
+                _generate(conn, request[1], request[2])
+            elif request[0] == 'count_tokens':
+                conn.send(('count', llm_handler.count_tokens(request[1])))
+            # A 'cancel' that arrives after its generation finished is ignored.
+    except (OSError, EOFError):
+        pass  # The client went away.
+    finally:
+        conn.close()
+
+def serve(socket_path: str = None):
+    """
+    Loads the model once and serves generation requests from any number of Django
+    worker processes over a Unix socket. Requests run one at a time on the shared
+    context (under llm_handler.llm_lock), so the prefix cache is shared as well.
+    """
+    socket_path = socket_path or SOCKET_PATH
+    llm_handler.load_model()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # Left behind by a server that did not shut down cleanly.
+    listener = Listener(socket_path, family='AF_UNIX', authkey=_authkey())
+    os.chmod(socket_path, 0o600)
+    logger.info("Listening on %s", socket_path)
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError) as e:
+                logger.warning("Rejected a connection: %s", e)
+                continue
+            except OSError as e:
+                # E.g. out of file descriptors; back off instead of spinning on accept().
+                logger.error("Could not accept a connection: %s", e)
+                time.sleep(1)
+                continue
+            threading.Thread(target=_serve_client, args=(conn,), name='model-server-client', daemon=True).start()
+    finally:
+        listener.close()
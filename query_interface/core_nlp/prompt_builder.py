@@ -1,33 +1,128 @@
 # query_interface/core_nlp/prompt_builder.py
-import sqlite3
+import logging
+from django.conf import settings
 
-def get_schema_representation(db_path: str) -> str:
-    print(f"DEBUG: [Prompt Builder] Reading schema from DB at: {db_path}")
+from .cache import LRUCache
+from .db_fingerprint import get_db_fingerprint, quote_identifier
+from .db_pool import connection
+from .sql_grammar import build_select_grammar
+from . import db_profile, schema_index
+
+logger = logging.getLogger(__name__)
+
+# Process-wide schema cache keyed by the database fingerprint. A hit costs one
+# stat() and a header read; SQLite is only opened when the file has changed.
+schema_cache = LRUCache(max_entries=getattr(settings, 'LEXIBASE_SCHEMA_CACHE_ENTRIES', 64))
+
+def _read_schema(db_path: str, fingerprint: str) -> dict:
+    with connection(db_path) as con:
+        cursor = con.cursor()
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+        create_statements = cursor.fetchall()
+        tables = {}
+        column_types = {}
+        for name, _ in create_statements:
+            cursor.execute(f"PRAGMA table_info({quote_identifier(name)});")
+            columns = cursor.fetchall()
+            tables[name] = [column[1] for column in columns]
+            column_types[name] = {column[1]: column[2] for column in columns}
+        cursor.close()
+    return {
+        'fingerprint': fingerprint,
+        'schema_sql': "\n".join([statement[1] for statement in create_statements if statement[1]]),
+        'tables': tables,
+        'column_types': column_types,
+        'token_count': None,
+        'grammar': None,
+        'fast_path_lexicon': None,
+    }
+
+def get_schema_info(db_path: str) -> dict:
+    """
+    Returns the cached schema artifacts for a database: its fingerprint, the
+    rendered CREATE TABLE text, the column names and declared types per table and
+    (once the model is loaded) the token count of the rendered schema.
+    """
+    fingerprint = get_db_fingerprint(db_path)
+    info = schema_cache.get(fingerprint)
+    if info is None:
+        logger.debug("Schema cache miss. Reading schema from DB at: %s", db_path)
+        info = _read_schema(db_path, fingerprint)
+        schema_cache.put(fingerprint, info)
+    if info['token_count'] is None:
+        from .llm_handler import count_tokens
+        info['token_count'] = count_tokens(info['schema_sql'])
+    return info
+
+def get_schema_representation(db_path: str, user_query: str = None) -> str:
+    """
+    Returns the CREATE TABLE statements for the prompt. When the full schema does
+    not fit LEXIBASE_SCHEMA_TOKEN_BUDGET, only the tables most relevant to
+    `user_query` (and their foreign-key neighbors) are included.
+    """
+    logger.debug("Getting schema for DB at: %s", db_path)
     if not db_path:
         return "-- No database provided --"
     try:
-        con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
-        cursor = con.cursor()
-        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table';")
-        create_statements = cursor.fetchall()
-        con.close()
-        schema_sql = "\n".join([statement[0] for statement in create_statements if statement[0]])
-        print("DEBUG: [Prompt Builder] Schema generation successful.")
-        return schema_sql
+        info = get_schema_info(db_path)
+        token_budget = getattr(settings, 'LEXIBASE_SCHEMA_TOKEN_BUDGET', 2048)
+        schema_tokens = info['token_count']
+        if schema_tokens is None:
+            schema_tokens = schema_index.estimate_tokens(info['schema_sql'])
+        if user_query and schema_tokens > token_budget:
+            # Keeping the full schema when it fits preserves the reusable prompt prefix.
+            logger.debug("Schema (%s tokens) exceeds budget. Retrieving relevant tables.", schema_tokens)
+            index = schema_index.build_schema_index(db_path)
+            return schema_index.select_relevant_schema(
+                index, user_query, getattr(settings, 'LEXIBASE_SCHEMA_TOP_K', 8), token_budget
+            )
+        logger.debug("Schema ready (%s tokens).", schema_tokens)
+        return info['schema_sql']
     except Exception as e:
-        print(f"ERROR: [Prompt Builder] Failed to read schema: {e}")
+        logger.error("Failed to read schema: %s", e)
         return f"-- Error reading database schema: {e} --"
 
+def get_sql_grammar(db_path: str):
+    """
+    Returns the GBNF grammar for constrained decoding against this database, or
+    None when grammar mode (LEXIBASE_GRAMMAR_ENABLED) is off.
+    """
+    if not db_path or not getattr(settings, 'LEXIBASE_GRAMMAR_ENABLED', False):
+        return None
+    info = get_schema_info(db_path)
+    if info['grammar'] is None:
+        info['grammar'] = build_select_grammar(info['tables'])
+    return info['grammar']
+
+def get_value_hints(db_path: str, user_query: str) -> str:
+    """Returns the profiled column values relevant to the question, as a prompt section ('' if none)."""
+    if not db_path:
+        return ""
+    try:
+        hints = db_profile.describe_relevant_values(db_path, user_query)
+    except Exception as e:
+        logger.error("Failed to read database profile: %s", e)
+        return ""
+    return f"{hints}\n" if hints else ""
+
 def create_text_to_sql_prompt(user_query: str, db_path: str) -> str:
-    print("DEBUG: [Prompt Builder] Creating advanced prompt...")
-    schema = get_schema_representation(db_path)
+    logger.debug("Creating advanced prompt...")
+    schema = get_schema_representation(db_path, user_query)
+    # The hints depend on the question, so they follow the reusable prefix (see llm_handler.split_prompt).
+    value_hints = get_value_hints(db_path, user_query)
+    # The decoding grammar only admits short names for CTEs, table aliases and column aliases (see sql_grammar).
+    alias_rule = (
+        "\n4.  **Aliases:** Name every CTE, table alias and column alias with one or two lowercase letters and an optional digit"
+        " (e.g. `e`, `oi`, `t1`, `AVG(salary) AS a1`). Only alias a result column when you refer to it again."
+        if getattr(settings, 'LEXIBASE_GRAMMAR_ENABLED', False) else ""
+    )
     prompt = f"""<|system|>
 You are an expert SQLite data analyst. Your task is to convert a user's question into a single, valid, and efficient SQLite query.
 
 **Instructions:**
 1.  **Analyze the question:** First, understand the user's intent. If the question is complex, break it down into smaller, logical steps.
 2.  **Use Common Table Expressions (CTEs):** For any query that requires intermediate steps (like finding a value to use in another part of the query), you MUST use a CTE (`WITH ... AS (...)`). This is crucial for clarity and correctness.
-3.  **Output Only SQL:** Your final output must be ONLY the raw SQL query. Do not include any explanations, comments, or markdown.
+3.  **Output Only SQL:** Your final output must be ONLY the raw SQL query. Do not include any explanations, comments, or markdown.{alias_rule}
 
 **Example of a Complex Query:**
 *   **Question:** "Show me the title of films that have the same length as the film 'ALIEN CENTER'."
@@ -36,15 +131,15 @@ You are an expert SQLite data analyst. Your task is to convert a user's question
     2.  Then, I need to find all other films that have that same length.
     3.  I will use a CTE to store the length from the first step.
 *   **Your Output (the raw SQL):**
-    `WITH film_length AS (SELECT length FROM film WHERE title = 'ALIEN CENTER') SELECT title FROM film, film_length WHERE film.length = film_length.length AND film.title != 'ALIEN CENTER'`
+    `WITH fl AS (SELECT length FROM film WHERE title = 'ALIEN CENTER') SELECT f.title FROM film f, fl WHERE f.length = fl.length AND f.title != 'ALIEN CENTER'`
 
 ---
 **Database Schema:**
 {schema}
 ---<|end|>
 <|user|>
-Here is the user's question: "{user_query}"<|end|>
+{value_hints}Here is the user's question: "{user_query}"<|end|>
 <|assistant|>
 """
-    print("DEBUG: [Prompt Builder] Advanced prompt created.")
+    logger.debug("Advanced prompt created.")
     return prompt
\ No newline at end of file
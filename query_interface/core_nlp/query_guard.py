@@ -0,0 +1,197 @@
+# query_interface/core_nlp/query_guard.py
+import contextlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from django.conf import settings
+
+from .db_fingerprint import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+QUERY_TIME_LIMIT = getattr(settings, 'LEXIBASE_QUERY_TIME_LIMIT', 10)
+QUERY_MAX_VM_STEPS = getattr(settings, 'LEXIBASE_QUERY_MAX_VM_STEPS', 500_000_000)
+EXPORT_TIME_LIMIT = getattr(settings, 'LEXIBASE_EXPORT_TIME_LIMIT', 300)
+PROGRESS_INTERVAL = getattr(settings, 'LEXIBASE_QUERY_PROGRESS_INTERVAL', 10_000)
+# 'reject' refuses queries whose plan is too expensive, 'warn' only reports, 'off' skips the check.
+PLAN_POLICY = getattr(settings, 'LEXIBASE_QUERY_PLAN_POLICY', 'reject')
+SCAN_WARN_ROWS = getattr(settings, 'LEXIBASE_QUERY_SCAN_WARN_ROWS', 1_000_000)
+MAX_PLAN_ROWS = getattr(settings, 'LEXIBASE_QUERY_MAX_PLAN_ROWS', 100_000_000)
+
+_PLAN_LOOP_RE = re.compile(r'^(SCAN|SEARCH) (\S+)')
+_PLAN_MATERIALIZE_RE = re.compile(r'^MATERIALIZE (\S+)')
+
+
+class QueryGuardError(Exception):
+    """Base class for queries stopped by a guardrail rather than by an SQL error."""
+
+
+class QueryBudgetExceeded(QueryGuardError):
+    """Raised when a running query exceeds its wall-clock or VM-step budget."""
+
+
+class QueryTooExpensive(QueryGuardError):
+    """Raised when a query's plan is rejected before it runs."""
+
+
+@contextlib.contextmanager
+def execution_budget(con: sqlite3.Connection, time_limit: float = None, max_steps: int = None,
+                     time_spent: float = 0.0):
+    """
+    Aborts statements run on `con` inside the block once they have used
+    `time_limit` seconds or about `max_steps` VM instructions. The progress handler
+    enforces both while the VM is stepping; a timer interrupt backs up the time
+    limit for long stretches (e.g. sorting) between handler calls. `time_spent`
+    is what earlier blocks of the same statement already used.
+    """
+    if time_limit and time_spent >= time_limit:
+        raise QueryBudgetExceeded(f"The query exceeded its time limit of {time_limit} seconds.")
+    remaining = time_limit - time_spent if time_limit else None
+    deadline = time.monotonic() + remaining if time_limit else None
+    state = {'steps': 0, 'exceeded': None, 'active': True}
+    state_lock = threading.Lock()
+
+    def on_progress():
+        state['steps'] += PROGRESS_INTERVAL
+        if max_steps and state['steps'] > max_steps:
+            state['exceeded'] = f"The query exceeded its budget of {max_steps:,} VM steps."
+            return 1
+        if deadline is not None and time.monotonic() > deadline:
+            state['exceeded'] = f"The query exceeded its time limit of {time_limit} seconds."
+            return 1
+        return 0
+
+    def on_timeout():
+        with state_lock:
+            if state['active']:
+                state['exceeded'] = f"The query exceeded its time limit of {time_limit} seconds."
+                con.interrupt()
+
+    timer = None
+    if deadline is not None:
+        timer = threading.Timer(remaining, on_timeout)
+        timer.daemon = True
+        timer.start()
+    con.set_progress_handler(on_progress, PROGRESS_INTERVAL)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if state['exceeded']:
+            raise QueryBudgetExceeded(state['exceeded']) from e
+        raise
+    finally:
+        with state_lock:
+            state['active'] = False
+        if timer is not None:
+            timer.cancel()
+        # The connection goes back to the pool; the next query gets its own budget.
+        con.set_progress_handler(None, PROGRESS_INTERVAL)
+
+def estimate_table_rows(cursor, table_name: str, row_counts: dict = None):
+    """
+    Estimates a table's row count without scanning it: from `row_counts` (the
+    database profile's exact counts) when given, else from ANALYZE statistics when
+    present, else from the largest rowid (an upper bound that is exact unless rows
+    were deleted). Returns None for views, CTEs and WITHOUT ROWID tables.
+    """
+    if row_counts and table_name in row_counts:
+        return row_counts[table_name]
+    # Reading max(rowid) from a view computes the whole view, so only tables are estimated.
+    if cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE;", (table_name,)
+    ).fetchone() is None:
+        return None
+    try:
+        row = cursor.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? ORDER BY idx IS NOT NULL LIMIT 1;", (table_name,)
+        ).fetchone()
+        if row:
+            return int(row[0].split()[0])
+    except (sqlite3.Error, ValueError):
+        pass  # No ANALYZE statistics in this database.
+    try:
+        row = cursor.execute(f"SELECT max(rowid) FROM {quote_identifier(table_name)};").fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0]
+
+def inspect_query_plan(cursor, sql_string: str, aliases: dict, params=(), row_counts: dict = None,
+                       limit: int = None) -> dict:
+    """
+    Walks EXPLAIN QUERY PLAN for `sql_string` and estimates the rows it will visit.
+    Sibling SCAN/SEARCH nodes are nested loops, so their row counts multiply; a
+    SEARCH counts as one row per outer row. `aliases` maps plan names (aliases)
+    to table names; `row_counts` are known table sizes (see estimate_table_rows).
+    `limit` is the literal LIMIT of a query that streams its rows (see
+    query_rewriter.streamed_row_limit); unless the plan sorts into a temporary
+    B-tree first, the outer loops stop after that many rows.
+    Returns {'estimated_rows', 'warnings'}.
+    """
+    plan = cursor.execute(f"EXPLAIN QUERY PLAN {sql_string}", params).fetchall()
+    if any('USE TEMP B-TREE' in detail for _, _, _, detail in plan):
+        limit = None  # Every row is read before the first one comes out.
+    children = {}
+    for node_id, parent_id, _, detail in plan:
+        children.setdefault(parent_id, []).append((node_id, detail))
+
+    table_rows = {}
+    materialized = {}
+    warnings = []
+
+    def rows_of(name: str):
+        table = aliases.get(name, name)
+        if table in materialized:
+            return materialized[table]
+        if table not in table_rows:
+            table_rows[table] = estimate_table_rows(cursor, table, row_counts)
+        return table_rows[table]
+
+    def subtree_cost(parent_id, cap: int = None) -> int:
+        loop_cost, extra_cost, scans = 1, 0, []
+        for node_id, detail in children.get(parent_id, []):
+            materialize = _PLAN_MATERIALIZE_RE.match(detail)
+            loop = _PLAN_LOOP_RE.match(detail)
+            if materialize:
+                cost = subtree_cost(node_id)
+                materialized[materialize.group(1)] = cost
+                extra_cost += cost
+            elif loop:
+                extra_cost += subtree_cost(node_id)
+                if loop.group(1) == 'SEARCH':
+                    continue
+                name = loop.group(2)
+                rows = rows_of(name) or 1
+                if rows > SCAN_WARN_ROWS:
+                    warnings.append(f"Full scan of {aliases.get(name, name)} (~{rows:,} rows).")
+                if scans and rows > 1:
+                    warnings.append(f"Cartesian product: {name} is scanned once for every row of {scans[-1]}.")
+                scans.append(name)
+                loop_cost *= rows
+            else:
+                extra_cost += subtree_cost(node_id)
+        if cap is not None:
+            loop_cost = min(loop_cost, cap)
+        return loop_cost + extra_cost
+
+    return {'estimated_rows': subtree_cost(0, limit), 'warnings': warnings}
+
+def check_query_plan(cursor, sql_string: str, aliases: dict, params=(), row_counts: dict = None,
+                     limit: int = None) -> list:
+    """
+    Applies the deployment's plan policy to a query before it runs. Returns the
+    plan warnings, or raises QueryTooExpensive when the policy is 'reject' and
+    the estimated number of visited rows exceeds the limit.
+    """
+    if PLAN_POLICY == 'off':
+        return []
+    report = inspect_query_plan(cursor, sql_string, aliases, params, row_counts, limit)
+    estimated_rows = report['estimated_rows']
+    logger.debug("Plan visits ~%d rows. Warnings: %s", estimated_rows, report['warnings'])
+    if PLAN_POLICY == 'reject' and estimated_rows > MAX_PLAN_ROWS:
+        reasons = " ".join(report['warnings'])
+        raise QueryTooExpensive(
+            f"The query would visit about {estimated_rows:,} rows (limit {MAX_PLAN_ROWS:,}). {reasons}".strip()
+        )
+    return report['warnings']
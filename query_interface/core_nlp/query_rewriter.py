@@ -0,0 +1,121 @@
+# query_interface/core_nlp/query_rewriter.py
+import logging
+from django.conf import settings
+from sqlglot import exp
+from sqlglot.optimizer import optimize
+from sqlglot.optimizer.eliminate_ctes import eliminate_ctes
+from sqlglot.optimizer.merge_subqueries import merge_subqueries
+from sqlglot.optimizer.pushdown_predicates import pushdown_predicates
+from sqlglot.optimizer.pushdown_projections import pushdown_projections
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.simplify import simplify
+
+logger = logging.getLogger(__name__)
+
+REWRITE_ENABLED = getattr(settings, 'LEXIBASE_SQL_REWRITE_ENABLED', True)
+
+# Passes that only ever make the statement cheaper for SQLite: expand stars and
+# qualify columns, prune unused subquery/CTE columns, push filters down, inline
+# derived tables, drop unused CTEs and fold constant predicates.
+OPTIMIZER_RULES = (
+    qualify,
+    pushdown_projections,
+    pushdown_predicates,
+    merge_subqueries,
+    eliminate_ctes,
+    simplify,
+)
+
+def _literal_int(node):
+    """Returns the integer of a LIMIT/OFFSET clause with a literal value, else None."""
+    value = node.expression if node is not None else None
+    if isinstance(value, exp.Literal) and not value.is_string:
+        try:
+            return int(value.this)
+        except ValueError:
+            return None
+    return None
+
+def streamed_row_limit(query):
+    """
+    Returns LIMIT + OFFSET for a query that hands rows out as it finds them (no
+    grouping, DISTINCT, aggregates or window functions) under a literal LIMIT:
+    SQLite stops reading after that many result rows. Else None.
+    """
+    limit, offset = _literal_int(query.args.get('limit')), _literal_int(query.args.get('offset'))
+    if limit is None or limit < 0 or (query.args.get('offset') is not None and offset is None):
+        return None
+    if any(query.args.get(arg) for arg in ('group', 'having', 'distinct')) or query.find(exp.AggFunc, exp.Window):
+        return None
+    return limit + (offset or 0)
+
+def optimize_select(parsed_query, tables: dict):
+    """
+    Runs the optimizer passes over a validated SELECT, using the cached
+    {table: [columns]} schema to expand `SELECT *`. Returns the original
+    expression if the optimizer cannot handle the query.
+    """
+    if not REWRITE_ENABLED:
+        return parsed_query
+    # Column types only matter for type annotation, which is not one of the passes.
+    schema = {table: {column: 'TEXT' for column in columns} for table, columns in tables.items()}
+    try:
+        optimized = optimize(parsed_query, schema=schema, dialect="sqlite", rules=OPTIMIZER_RULES)
+    except Exception as e:
+        logger.debug("Optimizer skipped: %s", e)
+        return parsed_query
+    return optimized if isinstance(optimized, exp.Select) else parsed_query
+
+def apply_page_limit(query, limit: int, offset: int = 0):
+    """
+    Limits a SELECT to `limit` rows starting `offset` rows into its own result,
+    folding the page into an existing literal LIMIT/OFFSET instead of wrapping it.
+    Returns None when the query's own LIMIT leaves nothing for this page.
+    """
+    own_limit_node, own_offset_node = query.args.get('limit'), query.args.get('offset')
+    own_limit, own_offset = _literal_int(own_limit_node), _literal_int(own_offset_node)
+    if (own_limit_node is not None and own_limit is None) or (own_offset_node is not None and own_offset is None):
+        # A computed LIMIT cannot be folded; page over the query as a subquery instead.
+        query = exp.select('*').from_(query.subquery('page_source'))
+        own_limit, own_offset = None, None
+    else:
+        query = query.copy()
+    if own_limit is not None and own_limit >= 0:  # LIMIT -1 means no limit in SQLite.
+        limit = min(limit, own_limit - offset)
+        if limit <= 0:
+            return None
+    query = query.limit(limit)
+    total_offset = (own_offset or 0) + offset
+    return query.offset(total_offset) if total_offset else query
+
+def push_limit_into_cte(query):
+    """
+    For `WITH c AS (...) SELECT ... FROM c LIMIT n` where the outer query only
+    projects rows of c, limits the CTE body too, so SQLite never materializes
+    rows the outer query would discard.
+    """
+    limit = _literal_int(query.args.get('limit'))
+    offset = _literal_int(query.args.get('offset')) or 0
+    source = query.args.get('from_')
+    if not query.ctes or limit is None or limit < 0 or source is None or not isinstance(source.this, exp.Table):
+        return query
+    if any(query.args.get(arg) for arg in ('joins', 'laterals', 'where', 'group', 'having', 'order', 'distinct')):
+        return query
+    if any(projection.find(exp.AggFunc, exp.Window) for projection in query.expressions):
+        return query
+
+    query = query.copy()
+    name = query.args['from_'].this.name
+    cte = next((cte for cte in query.ctes if cte.alias_or_name == name), None)
+    # Another reference to the CTE might need rows beyond the outer page.
+    if cte is None or sum(1 for table in query.find_all(exp.Table) if table.name == name) != 1:
+        return query
+    body = cte.this
+    if not isinstance(body, exp.Select):
+        return query
+    body_limit_node = body.args.get('limit')
+    body_limit = _literal_int(body_limit_node)
+    if body_limit_node is not None and (body_limit is None or 0 <= body_limit <= limit + offset):
+        return query
+    cte.set('this', body.limit(limit + offset))
+    return query
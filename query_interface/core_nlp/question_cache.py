@@ -0,0 +1,163 @@
+# query_interface/core_nlp/question_cache.py
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+
+from . import db_profile
+from .cache import LRUCache
+from .prompt_builder import get_schema_info
+
+NUMBER_WORDS = {
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+    'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
+    'eleven': '11', 'twelve': '12', 'fifteen': '15', 'twenty': '20',
+    'thirty': '30', 'fifty': '50', 'hundred': '100',
+}
+_NUMBER_WORDS_RE = re.compile(r'\b(' + '|'.join(NUMBER_WORDS) + r')\b')
+# Quoted literals ("Sales", 'ALIEN CENTER') keep their case; apostrophes inside words do not start a quote.
+_QUOTED_RE = re.compile(r'("[^"]*"|(?<!\w)\'[^\']*\'(?!\w))')
+
+memory_cache = LRUCache(
+    max_entries=getattr(settings, 'LEXIBASE_QUESTION_CACHE_ENTRIES', 1024),
+    ttl=getattr(settings, 'LEXIBASE_QUESTION_CACHE_TTL', 24 * 60 * 60),
+)
+# Words naming a table, column or profiled value, per database fingerprint (see case_sensitive_terms).
+terms_cache = LRUCache(max_entries=getattr(settings, 'LEXIBASE_SCHEMA_CACHE_ENTRIES', 64))
+# The disk store is trimmed every PRUNE_EVERY writes rather than on each one.
+PRUNE_EVERY = max(1, getattr(settings, 'LEXIBASE_QUESTION_CACHE_PRUNE_EVERY', 1000))
+_disk_connection = None
+_disk_lock = threading.Lock()
+_disk_writes = 0
+
+def _canonical_number(literal: str) -> str:
+    try:
+        return format(Decimal(literal).normalize(), 'f')
+    except InvalidOperation:
+        return literal
+
+def _normalize_unquoted(text: str, keep_case) -> str:
+    text = re.sub(r'\w+', lambda m: m.group(0) if m.group(0).lower() in keep_case else m.group(0).lower(), text)
+    text = re.sub(r'(?<=\d),(?=\d{3}\b)', '', text)  # 1,000 -> 1000
+    text = _NUMBER_WORDS_RE.sub(lambda m: NUMBER_WORDS[m.group(1)], text)
+    text = re.sub(r'\d+(?:\.\d+)?', lambda m: _canonical_number(m.group(0)), text)
+    text = re.sub(r'(?<!\d)\.|\.(?!\d)', ' ', text)  # keep decimal points only
+    return re.sub(r'[^\w\s.]', ' ', text)
+
+def normalize_question(question: str, keep_case=frozenset()) -> str:
+    """
+    Normalizes a question so trivially different phrasings share a cache entry:
+    case, whitespace, punctuation and the spelling of number literals are
+    canonicalized, while quoted literals are kept verbatim. Words whose
+    lowercase form is in `keep_case` keep their case, since "Sales" and "sales"
+    may be different values in the data.
+    """
+    parts = _QUOTED_RE.split(unicodedata.normalize('NFKC', question))
+    normalized = [part if i % 2 else _normalize_unquoted(part, keep_case) for i, part in enumerate(parts)]
+    return ' '.join(''.join(normalized).split())
+
+def case_sensitive_terms(db_path: str, fingerprint: str) -> frozenset:
+    """
+    Returns the lowercased words of the database's table and column names and
+    of its profiled column values, the words normalize_question keeps the case of.
+    """
+    if not db_path:
+        return frozenset()
+    terms = terms_cache.get(fingerprint)
+    if terms is None:
+        names = []
+        try:
+            for table, columns in get_schema_info(db_path)['tables'].items():
+                names += [table, *columns]
+            profile = db_profile.get_profile(db_path)
+        except (sqlite3.Error, OSError):
+            return frozenset()
+        if profile is not None:
+            for table_profile in profile['tables'].values():
+                for stats in table_profile['columns'].values():
+                    names += [value for value, _ in stats.get('top_values') or []]
+        terms = frozenset(word for name in names for word in re.findall(r'\w+', str(name).lower()))
+        terms_cache.put(fingerprint, terms)
+    return terms
+
+def make_cache_key(question: str, fingerprint: str, keep_case=frozenset()) -> str:
+    return hashlib.sha256(f"{fingerprint}|{normalize_question(question, keep_case)}".encode('utf-8')).hexdigest()
+
+def _expiry_cutoff() -> float:
+    return time.time() - memory_cache.ttl if memory_cache.ttl else 0.0
+
+def _get_disk_connection():
+    """Opens the optional on-disk store (LEXIBASE_QUESTION_CACHE_PATH) on first use."""
+    global _disk_connection
+    path = getattr(settings, 'LEXIBASE_QUESTION_CACHE_PATH', None)
+    if not path:
+        return None
+    if _disk_connection is None:
+        _disk_connection = sqlite3.connect(str(path), check_same_thread=False)
+        _disk_connection.execute(
+            "CREATE TABLE IF NOT EXISTS question_cache ("
+            "key TEXT PRIMARY KEY, sql TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        _disk_connection.execute(
+            "CREATE INDEX IF NOT EXISTS question_cache_created_at ON question_cache (created_at)"
+        )
+        _disk_connection.commit()
+    return _disk_connection
+
+def _prune_disk_store(con):
+    """Drops expired entries and all but the newest LEXIBASE_QUESTION_CACHE_DISK_ENTRIES, walking the created_at index."""
+    con.execute("DELETE FROM question_cache WHERE created_at <= ?", (_expiry_cutoff(),))
+    row = con.execute(
+        "SELECT created_at FROM question_cache ORDER BY created_at DESC LIMIT 1 OFFSET ?",
+        (getattr(settings, 'LEXIBASE_QUESTION_CACHE_DISK_ENTRIES', 100000),),
+    ).fetchone()
+    if row is not None:
+        con.execute("DELETE FROM question_cache WHERE created_at <= ?", (row[0],))
+
+def get_cached_sql(question: str, fingerprint: str, db_path: str = None):
+    """
+    Returns the memoized SQL for a question against a database, or None. With
+    `db_path`, words naming its tables, columns and values keep their case.
+    """
+    if not getattr(settings, 'LEXIBASE_QUESTION_CACHE_ENABLED', True):
+        return None
+    key = make_cache_key(question, fingerprint, case_sensitive_terms(db_path, fingerprint))
+    sql = memory_cache.get(key)
+    if sql is not None:
+        return sql
+
+    with _disk_lock:
+        con = _get_disk_connection()
+        if con is None:
+            return None
+        row = con.execute(
+            "SELECT sql FROM question_cache WHERE key = ? AND created_at > ?",
+            (key, _expiry_cutoff()),
+        ).fetchone()
+    if row is None:
+        return None
+    memory_cache.put(key, row[0])
+    return row[0]
+
+def store_sql(question: str, fingerprint: str, sql: str, db_path: str = None):
+    """Memoizes the SQL generated for a question, in memory and (if configured) on disk."""
+    global _disk_writes
+    if not getattr(settings, 'LEXIBASE_QUESTION_CACHE_ENABLED', True):
+        return
+    key = make_cache_key(question, fingerprint, case_sensitive_terms(db_path, fingerprint))
+    memory_cache.put(key, sql)
+
+    with _disk_lock:
+        con = _get_disk_connection()
+        if con is None:
+            return
+        con.execute("INSERT OR REPLACE INTO question_cache (key, sql, created_at) VALUES (?, ?, ?)", (key, sql, time.time()))
+        # Expired rows are never served (see get_cached_sql), so trimming can wait.
+        if _disk_writes % PRUNE_EVERY == 0:
+            _prune_disk_store(con)
+        _disk_writes += 1
+        con.commit()
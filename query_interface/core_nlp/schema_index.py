@@ -0,0 +1,183 @@
+# query_interface/core_nlp/schema_index.py
+import logging
+import math
+import re
+from collections import Counter
+from django.conf import settings
+
+from .cache import LRUCache
+from .db_fingerprint import get_db_fingerprint, quote_identifier
+from .db_pool import connection
+
+logger = logging.getLogger(__name__)
+
+# Field weights: a question term matching a table name says more than one matching a sample value.
+TABLE_NAME_WEIGHT = 3
+COLUMN_NAME_WEIGHT = 2
+SAMPLE_VALUE_WEIGHT = 1
+SAMPLE_ROWS = 1000
+SAMPLE_VALUES_PER_COLUMN = 50
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'for', 'to', 'by', 'with', 'and', 'or', 'is', 'are',
+    'what', 'which', 'who', 'how', 'many', 'much', 'show', 'me', 'list', 'all', 'give', 'find',
+    'get', 'that', 'have', 'has', 'each', 'per', 'from', 'their', 'there', 'top', 'most', 'do', 'does',
+}
+
+index_cache = LRUCache(max_entries=getattr(settings, 'LEXIBASE_SCHEMA_INDEX_ENTRIES', 32))
+
+def tokenize(text: str) -> list:
+    """Splits identifiers and prose into lowercase terms (snake_case and camelCase aware)."""
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', str(text))
+    terms = []
+    for term in re.findall(r'[a-z0-9]+', text.lower()):
+        if term in STOPWORDS:
+            continue
+        # Crude plural folding so "employees" matches the "employee" table.
+        if len(term) > 4 and term.endswith('ies'):
+            term = term[:-3] + 'y'
+        elif len(term) > 3 and term.endswith('s') and not term.endswith('ss'):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+def estimate_tokens(text: str) -> int:
+    """Counts model tokens when the model is loaded, else estimates ~4 characters per token."""
+    from .llm_handler import count_tokens
+    count = count_tokens(text)
+    return count if count is not None else len(text) // 4 + 1
+
+def _is_text_column(declared_type: str) -> bool:
+    declared_type = (declared_type or '').upper()
+    return not declared_type or any(marker in declared_type for marker in ('CHAR', 'TEXT', 'CLOB'))
+
+def _read_tables(db_path: str) -> dict:
+    with connection(db_path) as con:
+        cursor = con.cursor()
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND sql IS NOT NULL;")
+        tables = {}
+        for name, create_sql in cursor.fetchall():
+            quoted = quote_identifier(name)
+            columns = cursor.execute(f"PRAGMA table_info({quoted});").fetchall()
+            foreign_keys = {row[2] for row in cursor.execute(f"PRAGMA foreign_key_list({quoted});").fetchall()}
+            sample_values = []
+            for column in columns:
+                if not _is_text_column(column[2]):
+                    continue
+                column_name = quote_identifier(column[1])
+                # Sampling a bounded prefix of the table keeps index builds fast on huge tables.
+                cursor.execute(
+                    f"SELECT DISTINCT {column_name} FROM (SELECT {column_name} FROM {quoted} LIMIT ?) "
+                    f"WHERE {column_name} IS NOT NULL LIMIT ?;",
+                    (SAMPLE_ROWS, SAMPLE_VALUES_PER_COLUMN),
+                )
+                sample_values.extend(str(row[0]) for row in cursor.fetchall())
+            tables[name] = {
+                'create_sql': create_sql,
+                'columns': [column[1] for column in columns],
+                'foreign_keys': foreign_keys,
+                'sample_values': sample_values,
+            }
+        cursor.close()
+    return tables
+
+def build_schema_index(db_path: str) -> dict:
+    """
+    Builds (or returns the cached) BM25 index over the tables of a database. Each
+    table is a document made of its name, its column names and sampled text values.
+    """
+    fingerprint = get_db_fingerprint(db_path)
+    index = index_cache.get(fingerprint)
+    if index is not None:
+        return index
+
+    logger.debug("Building schema index for DB at: %s", db_path)
+    tables = _read_tables(db_path)
+    term_frequencies = {}
+    for name, table in tables.items():
+        terms = Counter()
+        for term in tokenize(name):
+            terms[term] += TABLE_NAME_WEIGHT
+        for column in table['columns']:
+            for term in tokenize(column):
+                terms[term] += COLUMN_NAME_WEIGHT
+        for value in table['sample_values']:
+            for term in tokenize(value):
+                terms[term] += SAMPLE_VALUE_WEIGHT
+        term_frequencies[name] = terms
+
+    document_frequency = Counter()
+    for terms in term_frequencies.values():
+        document_frequency.update(terms.keys())
+    n_docs = len(tables) or 1
+    lengths = {name: sum(terms.values()) for name, terms in term_frequencies.items()}
+
+    # Tables reference each other through foreign keys in both directions.
+    neighbors = {name: set() for name in tables}
+    for name, table in tables.items():
+        for referenced in table['foreign_keys']:
+            if referenced in neighbors:
+                neighbors[name].add(referenced)
+                neighbors[referenced].add(name)
+
+    index = {
+        'tables': tables,
+        'term_frequencies': term_frequencies,
+        'idf': {
+            term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        },
+        'lengths': lengths,
+        'average_length': (sum(lengths.values()) / n_docs) or 1.0,
+        'neighbors': neighbors,
+        'token_counts': {},
+    }
+    index_cache.put(fingerprint, index)
+    return index
+
+def score_tables(index: dict, question: str) -> dict:
+    """Returns the BM25 score of every table for the question."""
+    question_terms = tokenize(question)
+    scores = {}
+    for name, terms in index['term_frequencies'].items():
+        length_norm = 1 - BM25_B + BM25_B * index['lengths'][name] / index['average_length']
+        score = 0.0
+        for term in question_terms:
+            tf = terms.get(term)
+            if tf:
+                score += index['idf'][term] * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+        scores[name] = score
+    return scores
+
+def _table_tokens(index: dict, name: str) -> int:
+    token_counts = index['token_counts']
+    if name not in token_counts:
+        token_counts[name] = estimate_tokens(index['tables'][name]['create_sql'])
+    return token_counts[name]
+
+def select_relevant_schema(index: dict, question: str, top_k: int, token_budget: int) -> str:
+    """
+    Renders the CREATE TABLE statements of the top-k tables for the question plus
+    their foreign-key neighbors, in relevance order, stopping at the token budget.
+    """
+    scores = score_tables(index, question)
+    ranked = sorted(scores, key=lambda name: scores[name], reverse=True)
+    chosen = [name for name in ranked[:top_k] if scores[name] > 0] or ranked[:top_k]
+
+    candidates = list(chosen)
+    for name in chosen:
+        for neighbor in sorted(index['neighbors'][name], key=lambda n: scores[n], reverse=True):
+            if neighbor not in candidates:
+                candidates.append(neighbor)
+
+    selected, used_tokens = [], 0
+    for name in candidates:
+        tokens = _table_tokens(index, name)
+        if selected and used_tokens + tokens > token_budget:
+            continue
+        selected.append(name)
+        used_tokens += tokens
+    logger.debug("Selected %s/%s tables (~%s tokens): %s", len(selected), len(scores), used_tokens, selected)
+    return "\n".join(index['tables'][name]['create_sql'] for name in selected)
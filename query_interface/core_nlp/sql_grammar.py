@@ -0,0 +1,89 @@
+# query_interface/core_nlp/sql_grammar.py
+import re
+
+# GBNF grammar for read-only SQLite SELECT/WITH statements. The `table-name` and
+# `column-name` rules are filled in per database so the model spells (and quotes)
+# schema identifiers exactly. Every name the query declares (CTE names, table
+# aliases and result column aliases) is a short `alias-name` ("e", "oi", "t1"):
+# declared names can then be referenced anywhere (ORDER BY, HAVING, an outer
+# query), yet a reference can never be an invented table or column name. A
+# grammar cannot track which names were declared. UNION/INTERSECT/EXCEPT are left
+# out because sql_interpreter.parse_select only runs a single SELECT.
+SELECT_GRAMMAR_TEMPLATE = r'''
+root ::= ws select-stmt ws ";"
+
+select-stmt ::= with-clause? select-core order-by? limit-clause?
+with-clause ::= "WITH" ws1 cte (ws "," ws cte)* ws1
+cte ::= alias-name ws1 "AS" ws "(" ws select-stmt ws ")"
+select-core ::= "SELECT" ws1 ("DISTINCT" ws1)? result-column (ws "," ws result-column)* from-clause? where-clause? group-by?
+from-clause ::= ws1 "FROM" ws1 table-or-subquery (join-op table-or-subquery join-constraint?)*
+where-clause ::= ws1 "WHERE" ws1 expr
+group-by ::= ws1 "GROUP BY" ws1 expr (ws "," ws expr)* (ws1 "HAVING" ws1 expr)?
+order-by ::= ws1 "ORDER BY" ws1 ordering-term (ws "," ws ordering-term)*
+ordering-term ::= expr (ws1 ("ASC" | "DESC"))?
+limit-clause ::= ws1 "LIMIT" ws1 integer (ws1 "OFFSET" ws1 integer)?
+
+result-column ::= "*" | qualifier "." "*" | expr (ws1 "AS" ws1 alias-name)?
+table-or-subquery ::= (table-name | alias-name) alias? | "(" ws select-stmt ws ")" alias?
+alias ::= ws1 ("AS" ws1)? alias-name
+join-op ::= ws "," ws | ws1 (("LEFT" ws1 ("OUTER" ws1)?) | ("INNER" ws1) | ("CROSS" ws1))? "JOIN" ws1
+join-constraint ::= ws1 "ON" ws1 expr | ws1 "USING" ws "(" ws column-name (ws "," ws column-name)* ws ")"
+
+expr ::= and-expr (ws1 "OR" ws1 and-expr)*
+and-expr ::= not-expr (ws1 "AND" ws1 not-expr)*
+not-expr ::= ("NOT" ws1)? predicate
+predicate ::= sum-expr predicate-tail?
+predicate-tail ::= ws comparison ws sum-expr | ws1 ("NOT" ws1)? "IN" ws "(" ws (select-stmt | expr-list) ws ")" | ws1 ("NOT" ws1)? "LIKE" ws1 sum-expr | ws1 ("NOT" ws1)? "BETWEEN" ws1 sum-expr ws1 "AND" ws1 sum-expr | ws1 "IS" ws1 ("NOT" ws1)? "NULL"
+comparison ::= "=" | "!=" | "<>" | "<=" | ">=" | "<" | ">"
+expr-list ::= expr (ws "," ws expr)*
+sum-expr ::= product-expr (ws ("+" | "-" | "||") ws product-expr)*
+product-expr ::= unary (ws ("*" | "/" | "%") ws unary)*
+unary ::= "-"? primary
+primary ::= literal | function-call | case-expr | column-ref | "(" ws (select-stmt | expr) ws ")" | "EXISTS" ws "(" ws select-stmt ws ")" | "CAST" ws "(" ws expr ws1 "AS" ws1 type-name ws ")"
+function-call ::= aggregate | scalar-function
+aggregate ::= ("COUNT" | "SUM" | "AVG" | "MIN" | "MAX" | "TOTAL" | "GROUP_CONCAT") ws "(" ws ("*" | ("DISTINCT" ws1)? expr) ws ")"
+scalar-function ::= function-name ws "(" ws expr-list? ws ")"
+function-name ::= "ROUND" | "ABS" | "LENGTH" | "LOWER" | "UPPER" | "SUBSTR" | "TRIM" | "REPLACE" | "INSTR" | "COALESCE" | "IFNULL" | "NULLIF" | "DATE" | "DATETIME" | "STRFTIME" | "JULIANDAY"
+case-expr ::= "CASE" (ws1 expr)? (ws1 "WHEN" ws1 expr ws1 "THEN" ws1 expr)+ (ws1 "ELSE" ws1 expr)? ws1 "END"
+type-name ::= "INTEGER" | "REAL" | "TEXT" | "NUMERIC"
+
+column-ref ::= (qualifier ".")? (column-name | alias-name)
+qualifier ::= table-name | alias-name
+literal ::= number | string | "NULL" | "CURRENT_DATE" | "CURRENT_TIMESTAMP"
+number ::= integer ("." [0-9]+)?
+integer ::= [0-9]+
+string ::= "'" ([^'] | "''")* "'"
+alias-name ::= [a-z] [a-z]? [0-9]?
+free-name ::= [a-zA-Z_] [a-zA-Z0-9_]*
+
+ws ::= [ \t\n]*
+ws1 ::= [ \t\n]+
+'''
+
+_BARE_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def gbnf_literal(text: str) -> str:
+    """Renders `text` as a GBNF string literal."""
+    escaped = text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{escaped}"'
+
+def _name_alternatives(names) -> str:
+    alternatives = []
+    for name in sorted(set(names)):
+        if _BARE_IDENTIFIER_RE.match(name):
+            alternatives.append(gbnf_literal(name))
+        alternatives.append(gbnf_literal('"' + name.replace('"', '""') + '"'))
+    # An empty schema still needs a valid rule; fall back to free identifiers.
+    return " | ".join(alternatives) if alternatives else "free-name"
+
+def build_select_grammar(tables: dict) -> str:
+    """
+    Builds a GBNF grammar that only admits a single read-only SELECT (or WITH ... SELECT)
+    statement terminated by ';', specialized to the given {table: [columns]} schema.
+    """
+    columns = [column for table_columns in tables.values() for column in table_columns]
+    return (
+        SELECT_GRAMMAR_TEMPLATE
+        + f"table-name ::= {_name_alternatives(tables.keys())}\n"
+        + f"column-name ::= {_name_alternatives(columns)}\n"
+    )
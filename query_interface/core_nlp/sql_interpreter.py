@@ -1,45 +1,373 @@
 # query_interface/core_nlp/sql_interpreter.py
+import logging
 import sqlglot
 import sqlite3
+import sys
+import time
+from django.conf import settings
+from sqlglot import exp
+from sqlglot.dialects.dialect import Dialect
 from sqlglot.expressions import DML, DDL
+from sqlglot.tokens import TokenType
 
-def execute_query(sql_string: str, db_path: str):
-    print(f"DEBUG: [Interpreter] Received SQL to execute: '{sql_string}'")
+from . import db_profile, duckdb_engine, metrics
+from .cache import LRUCache
+from .db_fingerprint import get_db_fingerprint
+from .db_pool import connection
+from .prompt_builder import get_schema_info
+from .query_guard import (
+    EXPORT_TIME_LIMIT, QUERY_MAX_VM_STEPS, QUERY_TIME_LIMIT, QueryGuardError,
+    check_query_plan, estimate_table_rows, execution_budget,
+)
+from .query_rewriter import apply_page_limit, optimize_select, push_limit_into_cte, streamed_row_limit
+
+logger = logging.getLogger(__name__)
+
+# Uploaded databases are opened read-only, so a SELECT's result only changes when
+# the file does. Results are keyed by (db_path, fingerprint, canonical SQL).
+result_cache = LRUCache(
+    max_entries=getattr(settings, 'LEXIBASE_RESULT_CACHE_ENTRIES', 256),
+    max_bytes=getattr(settings, 'LEXIBASE_RESULT_CACHE_BYTES', 64 * 1024 * 1024),
+)
+
+PAGE_SIZE = getattr(settings, 'LEXIBASE_RESULT_PAGE_SIZE', 100)
+MAX_PAGE_SIZE = getattr(settings, 'LEXIBASE_RESULT_MAX_PAGE_SIZE', 1000)
+EXPORT_BATCH_ROWS = getattr(settings, 'LEXIBASE_EXPORT_BATCH_ROWS', 1000)
+# Queries touching fewer rows than this stay on SQLite, which answers before DuckDB has warmed up.
+DUCKDB_MIN_ROWS = getattr(settings, 'LEXIBASE_DUCKDB_MIN_ROWS', 1_000_000)
+# Extra column selected for keyset pagination and stripped before results are returned.
+KEYSET_COLUMN = '__lexibase_rowid'
+
+def estimate_result_size(columns, results) -> int:
+    """Approximates the memory held by a result set, in bytes."""
+    size = sys.getsizeof(results) + sum(sys.getsizeof(column) for column in columns)
+    for row in results:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(cell) for cell in row)
+    return size
+
+def invalidate_database(db_path: str):
+    """Drops every cached result for a database path (e.g. when the session's file is replaced)."""
+    removed = result_cache.invalidate(lambda key: key[0] == db_path)
+    logger.debug("Invalidated %s cached results for %s", removed, db_path)
+
+def parse_select(sql_string: str, db_path: str):
+    """Parses `sql_string` and returns its expression, raising ValueError unless it is a single read-only SELECT."""
+    if not sql_string:
+        raise ValueError("The generated query was empty.")
+    if not db_path:
+        raise ValueError("Database path not found. Please upload a database first.")
+
+    logger.debug("Parsing SQL string...")
+    parsed_queries = sqlglot.parse(sql_string, read="sqlite")
+
+    if not parsed_queries:
+        raise ValueError("SQL string could not be parsed.")
+    if len(parsed_queries) > 1:
+        raise ValueError("Execution of multiple SQL statements is forbidden.")
+
+    parsed_query = parsed_queries[0]
+    logger.debug("SQL parsing successful.")
+
+    logger.debug("Running security validation...")
+    if any(expr for expr in parsed_query.find_all(DML, DDL)):
+        raise ValueError("Query contains forbidden commands (e.g., UPDATE, DELETE, DROP). Only SELECT is permitted.")
+    if not isinstance(parsed_query, sqlglot.exp.Select):
+        raise ValueError("Only SELECT queries are allowed.")
+    logger.debug("Security validation passed.")
+    return parsed_query
+
+def _keyset_table(parsed_query):
+    """
+    Returns the table a query can be keyset-paginated on by rowid, or None. Only
+    plain row listings from one table qualify: ordering, grouping, aggregation or
+    an explicit LIMIT would change what "the next page" means.
+    """
+    from_clause = parsed_query.args.get('from_')
+    if from_clause is None or not isinstance(from_clause.this, exp.Table):
+        return None
+    # A WHERE clause is fine: the rowid predicate is ANDed onto it.
+    if any(parsed_query.args.get(arg) for arg in ('joins', 'laterals', 'group', 'having', 'order', 'limit', 'offset', 'distinct', 'with_')):
+        return None
+    if parsed_query.find(exp.AggFunc, exp.Window):
+        return None
+    return from_clause.this
+
+def _keyset_page_query(query, table, page_size: int, after):
+    rowid = exp.column('rowid', table=table.alias_or_name)
+    query = query.copy().select(exp.alias_(rowid.copy(), KEYSET_COLUMN))
+    if after is not None:
+        query = query.where(exp.GT(this=rowid.copy(), expression=exp.Literal.number(int(after))))
+    return query.order_by(rowid.copy()).limit(page_size + 1)
+
+def _with_limit_zero(sql_string: str) -> str:
+    """The statement as written, with its top-level LIMIT (and OFFSET) replaced by LIMIT 0."""
+    tokens = Dialect.get_or_raise("sqlite").tokenize(sql_string)
+    depth, cut = 0, None
+    for token in tokens:
+        if token.token_type == TokenType.L_PAREN:
+            depth += 1
+        elif token.token_type == TokenType.R_PAREN:
+            depth -= 1
+        elif token.token_type == TokenType.LIMIT and depth == 0:
+            cut = token.start  # LIMIT ends a SELECT, so nothing after it matters.
+    if cut is None:
+        cut = max((token.end + 1 for token in tokens if token.token_type != TokenType.SEMICOLON), default=0)
+    return f"{sql_string[:cut]}\nLIMIT 0"
+
+def result_columns(cursor, sql_string: str) -> list:
+    """
+    Returns the column names SQLite gives a statement as written, without running
+    it: under LIMIT 0 the statement stops before reading a row.
+    """
+    cursor.execute(_with_limit_zero(sql_string))
+    return [description[0] for description in cursor.description]
+
+def _names_survive_rewriting(parsed_query) -> bool:
+    """
+    Whether every result column is named by an alias or a column name. SQLite names
+    other expressions by their text, which rewriting and paging regenerate (and the
+    optimizer aliases as _col_N), so only then do the executed headers need replacing.
+    """
+    return all(isinstance(projection, (exp.Alias, exp.Column, exp.Star)) for projection in parsed_query.expressions)
+
+def estimate_total_rows(cursor, parsed_query, table, row_counts: dict = None):
+    """Estimates the row count of an unfiltered single-table listing without scanning it, else None."""
+    if table is None or parsed_query.args.get('where'):
+        return None
+    return estimate_table_rows(cursor, table.name, row_counts)
+
+def table_aliases(parsed_query) -> dict:
+    """Maps every name a query uses for a table (alias or bare name) to the table name."""
+    return {table.alias_or_name: table.name for table in parsed_query.find_all(exp.Table)}
+
+def _check_plan(cursor, query, row_counts: dict = None) -> list:
+    """Applies the plan policy to the statement about to run, page limit included. Returns its warnings."""
+    return check_query_plan(
+        cursor, query.sql(dialect="sqlite"), table_aliases(query),
+        row_counts=row_counts, limit=streamed_row_limit(query),
+    )
+
+def _fetch_page(cursor, query, page: int, page_size: int, after, row_counts: dict = None):
+    """
+    Runs one page of a (rewritten) query. Returns (mode, executed_sql, columns, rows,
+    has_next, next_after, total_estimate, plan_warnings); columns is None if nothing
+    had to run.
+    """
+    table = _keyset_table(query)
+    if table is not None and (after is not None or page == 1):
+        page_query = _keyset_page_query(query, table, page_size, after)
+        executed_sql = page_query.sql(dialect="sqlite")
+        try:
+            warnings = _check_plan(cursor, page_query, row_counts)
+            cursor.execute(executed_sql)
+            rows = cursor.fetchmany(page_size + 1)
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise  # Stopped by the execution budget, not a missing rowid.
+            # WITHOUT ROWID tables have no rowid; fall back to offsets.
+            logger.debug("Keyset pagination unavailable (%s). Using offsets.", e)
+            table, rows = None, None
+        if rows and rows[0][-1] is None:
+            # Views report a NULL rowid instead of failing, which gives no order to page by.
+            logger.debug("Keyset pagination unavailable (no rowid). Using offsets.")
+            table = None
+        elif rows is not None:
+            columns = [description[0] for description in cursor.description][:-1]
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+            next_after = rows[-1][-1] if has_next else None
+            total = None if after is not None else estimate_total_rows(cursor, query, table, row_counts)
+            return 'keyset', executed_sql, columns, [row[:-1] for row in rows], has_next, next_after, total, warnings
+
+    # Fetching one row past the page tells us whether another page exists, and a
+    # LIMIT lets SQLite stop early (or keep only the top rows when sorting).
+    paged = apply_page_limit(query, page_size + 1, (page - 1) * page_size)
+    if paged is None:
+        return 'offset', None, None, [], False, None, None, []
+    paged = push_limit_into_cte(paged)
+    warnings = _check_plan(cursor, paged, row_counts)
+    executed_sql = paged.sql(dialect="sqlite")
+    cursor.execute(executed_sql)
+    rows = cursor.fetchmany(page_size + 1)
+    columns = [description[0] for description in cursor.description]
+    has_next = len(rows) > page_size
+    total = estimate_total_rows(cursor, query, table, row_counts) if page == 1 else None
+    return 'offset', executed_sql, columns, rows[:page_size], has_next, None, total, warnings
+
+def choose_engine(cursor, query, row_counts: dict = None) -> str:
+    """
+    Picks the engine for a query from its shape and table sizes: DuckDB for
+    aggregations, sorts and joins over large tables, where vectorized multi-threaded
+    execution pays off; SQLite for row listings, small tables and anything whose
+    semantics DuckDB does not reproduce exactly. `row_counts` are the database
+    profile's table sizes, which spare the lookups in the database.
+    """
+    if not duckdb_engine.is_available():
+        return 'sqlite'
+    analytical = (
+        any(query.args.get(arg) for arg in ('group', 'order', 'distinct', 'joins'))
+        or query.find(exp.AggFunc, exp.Window) is not None
+    )
+    if not analytical or not duckdb_engine.is_portable(query):
+        return 'sqlite'
+    scanned_rows = sum(
+        estimate_table_rows(cursor, table, row_counts) or 0 for table in set(table_aliases(query).values())
+    )
+    return 'duckdb' if scanned_rows >= DUCKDB_MIN_ROWS else 'sqlite'
+
+def _rewrite(parsed_query, db_path: str):
+    return optimize_select(parsed_query, get_schema_info(db_path)['tables'])
+
+def execute_query(sql_string: str, db_path: str, page: int = 1, page_size: int = None, after=None):
+    """
+    Validates and runs a SELECT, returning one page of its rows. Pages after the
+    first are addressed by `page` and, for keyset-paginated queries, by the
+    `after` rowid cursor returned with the previous page.
+    """
+    logger.debug("Received SQL to execute: '%s'", sql_string)
+    page = max(1, int(page))
+    page_size = min(max(1, int(page_size or PAGE_SIZE)), MAX_PAGE_SIZE)
     try:
-        if not sql_string:
-            raise ValueError("The generated query was empty.")
-        if not db_path:
-            raise ValueError("Database path not found. Please upload a database first.")
-
-        print("DEBUG: [Interpreter] Parsing SQL string...")
-        parsed_queries = sqlglot.parse(sql_string, read="sqlite")
-        
-        if not parsed_queries:
-            raise ValueError("SQL string could not be parsed.")
-        if len(parsed_queries) > 1:
-            raise ValueError("Execution of multiple SQL statements is forbidden.")
-        
-        parsed_query = parsed_queries[0]
-        print("DEBUG: [Interpreter] SQL parsing successful.")
-
-        print("DEBUG: [Interpreter] Running security validation...")
-        if any(expr for expr in parsed_query.find_all(DML, DDL)):
-            raise ValueError("Query contains forbidden commands (e.g., UPDATE, DELETE, DROP). Only SELECT is permitted.")
-        if not isinstance(parsed_query, sqlglot.exp.Select):
-            raise ValueError("Only SELECT queries are allowed.")
-        print("DEBUG: [Interpreter] Security validation passed.")
-
-        print(f"DEBUG: [Interpreter] Connecting to user DB at {db_path} and executing query...")
-        con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
-        cursor = con.cursor()
-        cursor.execute(sql_string)
-        
-        columns = [description[0] for description in cursor.description]
-        results = cursor.fetchall()
-        con.close()
-        print(f"DEBUG: [Interpreter] Execution successful. Found {len(results)} rows.")
-        return {"columns": columns, "results": results, "error": None}
+        with metrics.span('sql_validation'):
+            parsed_query = parse_select(sql_string, db_path)
 
+        cache_key = (
+            db_path, get_db_fingerprint(db_path),
+            parsed_query.sql(dialect="sqlite", normalize=True), page, page_size, after,
+        )
+        cached = result_cache.get(cache_key)
+        metrics.count_cache('result', cached is not None)
+        if cached is not None:
+            logger.debug("Result cache hit. Returning %s cached rows.", len(cached['results']))
+            return dict(
+                cached, columns=list(cached['columns']), results=list(cached['results']),
+                page=dict(cached['page']), warnings=list(cached['warnings']),
+            )
+
+        with metrics.span('sql_rewrite'):
+            query = _rewrite(parsed_query, db_path)
+        row_counts = db_profile.get_row_counts(db_path)
+        logger.debug("Connecting to user DB at %s and executing query (page %s)...", db_path, page)
+        started = time.perf_counter()
+        with connection(db_path) as con:
+            cursor = con.cursor()
+            try:
+                # Estimates may still read the database (e.g. max(rowid)), so they get a budget too.
+                with execution_budget(con, time_limit=QUERY_TIME_LIMIT, max_steps=QUERY_MAX_VM_STEPS):
+                    engine, fetched = choose_engine(cursor, query, row_counts), None
+                    if engine == 'duckdb':
+                        # DuckDB runs the same page; its SQLite form stands in for the plan check.
+                        paged = apply_page_limit(query, page_size + 1, (page - 1) * page_size)
+                        warnings = _check_plan(cursor, paged, row_counts) if paged is not None else []
+                if engine == 'duckdb':
+                    try:
+                        executed_sql, columns, results, has_next = duckdb_engine.fetch_page(
+                            db_path, query, page, page_size, time_limit=QUERY_TIME_LIMIT
+                        )
+                        fetched = ('offset', executed_sql, columns, results, has_next, None, None, warnings)
+                    except duckdb_engine.DuckDBError as e:
+                        logger.debug("DuckDB could not run the query (%s). Falling back to SQLite.", e)
+                        engine = 'sqlite'
+                if fetched is None:
+                    with execution_budget(con, time_limit=QUERY_TIME_LIMIT, max_steps=QUERY_MAX_VM_STEPS):
+                        try:
+                            fetched = _fetch_page(cursor, query, page, page_size, after, row_counts)
+                        except sqlite3.OperationalError as e:
+                            if query is parsed_query or 'interrupted' in str(e):
+                                raise
+                            logger.debug("Rewritten query failed (%s). Running it as written.", e)
+                            query = parsed_query
+                            fetched = _fetch_page(cursor, query, page, page_size, after, row_counts)
+                mode, executed_sql, columns, results, has_next, next_after, total, warnings = fetched
+                if columns is None or not _names_survive_rewriting(parsed_query):
+                    # Report the headers of the SQL as written.
+                    original_columns = result_columns(cursor, sql_string)
+                    if columns is None or len(columns) == len(original_columns):
+                        columns = original_columns
+            finally:
+                cursor.close()
+        metrics.record_span('sql_execution', time.perf_counter() - started)
+        metrics.record_rows(len(results))
+
+        first_row = (page - 1) * page_size + 1
+        total_exact = not has_next and (bool(results) or page == 1)
+        if total_exact:
+            total = first_row - 1 + len(results)  # The last page makes the count exact.
+        page_info = {
+            'number': page,
+            'size': page_size,
+            'mode': mode,
+            'first_row': first_row if results else 0,
+            'last_row': first_row + len(results) - 1 if results else 0,
+            'has_previous': page > 1,
+            'has_next': has_next,
+            'next_after': next_after,
+            'total_rows': total,
+            'total_exact': total_exact,
+        }
+        logger.debug("Execution successful on %s. Returning %s rows (more: %s).", engine, len(results), has_next)
+        response = {
+            "columns": columns, "results": results, "page": page_info, "warnings": warnings,
+            "executed_sql": executed_sql, "engine": engine, "error": None, "error_type": None,
+        }
+        result_cache.put(cache_key, response, size=estimate_result_size(columns, results))
+        return dict(response, columns=list(columns), results=list(results), page=dict(page_info), warnings=list(warnings))
+
+    except QueryGuardError as e:
+        logger.warning("Query stopped by a guardrail: %s", e)
+        return {
+            "columns": [], "results": [], "page": None, "warnings": [],
+            "error": f"Query Guardrail: {str(e)}", "error_type": "guardrail",
+        }
     except Exception as e:
-        print(f"ERROR: [Interpreter] An error occurred: {str(e)}")
-        return {"columns": [], "results": [], "error": f"Interpreter Error: {str(e)}"}
\ No newline at end of file
+        logger.error("An error occurred: %s", e)
+        return {
+            "columns": [], "results": [], "page": None, "warnings": [],
+            "error": f"Interpreter Error: {str(e)}", "error_type": "interpreter",
+        }
+
+def stream_query(sql_string: str, db_path: str, batch_size: int = None):
+    """
+    Validates and runs a SELECT, yielding its column names first and then lists of
+    at most `batch_size` rows, so exports never hold the full result in memory.
+    The pooled connection is held until the generator is exhausted or closed.
+    """
+    parsed_query = parse_select(sql_string, db_path)
+    query = _rewrite(parsed_query, db_path)
+    batch_size = batch_size or EXPORT_BATCH_ROWS
+    row_counts = db_profile.get_row_counts(db_path)
+    with connection(db_path) as con:
+        cursor = con.cursor()
+        spent = 0.0
+
+        def run(step, *args, **kwargs):
+            # Exports legitimately read every row, so only the (longer) time limit applies. It
+            # counts time spent executing, not time the generator waits on a slow client.
+            nonlocal spent
+            started = time.perf_counter()
+            try:
+                with execution_budget(con, time_limit=EXPORT_TIME_LIMIT, time_spent=spent):
+                    return step(*args, **kwargs)
+            finally:
+                spent += time.perf_counter() - started
+
+        try:
+            columns = None if _names_survive_rewriting(parsed_query) else result_columns(cursor, sql_string)
+            executed_sql = query.sql(dialect="sqlite")
+            run(_check_plan, cursor, query, row_counts)
+            try:
+                run(cursor.execute, executed_sql)
+            except sqlite3.OperationalError as e:
+                if query is parsed_query or 'interrupted' in str(e):
+                    raise
+                logger.debug("Rewritten query failed (%s). Running it as written.", e)
+                run(_check_plan, cursor, parsed_query, row_counts)
+                run(cursor.execute, sql_string)
+            yield columns or [description[0] for description in cursor.description]
+            while True:
+                rows = run(cursor.fetchmany, batch_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
@@ -0,0 +1,96 @@
+# query_interface/core_nlp/upload_janitor.py
+import logging
+import threading
+import time
+from importlib import import_module
+from django.conf import settings
+from django.db import connections
+
+from . import db_pool, duckdb_engine, upload_store
+from .db_fingerprint import content_hash_from_path
+from .db_profile import profile_cache
+from .prompt_builder import schema_cache
+from .schema_index import index_cache
+from .sql_interpreter import invalidate_database
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background sweeps in each server process (the thread starts with its
+# first request); 0 disables the thread (use `manage.py sweep_uploads` instead).
+JANITOR_INTERVAL = getattr(settings, 'LEXIBASE_JANITOR_INTERVAL', 600)
+# A reference younger than this may belong to a request that has not saved its session yet.
+REFERENCE_GRACE_SECONDS = getattr(settings, 'LEXIBASE_JANITOR_REFERENCE_GRACE', 300)
+INCOMING_MAX_AGE = getattr(settings, 'LEXIBASE_JANITOR_INCOMING_MAX_AGE', 3600)
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def release_database(db_path: str):
+    """Drops cached results, schema artifacts, profiles, pooled connections and engine handles for a database."""
+    invalidate_database(db_path)
+    db_pool.close_database(db_path)
+    duckdb_engine.close_database(db_path)
+    content_hash = content_hash_from_path(db_path)
+    if content_hash is not None:
+        # Content-addressed files use their hash as the fingerprint these caches are keyed by.
+        schema_cache.pop(content_hash)
+        index_cache.pop(content_hash)
+        profile_cache.pop(content_hash)
+
+def _session_database(session_store_class, session_key: str):
+    """Returns the content hash a live session points at, or None if the session has expired or is gone."""
+    store = session_store_class(session_key=session_key)
+    data = store.load()
+    if store.session_key is None:
+        return None
+    return data.get('db_hash')
+
+def sweep() -> dict:
+    """
+    One janitor pass: releases references held by sessions that have expired or
+    moved on, deletes unreferenced and stray files, enforces the global disk
+    quota and closes idle connection pools. Returns counts for each step.
+    """
+    start = time.monotonic()
+    session_store_class = import_module(settings.SESSION_ENGINE).SessionStore
+    report = {'released': 0}
+    for content_hash, owner in upload_store.list_references(time.time() - REFERENCE_GRACE_SECONDS):
+        if _session_database(session_store_class, owner) != content_hash:
+            upload_store.release(content_hash, owner, on_delete=release_database)
+            report['released'] += 1
+    report.update(upload_store.sweep_orphans(
+        on_delete=release_database,
+        incoming_max_age=INCOMING_MAX_AGE,
+        legacy_max_age=settings.SESSION_COOKIE_AGE,
+    ))
+    report['evicted'] = 0
+    if upload_store.GLOBAL_QUOTA_BYTES:
+        report['evicted'] = len(upload_store.evict_to_quota(upload_store.GLOBAL_QUOTA_BYTES, on_delete=release_database))
+    report['idle_pools_closed'] = db_pool.evict_idle_pools()
+    report['seconds'] = round(time.monotonic() - start, 3)
+    logger.info("Sweep finished: %s", report)
+    return report
+
+def _run(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            sweep()
+        except Exception as e:
+            logger.exception("Sweep failed: %s", e)
+        finally:
+            # This thread is not a request, so nothing else closes its database connection.
+            connections.close_all()
+
+def start(interval: float = None):
+    """Starts the background janitor thread once per process, unless the interval is 0."""
+    global _thread
+    interval = JANITOR_INTERVAL if interval is None else interval
+    if not interval:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, args=(interval,), name='lexibase-janitor', daemon=True)
+            _thread.start()
+            logger.info("Sweeping uploads every %s seconds.", interval)
@@ -0,0 +1,324 @@
+# query_interface/core_nlp/upload_store.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from django.conf import settings
+
+from .db_fingerprint import SQLITE_HEADER_MAGIC, content_hash_from_path, content_object_name
+from .db_profile import PROFILE_SUFFIX, profile_path
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = getattr(settings, 'LEXIBASE_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'temp_uploads'))
+OBJECTS_DIR = os.path.join(UPLOAD_DIR, 'objects')
+INCOMING_DIR = os.path.join(UPLOAD_DIR, 'incoming')
+METADATA_PATH = os.path.join(UPLOAD_DIR, 'store.sqlite3')
+QUICK_CHECK_ENABLED = getattr(settings, 'LEXIBASE_UPLOAD_QUICK_CHECK', True)
+# A session holds one database at a time, so the per-session quota caps a single upload.
+SESSION_QUOTA_BYTES = getattr(settings, 'LEXIBASE_UPLOAD_SESSION_QUOTA_BYTES', 512 * 1024 * 1024)
+GLOBAL_QUOTA_BYTES = getattr(settings, 'LEXIBASE_UPLOAD_GLOBAL_QUOTA_BYTES', 10 * 1024 * 1024 * 1024)
+# last_used is written at most this often per database, not on every query.
+TOUCH_INTERVAL = 60
+# Files SQLite keeps next to an open database; opening a WAL-mode upload creates them even read-only.
+SIDE_FILE_SUFFIXES = ('-wal', '-shm', '-journal')
+
+_last_touched = {}
+_touch_lock = threading.Lock()
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload cannot be stored; the message is shown to the user."""
+
+
+class InvalidDatabase(UploadRejected):
+    """Raised when an upload is not a readable SQLite database."""
+
+
+class UploadTooLarge(UploadRejected):
+    """Raised when an upload exceeds the per-session disk quota."""
+
+
+def _metadata():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    con = sqlite3.connect(METADATA_PATH, timeout=30, isolation_level=None)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS objects (content_hash TEXT PRIMARY KEY, size INTEGER, created REAL, last_used REAL)"
+    )
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS refs (content_hash TEXT, owner TEXT, created REAL, PRIMARY KEY (content_hash, owner))"
+    )
+    return con
+
+def object_path(content_hash: str) -> str:
+    return os.path.join(OBJECTS_DIR, content_object_name(content_hash))
+
+def _receive(uploaded_file):
+    """Streams an upload to a private temp file, hashing and checking the header on the way in."""
+    os.makedirs(INCOMING_DIR, exist_ok=True)
+    temp_path = os.path.join(INCOMING_DIR, f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    header = b""
+    size = 0
+    try:
+        with open(temp_path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                if len(header) < len(SQLITE_HEADER_MAGIC):
+                    # Reject non-SQLite files as soon as their first 16 bytes are in.
+                    header += chunk[:len(SQLITE_HEADER_MAGIC) - len(header)]
+                    if len(header) == len(SQLITE_HEADER_MAGIC) and header != SQLITE_HEADER_MAGIC:
+                        raise InvalidDatabase("The uploaded file is not a SQLite database.")
+                size += len(chunk)
+                if SESSION_QUOTA_BYTES and size > SESSION_QUOTA_BYTES:
+                    raise UploadTooLarge(
+                        f"The uploaded database is larger than the {SESSION_QUOTA_BYTES / (1024 * 1024):g} MiB limit."
+                    )
+                digest.update(chunk)
+                destination.write(chunk)
+        if header != SQLITE_HEADER_MAGIC:
+            raise InvalidDatabase("The uploaded file is not a SQLite database.")
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+def _quick_check(db_path: str):
+    con = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        result = con.execute("PRAGMA quick_check;").fetchall()
+    except sqlite3.DatabaseError as e:
+        raise InvalidDatabase(f"The uploaded database could not be read: {e}") from e
+    finally:
+        con.close()
+    if result != [('ok',)]:
+        raise InvalidDatabase(f"The uploaded database failed its integrity check: {result[0][0]}")
+
+def store_upload(uploaded_file, owner: str, on_delete=None):
+    """
+    Stores an uploaded database under the SHA-256 of its contents and records a
+    reference from `owner` (a session). Identical uploads share one read-only
+    file. If the store then exceeds its global quota, other databases are
+    evicted, unreferenced ones first (see evict_to_quota). Returns (db_path,
+    content_hash); raises UploadRejected for bad or oversized files.
+    """
+    temp_path, content_hash, size = _receive(uploaded_file)
+    target = object_path(content_hash)
+    try:
+        if not os.path.exists(target) and QUICK_CHECK_ENABLED:
+            _quick_check(temp_path)
+        os.makedirs(OBJECTS_DIR, exist_ok=True)
+        con = _metadata()
+        try:
+            # The write lock serializes this with release(), so a file is never deleted while being re-referenced.
+            con.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            if os.path.exists(target):
+                logger.debug("Deduplicated upload %s (%s bytes).", content_hash[:12], size)
+            else:
+                os.chmod(temp_path, 0o444)
+                os.replace(temp_path, target)
+                logger.debug("Stored new database %s (%s bytes).", content_hash[:12], size)
+            con.execute(
+                "INSERT INTO objects (content_hash, size, created, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(content_hash) DO UPDATE SET last_used = excluded.last_used",
+                (content_hash, size, now, now),
+            )
+            con.execute("INSERT OR IGNORE INTO refs (content_hash, owner, created) VALUES (?, ?, ?)", (content_hash, owner, now))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    if GLOBAL_QUOTA_BYTES:
+        evict_to_quota(GLOBAL_QUOTA_BYTES, on_delete=on_delete, protect=(content_hash,))
+    return target, content_hash
+
+def _delete_object(con, content_hash: str, on_delete=None):
+    """Deletes a stored database, its profile sidecar and its rows; the caller holds the write lock."""
+    path = object_path(content_hash)
+    if on_delete is not None:
+        on_delete(path)
+    con.execute("DELETE FROM refs WHERE content_hash = ?", (content_hash,))
+    con.execute("DELETE FROM objects WHERE content_hash = ?", (content_hash,))
+    with _touch_lock:
+        _last_touched.pop(content_hash, None)
+    for file_path in (path, profile_path(path), *(path + suffix for suffix in SIDE_FILE_SUFFIXES)):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+    logger.debug("Deleted database %s.", content_hash[:12])
+
+def release(content_hash: str, owner: str, on_delete=None) -> int:
+    """
+    Drops `owner`'s reference to a stored database and deletes the file once no
+    references remain, calling `on_delete(db_path)` first so pools and caches can
+    let go of it. Returns the number of remaining references.
+    """
+    con = _metadata()
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        con.execute("DELETE FROM refs WHERE content_hash = ? AND owner = ?", (content_hash, owner))
+        remaining = con.execute("SELECT COUNT(*) FROM refs WHERE content_hash = ?", (content_hash,)).fetchone()[0]
+        if remaining == 0:
+            _delete_object(con, content_hash, on_delete)
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+    return remaining
+
+def touch(db_path: str):
+    """Records that a stored database was just used, for least-recently-used eviction."""
+    content_hash = content_hash_from_path(db_path)
+    if content_hash is None:
+        return
+    now = time.time()
+    with _touch_lock:
+        if now - _last_touched.get(content_hash, 0) < TOUCH_INTERVAL:
+            return
+        _last_touched[content_hash] = now
+    con = _metadata()
+    try:
+        con.execute("UPDATE objects SET last_used = ? WHERE content_hash = ?", (now, content_hash))
+    finally:
+        con.close()
+
+def list_references(older_than: float) -> list:
+    """Returns (content_hash, owner) for every reference recorded before `older_than` (a timestamp)."""
+    con = _metadata()
+    try:
+        return con.execute("SELECT content_hash, owner FROM refs WHERE created < ?", (older_than,)).fetchall()
+    finally:
+        con.close()
+
+def evict_to_quota(quota_bytes: int, on_delete=None, protect=()) -> list:
+    """
+    Deletes databases until the store fits in `quota_bytes`: first those no
+    session references, then, as a last resort, referenced ones, each group least
+    recently used first. Hashes in `protect` are never evicted. Returns the
+    evicted hashes.
+    """
+    con = _metadata()
+    evicted, referenced_evicted = [], 0
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        total = con.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        if total > quota_bytes:
+            candidates = con.execute(
+                "SELECT content_hash, size, EXISTS (SELECT 1 FROM refs WHERE refs.content_hash = objects.content_hash) "
+                "AS referenced FROM objects ORDER BY referenced, last_used"
+            ).fetchall()
+            for content_hash, size, referenced in candidates:
+                if total <= quota_bytes:
+                    break
+                if content_hash in protect:
+                    continue
+                _delete_object(con, content_hash, on_delete)
+                total -= size
+                evicted.append(content_hash)
+                referenced_evicted += referenced
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+    if evicted:
+        logger.info("Evicted %s databases to fit the %s byte quota.", len(evicted), quota_bytes)
+    if referenced_evicted:
+        logger.warning("%s evicted databases were still in use by a session.", referenced_evicted)
+    return evicted
+
+def sweep_orphans(on_delete=None, incoming_max_age: float = 3600, legacy_max_age: float = None) -> dict:
+    """
+    Deletes stored databases with no references, object files (with their profiles
+    and -wal/-shm files) the metadata does not know about, interrupted uploads and
+    profile writes older than `incoming_max_age` seconds and, if `legacy_max_age`
+    is given, pre-content-addressing uploads older than that. Files whose names do
+    not follow the object pattern are left alone. Returns the number of files
+    removed in each category.
+    """
+    report = {'unreferenced': 0, 'untracked': 0, 'incoming': 0, 'legacy': 0}
+    now = time.time()
+    con = _metadata()
+    try:
+        # Holding the write lock keeps store_upload() from adding a file mid-scan.
+        con.execute("BEGIN IMMEDIATE")
+        unreferenced = con.execute(
+            "SELECT content_hash FROM objects WHERE content_hash NOT IN (SELECT content_hash FROM refs)"
+        ).fetchall()
+        for (content_hash,) in unreferenced:
+            _delete_object(con, content_hash, on_delete)
+            report['unreferenced'] += 1
+        known = {row[0] for row in con.execute("SELECT content_hash FROM objects")}
+        if os.path.isdir(OBJECTS_DIR):
+            for entry in os.scandir(OBJECTS_DIR):
+                if entry.name.endswith('.tmp'):
+                    # A profile still being written; only leftovers of a crash are reaped.
+                    if now - entry.stat().st_mtime > incoming_max_age:
+                        os.remove(entry.path)
+                        report['untracked'] += 1
+                    continue
+                # Profile sidecars and SQLite's -wal/-shm files live as long as their database.
+                base = entry.name
+                for suffix in (PROFILE_SUFFIX, *SIDE_FILE_SUFFIXES):
+                    if base.endswith(suffix):
+                        base = base[:-len(suffix)]
+                        break
+                content_hash = content_hash_from_path(base)
+                if content_hash is None or content_hash in known:
+                    continue  # Not ours to delete, or still tracked.
+                if on_delete is not None and base == entry.name:
+                    on_delete(entry.path)
+                os.remove(entry.path)
+                report['untracked'] += 1
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+    if os.path.isdir(INCOMING_DIR):
+        for entry in os.scandir(INCOMING_DIR):
+            if entry.is_file() and now - entry.stat().st_mtime > incoming_max_age:
+                os.remove(entry.path)
+                report['incoming'] += 1
+    if legacy_max_age is not None:
+        # Files saved directly in the upload directory by older versions, owned by one session each.
+        for entry in os.scandir(UPLOAD_DIR):
+            if entry.is_file() and not entry.name.startswith(os.path.basename(METADATA_PATH)):
+                if now - entry.stat().st_mtime > legacy_max_age:
+                    if on_delete is not None:
+                        on_delete(entry.path)
+                    os.remove(entry.path)
+                    report['legacy'] += 1
+    return report
+
+def get_store_stats() -> dict:
+    con = _metadata()
+    try:
+        objects, stored_bytes = con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+        references, referenced_bytes = con.execute(
+            "SELECT COUNT(*), COALESCE(SUM(objects.size), 0) FROM refs JOIN objects USING (content_hash)"
+        ).fetchone()
+    finally:
+        con.close()
+    # referenced_bytes is what the store would hold without deduplication.
+    return {
+        'objects': objects,
+        'stored_bytes': stored_bytes,
+        'references': references,
+        'referenced_bytes': referenced_bytes,
+        'global_quota_bytes': GLOBAL_QUOTA_BYTES,
+    }
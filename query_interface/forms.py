@@ -15,4 +15,9 @@ class DatabaseQueryForm(forms.Form):
             'class': 'form-control',
             'placeholder': 'e.g., "Which 5 actors appeared in the most films?"'
         })
-    )
\ No newline at end of file
+    )
+    bypass_cache = forms.BooleanField(
+        label="Regenerate (skip cached SQL)",
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
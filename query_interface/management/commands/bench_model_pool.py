@@ -0,0 +1,86 @@
+# query_interface/management/commands/bench_model_pool.py
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from query_interface.core_nlp.inference_scheduler import InferenceScheduler
+from query_interface.core_nlp.prompt_builder import create_text_to_sql_prompt
+
+DEFAULT_QUESTIONS = [
+    "How many employees are there in each department?",
+    "What are the 5 most expensive products?",
+    "What is the average salary in the Sales department?",
+    "List the products that are out of stock.",
+]
+
+
+class Command(BaseCommand):
+    help = "Measures SQL-generation throughput of the model worker pool for increasing worker counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('db_path', help="SQLite database whose schema is used to build the prompts.")
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="Worker counts to compare.")
+        parser.add_argument('--backend', choices=['thread', 'process'], default='process')
+        parser.add_argument('--requests', type=int, default=16, help="Concurrent requests per run.")
+        parser.add_argument('--threads-per-worker', type=int, default=None)
+        parser.add_argument('--group-size', type=int, default=1,
+                            help="Same-prefix jobs a worker may run in a row (sequentially, not batched).")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        questions = [DEFAULT_QUESTIONS[i % len(DEFAULT_QUESTIONS)] for i in range(options['requests'])]
+        prompts = [create_text_to_sql_prompt(question, options['db_path']) for question in questions]
+        results = []
+        baseline = None
+
+        for workers in options['workers']:
+            scheduler = InferenceScheduler(
+                workers=workers,
+                max_queue=len(prompts) + workers,
+                default_timeout=3600,
+                backend=options['backend'],
+                group_size=options['group_size'],
+                threads_per_worker=options['threads_per_worker'],
+                warmup_prompt=prompts[0],
+            )
+            try:
+                # Every worker loads its model and runs one warm-up prompt, so neither is measured.
+                scheduler.wait_until_ready()
+
+                start = time.perf_counter()
+                jobs = [scheduler.submit(prompt) for prompt in prompts]
+                errors = 0
+                for job in jobs:
+                    try:
+                        job.result()
+                    except Exception:
+                        errors += 1
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                raise CommandError(f"Benchmark with {workers} workers failed: {e}")
+            finally:
+                scheduler.shutdown()
+
+            throughput = len(prompts) / elapsed
+            baseline = baseline or throughput
+            results.append({
+                'workers': workers,
+                'backend': options['backend'],
+                'threads_per_worker': scheduler.threads_per_worker,
+                'requests': len(prompts),
+                'errors': errors,
+                'seconds': round(elapsed, 3),
+                'requests_per_second': round(throughput, 3),
+                'speedup': round(throughput / baseline, 2),
+            })
+
+        self.stdout.write(f"{'workers':>8} {'threads':>8} {'seconds':>10} {'req/s':>8} {'speedup':>8} {'errors':>7}")
+        for row in results:
+            self.stdout.write(
+                f"{row['workers']:>8} {row['threads_per_worker']:>8} {row['seconds']:>10} "
+                f"{row['requests_per_second']:>8} {row['speedup']:>8} {row['errors']:>7}"
+            )
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json_path']}"))
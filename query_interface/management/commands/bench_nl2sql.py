@@ -0,0 +1,388 @@
+# query_interface/management/commands/bench_nl2sql.py
+import json
+import math
+import os
+import platform
+import time
+from collections import Counter
+from datetime import datetime, timezone
+import sqlglot
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from query_interface.core_nlp import db_profile, fast_path, llm_handler, metrics, question_cache
+from query_interface.core_nlp.db_fingerprint import get_db_fingerprint
+from query_interface.core_nlp.inference_scheduler import InferenceScheduler
+from query_interface.core_nlp.prompt_builder import create_text_to_sql_prompt, get_sql_grammar
+from query_interface.core_nlp.sql_interpreter import execute_query, stream_query
+
+DEFAULT_CORPUS = os.path.join(settings.BASE_DIR, 'query_interface', 'benchmarks', 'nl2sql_corpus.json')
+# Stages in pipeline order; "total" is the whole question, as a user would wait for it.
+STAGES = (
+    'fast_path', 'prompt_build', 'queue_wait', 'prompt_eval', 'generation', 'sql_extraction', 'inference',
+    'sql_validation', 'sql_rewrite', 'sql_execution', 'total',
+)
+CACHES = ('question', 'prefix', 'result')
+ROUTES = ('cache', 'fast_path', 'llm')
+
+
+def percentile(values, q: float) -> float:
+    """Linearly interpolated percentile (0-100) of a non-empty list."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(values, scale: float = 1.0):
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values) * scale, 3),
+        'p50': round(percentile(values, 50) * scale, 3),
+        'p95': round(percentile(values, 95) * scale, 3),
+        'p99': round(percentile(values, 99) * scale, 3),
+    }
+
+def _normalize(value):
+    # AVG() and friends may differ in the last bits between equivalent queries.
+    return round(value, 6) if isinstance(value, float) else value
+
+def fetch_result(sql: str, db_path: str, max_rows: int):
+    """Runs a query through the interpreter and returns (column count, rows, truncated)."""
+    rows = stream_query(sql, db_path)
+    try:
+        columns = next(rows)
+        result = []
+        for batch in rows:
+            result.extend(tuple(_normalize(value) for value in row) for row in batch)
+            if len(result) >= max_rows:
+                return len(columns), result[:max_rows], True
+        return len(columns), result, False
+    finally:
+        rows.close()
+
+def results_match(gold, predicted, ordered: bool) -> bool:
+    """Execution match: same column count and the same rows, in order only if the gold query sorts."""
+    if gold[0] != predicted[0]:
+        return False
+    if ordered:
+        return gold[1] == predicted[1]
+    return Counter(gold[1]) == Counter(predicted[1])
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a versioned corpus of questions with gold SQL through the full NL-to-SQL pipeline and reports "
+        "per-stage latency percentiles, tokens/sec, cache hit rates and execution-match accuracy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Corpus JSON file.")
+        parser.add_argument(
+            '--database', action='append', default=[], metavar='NAME=PATH',
+            help="Fixture database for a corpus database name (repeatable), e.g. "
+                 "synthetic=<file from generate_fixture_db>. 'sample' defaults to the project's own database.",
+        )
+        parser.add_argument('--case', action='append', default=[], help="Only run the case with this id (repeatable).")
+        parser.add_argument('--repeat', type=int, default=1, help="Passes over the corpus; later passes show cache effects.")
+        parser.add_argument('--backend', choices=['thread', 'process', 'remote'],
+                            default=getattr(settings, 'LEXIBASE_INFERENCE_BACKEND', 'thread'))
+        parser.add_argument('--threads', type=int, default=None, help="Threads for the model context.")
+        parser.add_argument('--context-size', type=int, default=None, help="Context size (n_ctx) of the model.")
+        parser.add_argument('--question-cache', action='store_true',
+                            help="Consult and fill the question cache, as the web views do. Off by default so every case reaches the model.")
+        parser.add_argument('--no-fast-path', action='store_true',
+                            help="Send every question to the model instead of answering simple ones by template.")
+        parser.add_argument('--no-warmup', action='store_true', help="Include the first generation's warm-up in the measurements.")
+        parser.add_argument('--max-rows', type=int, default=100_000, help="Rows compared per result for execution match.")
+        parser.add_argument('--label', default='', help="Free-form name for this configuration or release.")
+        parser.add_argument('--output', help="Write the full results to this JSON file.")
+        parser.add_argument('--baseline', help="Earlier results JSON to compare against.")
+
+    def handle(self, *args, **options):
+        corpus = self._load_corpus(options['corpus'])
+        databases = self._resolve_databases(options['database'])
+        cases, skipped = [], []
+        for case in corpus['cases']:
+            if options['case'] and case['id'] not in options['case']:
+                continue
+            db_path = databases.get(case['database'])
+            if not db_path or not os.path.exists(db_path):
+                skipped.append({'id': case['id'], 'reason': f"No fixture database for '{case['database']}'."})
+                continue
+            cases.append((case, db_path))
+        if not cases:
+            raise CommandError("No corpus case has a fixture database to run against.")
+        for entry in skipped:
+            self.stderr.write(f"Skipping {entry['id']}: {entry['reason']}")
+
+        if options['backend'] == 'remote' and (options['threads'] or options['context_size']):
+            self.stderr.write("--threads and --context-size have no effect with --backend remote; "
+                              "the model server's own settings apply.")
+        scheduler = InferenceScheduler(
+            workers=1,
+            max_queue=2,
+            default_timeout=3600,
+            backend=options['backend'],
+            threads_per_worker=options['threads'],
+            context_size=options['context_size'],
+        )
+        gold_results = {}
+        records = []
+        try:
+            # Uploads are profiled when they arrive, so profiling is not part of any measured question.
+            for db_path in sorted({db_path for _, db_path in cases}):
+                db_profile.build_profile(db_path)
+            if not options['no_warmup']:
+                # Model loading and the first evaluation are not part of any measured question.
+                case, db_path = cases[0]
+                scheduler.submit(create_text_to_sql_prompt(case['question'], db_path)).result()
+            caches_before = self._cache_counts()
+            for run in range(options['repeat']):
+                for case, db_path in cases:
+                    record = self._run_case(
+                        scheduler, case, db_path, options['question_cache'], not options['no_fast_path']
+                    )
+                    record['run'] = run + 1
+                    self._check_match(record, case, db_path, gold_results, options['max_rows'])
+                    records.append(record)
+                    self.stdout.write(
+                        f"[{run + 1}] {case['id']}: {record['stages_ms']['total']:.0f}ms via {record['route']} "
+                        f"{'match' if record['match'] else 'MISMATCH' if record['match'] is False else 'n/a'}"
+                        + (f" ({record['error']})" if record['error'] else "")
+                    )
+            caches_after = self._cache_counts()
+        except Exception as e:
+            raise CommandError(f"Benchmark failed: {e}")
+        finally:
+            scheduler.shutdown()
+
+        report = {
+            'corpus': {'path': options['corpus'], 'version': corpus['version'], 'cases': len(cases), 'skipped': skipped},
+            'config': self._config(options, scheduler),
+            'summary': self._summarize(records, caches_before, caches_after),
+            'cases': records,
+        }
+        self._print_summary(report['summary'])
+        if options['baseline']:
+            self._print_comparison(report, options['baseline'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def _load_corpus(self, path: str) -> dict:
+        try:
+            with open(path) as f:
+                corpus = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read corpus {path}: {e}")
+        if 'version' not in corpus or not isinstance(corpus.get('cases'), list):
+            raise CommandError(f"{path} is not a benchmark corpus (needs 'version' and 'cases').")
+        for case in corpus['cases']:
+            missing = {'id', 'database', 'question', 'gold_sql'} - case.keys()
+            if missing:
+                raise CommandError(f"Corpus case {case.get('id', '?')} is missing {', '.join(sorted(missing))}.")
+        return corpus
+
+    def _resolve_databases(self, overrides) -> dict:
+        databases = {'sample': str(settings.DATABASES['default']['NAME'])}
+        for override in overrides:
+            name, sep, path = override.partition('=')
+            if not sep or not name or not path:
+                raise CommandError(f"Expected --database NAME=PATH, got '{override}'.")
+            databases[name] = path
+        return databases
+
+    def _run_case(self, scheduler, case: dict, db_path: str, use_question_cache: bool, use_fast_path: bool) -> dict:
+        record = {
+            'id': case['id'], 'database': case['database'], 'question': case['question'],
+            'sql': None, 'route': None, 'route_ms': None, 'from_cache': False, 'error': None, 'match': None,
+            'prompt_tokens': None, 'generated_tokens': None, 'tokens_per_second': None,
+        }
+        started = time.perf_counter()
+        with metrics.trace('bench') as spans:
+            try:
+                fingerprint = get_db_fingerprint(db_path)
+                sql, record['route'] = fast_path.route(
+                    case['question'], db_path, fingerprint, use_cache=use_question_cache, use_fast_path=use_fast_path
+                )
+                record['from_cache'] = record['route'] == 'cache'
+                if sql is None:
+                    with metrics.span('prompt_build'):
+                        prompt = create_text_to_sql_prompt(case['question'], db_path)
+                        grammar = get_sql_grammar(db_path)
+                    job = scheduler.submit(prompt, grammar=grammar)
+                    with metrics.span('inference'):
+                        sql = job.result()
+                    self._record_tokens(record, job.stats)
+                record['route_ms'] = round((time.perf_counter() - started) * 1000, 3)
+                record['sql'] = sql
+                results = execute_query(sql, db_path)
+                if results['error']:
+                    record['error'] = results['error']
+                elif use_question_cache and record['route'] == 'llm':
+                    question_cache.store_sql(case['question'], fingerprint, sql, db_path)
+            except Exception as e:
+                record['error'] = f"{type(e).__name__}: {e}"
+        spans['total'] = time.perf_counter() - started
+        record['stages_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in spans.items()}
+        return record
+
+    def _record_tokens(self, record: dict, stats):
+        if not stats:
+            return
+        record['prompt_tokens'] = stats['prompt_tokens']
+        record['generated_tokens'] = stats['generated_tokens']
+        if stats['generation_seconds'] > 0:
+            record['tokens_per_second'] = round(stats['generated_tokens'] / stats['generation_seconds'], 3)
+
+    def _check_match(self, record: dict, case: dict, db_path: str, gold_results: dict, max_rows: int):
+        key = (case['database'], case['gold_sql'])
+        if key not in gold_results:
+            try:
+                gold_results[key] = fetch_result(case['gold_sql'], db_path, max_rows)
+            except Exception as e:
+                gold_results[key] = e
+        gold = gold_results[key]
+        if isinstance(gold, Exception):
+            record['error'] = record['error'] or f"Gold SQL failed: {gold}"
+            record['gold_error'] = True
+            return
+        if record['error']:
+            record['match'] = False
+            return
+        try:
+            predicted = fetch_result(record['sql'], db_path, max_rows)
+        except Exception as e:
+            record['error'], record['match'] = f"{type(e).__name__}: {e}", False
+            return
+        ordered = sqlglot.parse_one(case['gold_sql'], read="sqlite").args.get('order') is not None
+        record['match'] = results_match(gold, predicted, ordered)
+        record['truncated'] = gold[2] or predicted[2]
+
+    def _cache_counts(self) -> dict:
+        return {
+            (cache, result): metrics.CACHE_REQUESTS.value(cache=cache, result=result)
+            for cache in CACHES for result in ('hit', 'miss')
+        }
+
+    def _config(self, options: dict, scheduler) -> dict:
+        return {
+            'label': options['label'],
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'backend': scheduler.backend,
+            # The model server's context is configured where it runs, so it is unknown here.
+            'threads': None if scheduler.backend == 'remote' else scheduler.threads_per_worker,
+            'context_size': None if scheduler.backend == 'remote' else scheduler.context_size or llm_handler.MODEL_CONTEXT_SIZE,
+            'repeat': options['repeat'],
+            'question_cache': options['question_cache'],
+            'fast_path': fast_path.FAST_PATH_ENABLED and not options['no_fast_path'],
+            'fast_path_min_confidence': fast_path.FAST_PATH_MIN_CONFIDENCE,
+            'warmup': not options['no_warmup'],
+            'grammar': getattr(settings, 'LEXIBASE_GRAMMAR_ENABLED', False),
+            'prefix_cache': getattr(settings, 'LEXIBASE_PREFIX_CACHE_ENABLED', True),
+            'early_stop': getattr(settings, 'LEXIBASE_EARLY_STOP_ENABLED', True),
+            'schema_token_budget': getattr(settings, 'LEXIBASE_SCHEMA_TOKEN_BUDGET', 2048),
+            'profile': db_profile.PROFILE_ENABLED,
+            'metrics_enabled': metrics.METRICS_ENABLED,
+            'host': {
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'python': platform.python_version(),
+            },
+        }
+
+    def _summarize(self, records, caches_before: dict, caches_after: dict) -> dict:
+        evaluated = [record for record in records if not record.get('gold_error')]
+        matches = sum(1 for record in evaluated if record['match'])
+        cache_hit_rates = {}
+        for cache in CACHES:
+            hits = caches_after[(cache, 'hit')] - caches_before[(cache, 'hit')]
+            misses = caches_after[(cache, 'miss')] - caches_before[(cache, 'miss')]
+            cache_hit_rates[cache] = round(hits / (hits + misses), 3) if hits + misses else None
+        stages = {}
+        for stage in STAGES:
+            values = [record['stages_ms'][stage] for record in records if stage in record['stages_ms']]
+            if values:
+                stages[stage] = summarize(values)
+        routes = {}
+        for route in ROUTES:
+            routed = [record for record in records if record['route'] == route]
+            if routed:
+                routes[route] = {
+                    'share': round(len(routed) / len(records), 3),
+                    'execution_match': self._match_rate(routed),
+                    'sql_latency_ms': summarize([record['route_ms'] for record in routed if record['route_ms'] is not None]),
+                }
+        return {
+            'questions': len(records),
+            'errors': sum(1 for record in records if record['error']),
+            'execution_match': round(matches / len(evaluated), 4) if evaluated else None,
+            'routes': routes,
+            'stage_latency_ms': stages,
+            'tokens_per_second': summarize([r['tokens_per_second'] for r in records if r['tokens_per_second']]),
+            'prompt_tokens': summarize([r['prompt_tokens'] for r in records if r['prompt_tokens'] is not None]),
+            'generated_tokens': summarize([r['generated_tokens'] for r in records if r['generated_tokens'] is not None]),
+            'cache_hit_rates': cache_hit_rates,
+        }
+
+    @staticmethod
+    def _match_rate(records):
+        evaluated = [record for record in records if not record.get('gold_error')]
+        return round(sum(1 for record in evaluated if record['match']) / len(evaluated), 4) if evaluated else None
+
+    def _print_summary(self, summary: dict):
+        self.stdout.write(f"\n{'stage':<16} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'n':>5}")
+        for stage, row in summary['stage_latency_ms'].items():
+            self.stdout.write(f"{stage:<16} {row['p50']:>10} {row['p95']:>10} {row['p99']:>10} {row['count']:>5}")
+        rate = summary['tokens_per_second']
+        if rate:
+            self.stdout.write(f"tokens/sec: p50 {rate['p50']}, p95 {rate['p95']}, mean {rate['mean']}")
+        self.stdout.write(f"\n{'route':<16} {'share':>10} {'match':>10} {'p50 ms':>10} {'p95 ms':>10}")
+        for route, row in summary['routes'].items():
+            match = 'n/a' if row['execution_match'] is None else f"{row['execution_match']:.1%}"
+            latency = row['sql_latency_ms'] or {'p50': 'n/a', 'p95': 'n/a'}
+            self.stdout.write(f"{route:<16} {row['share']:>10.1%} {match:>10} {latency['p50']:>10} {latency['p95']:>10}")
+        hit_rates = ", ".join(
+            f"{cache} {'n/a' if value is None else f'{value:.1%}'}" for cache, value in summary['cache_hit_rates'].items()
+        )
+        self.stdout.write(f"cache hit rates: {hit_rates}")
+        accuracy = summary['execution_match']
+        self.stdout.write(self.style.SUCCESS(
+            f"execution match: {'n/a' if accuracy is None else f'{accuracy:.1%}'} "
+            f"over {summary['questions']} questions ({summary['errors']} errors)"
+        ))
+
+    def _print_comparison(self, report: dict, baseline_path: str):
+        try:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read baseline {baseline_path}: {e}")
+        if baseline['corpus']['version'] != report['corpus']['version']:
+            self.stderr.write(self.style.WARNING(
+                f"Baseline used corpus version {baseline['corpus']['version']}, "
+                f"this run {report['corpus']['version']}; the numbers are not comparable."
+            ))
+        current, previous = report['summary'], baseline['summary']
+        self.stdout.write(f"\nvs. {baseline['config'].get('label') or baseline_path}")
+        self.stdout.write(f"{'stage':<16} {'p50 ms':>18} {'p95 ms':>18}")
+        for stage, row in current['stage_latency_ms'].items():
+            old = previous['stage_latency_ms'].get(stage)
+            if old is None:
+                continue
+            self.stdout.write(
+                f"{stage:<16} {self._delta(old['p50'], row['p50']):>18} {self._delta(old['p95'], row['p95']):>18}"
+            )
+        if current['tokens_per_second'] and previous.get('tokens_per_second'):
+            self.stdout.write(f"tokens/sec p50: {self._delta(previous['tokens_per_second']['p50'], current['tokens_per_second']['p50'])}")
+        if current['execution_match'] is not None and previous.get('execution_match') is not None:
+            self.stdout.write(f"execution match: {previous['execution_match']:.1%} -> {current['execution_match']:.1%}")
+
+    @staticmethod
+    def _delta(old: float, new: float) -> str:
+        change = f"{(new - old) / old:+.0%}" if old else "n/a"
+        return f"{new} ({change})"
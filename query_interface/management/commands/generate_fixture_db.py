@@ -0,0 +1,322 @@
+# query_interface/management/commands/generate_fixture_db.py
+import os
+import sqlite3
+import time
+# numpy is installed with llama-cpp-python; it generates each batch of values in one call.
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+# Rows generated (and inserted with one executemany) per batch. Part of the output's
+# identity: each batch draws from its own seeded generator, so changing this changes the data.
+BATCH_ROWS = 100_000
+MIN_ROWS = 1_000
+
+SCHEMA = """
+CREATE TABLE regions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE customers (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    city TEXT NOT NULL,
+    region_id INTEGER NOT NULL REFERENCES regions(id),
+    signup_date TEXT NOT NULL
+);
+CREATE TABLE employees (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    job_title TEXT NOT NULL,
+    department TEXT NOT NULL,
+    salary REAL NOT NULL,
+    hire_date TEXT NOT NULL,
+    region_id INTEGER NOT NULL REFERENCES regions(id),
+    manager_id INTEGER REFERENCES employees(id)
+);
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    price REAL NOT NULL,
+    stock_quantity INTEGER NOT NULL
+);
+CREATE TABLE orders (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    employee_id INTEGER NOT NULL REFERENCES employees(id),
+    order_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total REAL NOT NULL
+);
+CREATE TABLE order_items (
+    id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    quantity INTEGER NOT NULL,
+    unit_price REAL NOT NULL
+);
+"""
+
+# Built after loading: maintaining them row by row would slow every insert.
+INDEXES = """
+CREATE INDEX customers_region_id ON customers (region_id);
+CREATE INDEX employees_department ON employees (department);
+CREATE INDEX employees_manager_id ON employees (manager_id);
+CREATE INDEX products_category_id ON products (category_id);
+CREATE INDEX orders_customer_id ON orders (customer_id);
+CREATE INDEX orders_employee_id ON orders (employee_id);
+CREATE INDEX orders_order_date ON orders (order_date);
+CREATE INDEX order_items_order_id ON order_items (order_id);
+CREATE INDEX order_items_product_id ON order_items (product_id);
+"""
+
+# Durability is pointless while building a file that is discarded if the build fails.
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = OFF;",
+    "PRAGMA synchronous = OFF;",
+    "PRAGMA locking_mode = EXCLUSIVE;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -262144;",  # 256 MiB, mostly for the index builds.
+)
+
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+CITIES = np.array([
+    'Springfield', 'Riverton', 'Lakeside', 'Fairview', 'Georgetown', 'Salem', 'Franklin', 'Clinton',
+    'Greenville', 'Bristol', 'Madison', 'Oakland', 'Ashland', 'Milton', 'Newport', 'Dover',
+])
+CITY_REGION_IDS = np.arange(len(CITIES)) % len(REGIONS) + 1
+CATEGORIES = ['Electronics', 'Books', 'Home Goods', 'Clothing', 'Toys', 'Sports', 'Grocery', 'Beauty']
+FIRST_NAMES = np.array([
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Daniel', 'Nancy', 'Matthew', 'Lisa', 'Anthony', 'Betty', 'Mark', 'Sandra', 'Steven', 'Ashley',
+])
+LAST_NAMES = np.array([
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson',
+])
+DEPARTMENTS = np.array(['Engineering', 'Sales', 'Marketing', 'HR', 'Support', 'Finance'])
+# Job titles by department, in DEPARTMENTS order.
+JOB_TITLES = np.array([
+    ['Software Engineer', 'Senior Software Engineer'],
+    ['Sales Representative', 'Account Executive'],
+    ['Marketing Specialist', 'Marketing Manager'],
+    ['HR Specialist', 'Recruiter'],
+    ['Support Agent', 'Support Lead'],
+    ['Accountant', 'Financial Analyst'],
+])
+PRODUCT_ADJECTIVES = np.array([
+    'Classic', 'Deluxe', 'Compact', 'Premium', 'Eco', 'Smart', 'Portable', 'Vintage', 'Ultra', 'Basic',
+])
+PRODUCT_NOUNS = np.array([
+    'Lamp', 'Chair', 'Speaker', 'Novel', 'Jacket', 'Blender', 'Backpack', 'Puzzle', 'Watch', 'Kettle',
+    'Headphones', 'Notebook', 'Sneakers', 'Mug', 'Camera', 'Cookbook', 'Scarf', 'Drone', 'Racket', 'Candle',
+])
+ORDER_STATUSES = np.array(['pending', 'shipped', 'delivered', 'cancelled', 'returned'])
+ORDER_STATUS_WEIGHTS = [0.08, 0.15, 0.67, 0.07, 0.03]
+EPOCH = np.datetime64('2018-01-01')
+DATE_SPAN_DAYS = 7 * 365
+
+
+def table_sizes(rows: int) -> dict:
+    """Splits a total row count across the tables; order items are about 2.5 per order."""
+    sizes = {
+        'customers': max(100, rows // 10),
+        'employees': max(20, rows // 100),
+        'products': max(50, rows // 50),
+    }
+    sizes['orders'] = max(100, int((rows - sum(sizes.values())) / 3.5))
+    return sizes
+
+def _dates(rng, count: int, start=EPOCH, span_days: int = DATE_SPAN_DAYS) -> list:
+    return (start + rng.integers(0, span_days, count)).astype(str).tolist()
+
+def _batches(seed: int, table_number: int, count: int):
+    """Yields (generator, first id, rows) per batch; every batch is seeded independently."""
+    for batch_number, start in enumerate(range(0, count, BATCH_ROWS)):
+        rng = np.random.default_rng([seed, table_number, batch_number])
+        yield rng, start + 1, min(BATCH_ROWS, count - start)
+
+
+def customer_rows(rng, first_id: int, count: int) -> list:
+    ids = range(first_id, first_id + count)
+    first_names = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), count)].tolist()
+    last_names = LAST_NAMES[rng.integers(0, len(LAST_NAMES), count)].tolist()
+    emails = [f"{first.lower()}.{last.lower()}{i}@example.com" for i, first, last in zip(ids, first_names, last_names)]
+    cities = rng.integers(0, len(CITIES), count)
+    return list(zip(
+        ids, first_names, last_names, emails, CITIES[cities].tolist(), CITY_REGION_IDS[cities].tolist(), _dates(rng, count),
+    ))
+
+def employee_rows(rng, first_id: int, count: int, managers: int) -> list:
+    ids = np.arange(first_id, first_id + count)
+    departments = rng.integers(0, len(DEPARTMENTS), count)
+    titles = JOB_TITLES[departments, rng.integers(0, JOB_TITLES.shape[1], count)]
+    salaries = np.round(rng.normal(85_000, 20_000, count).clip(35_000, 250_000), -2)
+    # The first `managers` employees report to nobody; everyone else reports to one of them.
+    manager_ids = np.where(ids > managers, rng.integers(1, managers + 1, count), 0)
+    return list(zip(
+        ids.tolist(),
+        FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), count)].tolist(),
+        LAST_NAMES[rng.integers(0, len(LAST_NAMES), count)].tolist(),
+        titles.tolist(),
+        DEPARTMENTS[departments].tolist(),
+        salaries.tolist(),
+        _dates(rng, count, start=EPOCH - 3650, span_days=3650 + DATE_SPAN_DAYS),
+        rng.integers(1, len(REGIONS) + 1, count).tolist(),
+        [manager_id or None for manager_id in manager_ids.tolist()],
+    ))
+
+def product_rows(rng, first_id: int, count: int) -> tuple:
+    """Returns the rows and their prices, which order items are priced from."""
+    names = np.char.add(
+        np.char.add(PRODUCT_ADJECTIVES[rng.integers(0, len(PRODUCT_ADJECTIVES), count)], ' '),
+        PRODUCT_NOUNS[rng.integers(0, len(PRODUCT_NOUNS), count)],
+    )
+    prices = np.round(rng.lognormal(3.5, 0.9, count).clip(1, 5_000), 2)
+    rows = list(zip(
+        range(first_id, first_id + count),
+        names.tolist(),
+        rng.integers(1, len(CATEGORIES) + 1, count).tolist(),
+        prices.tolist(),
+        # About one product in twelve is out of stock.
+        np.where(rng.random(count) < 0.08, 0, rng.integers(1, 500, count)).tolist(),
+    ))
+    return rows, prices
+
+def order_rows(rng, first_id: int, count: int, first_item_id: int, sizes: dict, prices) -> tuple:
+    """Returns a batch of orders and their items; each order's total is the sum of its items."""
+    items_per_order = rng.integers(1, 5, count)
+    item_count = int(items_per_order.sum())
+    item_orders = np.repeat(np.arange(count), items_per_order)
+    product_ids = rng.integers(1, sizes['products'] + 1, item_count)
+    quantities = rng.integers(1, 6, item_count)
+    unit_prices = prices[product_ids - 1]
+    totals = np.round(np.bincount(item_orders, weights=quantities * unit_prices, minlength=count), 2)
+    orders = list(zip(
+        range(first_id, first_id + count),
+        rng.integers(1, sizes['customers'] + 1, count).tolist(),
+        rng.integers(1, sizes['employees'] + 1, count).tolist(),
+        _dates(rng, count),
+        ORDER_STATUSES[rng.choice(len(ORDER_STATUSES), count, p=ORDER_STATUS_WEIGHTS)].tolist(),
+        totals.tolist(),
+    ))
+    items = list(zip(
+        range(first_item_id, first_item_id + item_count),
+        (item_orders + first_id).tolist(),
+        product_ids.tolist(),
+        quantities.tolist(),
+        unit_prices.tolist(),
+    ))
+    return orders, items
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a deterministic SQLite fixture database (customers, employees, products, orders, order "
+        "items) of roughly the requested size, for benchmarks and load tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the database file to create.")
+        parser.add_argument('--rows', type=int, default=100_000,
+                            help="Approximate total rows across all tables (e.g. 10000 to 100000000).")
+        parser.add_argument('--seed', type=int, default=0, help="The same seed and row count always produce the same data.")
+        parser.add_argument('--overwrite', action='store_true', help="Replace the output file if it exists.")
+
+    def handle(self, *args, **options):
+        output, rows, seed = options['output'], options['rows'], options['seed']
+        if rows < MIN_ROWS:
+            raise CommandError(f"--rows must be at least {MIN_ROWS}.")
+        if os.path.exists(output) and not options['overwrite']:
+            raise CommandError(f"{output} already exists. Pass --overwrite to replace it.")
+        # Build under a temporary name, so a failed or interrupted run never leaves a partial database.
+        partial_path = f"{output}.partial"
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+        sizes = table_sizes(rows)
+        started = time.perf_counter()
+        con = sqlite3.connect(partial_path, isolation_level=None)
+        try:
+            for pragma in BULK_LOAD_PRAGMAS:
+                con.execute(pragma)
+            con.executescript(SCHEMA)
+            total = self._load(con, sizes, seed)
+            self._timed("indexes", lambda: con.executescript(INDEXES))
+            self._timed("statistics", lambda: con.execute("ANALYZE;"))
+            con.execute("PRAGMA journal_mode = DELETE;")
+        except BaseException:
+            con.close()
+            os.remove(partial_path)
+            raise
+        con.close()
+        os.replace(partial_path, output)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {total:,} rows to {output} ({os.path.getsize(output) / 1024 / 1024:.1f} MiB) "
+            f"in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s), seed {seed}."
+        ))
+
+    def _load(self, con, sizes: dict, seed: int) -> int:
+        total = 0
+        total += self._insert(con, 'regions', [(i + 1, name) for i, name in enumerate(REGIONS)])
+        total += self._insert(con, 'categories', [(i + 1, name) for i, name in enumerate(CATEGORIES)])
+        total += self._insert_batches(con, 'customers', (
+            customer_rows(rng, first_id, count) for rng, first_id, count in _batches(seed, 1, sizes['customers'])
+        ))
+        managers = max(1, sizes['employees'] // 10)
+        total += self._insert_batches(con, 'employees', (
+            employee_rows(rng, first_id, count, managers) for rng, first_id, count in _batches(seed, 2, sizes['employees'])
+        ))
+        price_batches = []
+        def products():
+            for rng, first_id, count in _batches(seed, 3, sizes['products']):
+                rows, prices = product_rows(rng, first_id, count)
+                price_batches.append(prices)
+                yield rows
+        total += self._insert_batches(con, 'products', products())
+        prices = np.concatenate(price_batches)
+
+        start = time.perf_counter()
+        orders = items = 0
+        con.execute("BEGIN;")
+        for rng, first_id, count in _batches(seed, 4, sizes['orders']):
+            order_batch, item_batch = order_rows(rng, first_id, count, items + 1, sizes, prices)
+            con.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?);", order_batch)
+            con.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?);", item_batch)
+            orders += len(order_batch)
+            items += len(item_batch)
+        con.execute("COMMIT;")
+        self.stdout.write(f"orders: {orders:,} rows, order_items: {items:,} rows in {time.perf_counter() - start:.1f}s")
+        return total + orders + items
+
+    def _insert(self, con, table: str, rows: list) -> int:
+        return self._insert_batches(con, table, [rows])
+
+    def _insert_batches(self, con, table: str, batches) -> int:
+        """Inserts every batch in a single transaction."""
+        start = time.perf_counter()
+        count = 0
+        con.execute("BEGIN;")
+        for rows in batches:
+            placeholders = ", ".join("?" * len(rows[0]))
+            con.executemany(f"INSERT INTO {table} VALUES ({placeholders});", rows)
+            count += len(rows)
+        con.execute("COMMIT;")
+        self.stdout.write(f"{table}: {count:,} rows in {time.perf_counter() - start:.1f}s")
+        return count
+
+    def _timed(self, label: str, step):
+        start = time.perf_counter()
+        step()
+        self.stdout.write(f"{label}: {time.perf_counter() - start:.1f}s")
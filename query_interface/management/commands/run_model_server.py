@@ -0,0 +1,17 @@
+# query_interface/management/commands/run_model_server.py
+from django.core.management.base import BaseCommand
+
+from query_interface.core_nlp import model_server
+
+
+class Command(BaseCommand):
+    help = "Loads the model once and serves SQL generation to Django workers running with LEXIBASE_MODEL_STARTUP = 'remote'."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=None, help=f"Unix socket path (default: {model_server.SOCKET_PATH}).")
+
+    def handle(self, *args, **options):
+        try:
+            model_server.serve(options['socket'])
+        except KeyboardInterrupt:
+            self.stdout.write("Model server stopped.")
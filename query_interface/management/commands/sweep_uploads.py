@@ -0,0 +1,29 @@
+# query_interface/management/commands/sweep_uploads.py
+import json
+from django.core.management.base import BaseCommand
+
+from query_interface.core_nlp import upload_janitor, upload_store
+
+
+class Command(BaseCommand):
+    help = "Deletes uploaded databases no live session references and enforces the upload disk quota."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="Print the sweep report as JSON.")
+
+    def handle(self, *args, **options):
+        report = upload_janitor.sweep()
+        report['store'] = upload_store.get_store_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"Released {report['released']} stale references; deleted {report['unreferenced']} unreferenced, "
+            f"{report['untracked']} untracked, {report['incoming']} interrupted and {report['legacy']} legacy files; "
+            f"evicted {report['evicted']} databases over quota; closed {report['idle_pools_closed']} idle pools."
+        )
+        store = report['store']
+        self.stdout.write(self.style.SUCCESS(
+            f"Store: {store['objects']} databases, {store['stored_bytes']} bytes "
+            f"(quota {store['global_quota_bytes']}), {store['references']} session references."
+        ))
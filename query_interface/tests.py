@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from unittest import mock, skipIf
 
-# Create your tests here.
+import sqlglot
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import Client, SimpleTestCase
+
+from .core_nlp import (
+    batch_runner, db_pool, db_profile, duckdb_engine, fast_path, hot_tier, inference_scheduler, llm_handler, metrics, prompt_builder, query_guard, question_cache, schema_index,
+    upload_store,
+)
+from .core_nlp.cache import LRUCache
+from .core_nlp.db_profile import PROFILE_SUFFIX
+from .core_nlp.query_rewriter import apply_page_limit, optimize_select, push_limit_into_cte, streamed_row_limit
+from .core_nlp.sql_grammar import build_select_grammar
+from .core_nlp.sql_interpreter import choose_engine, execute_query, stream_query
+from .management.commands.bench_nl2sql import percentile, results_match
+from .management.commands.generate_fixture_db import table_sizes
+from . import views
+
+
+def create_database(directory: str, statements) -> str:
+    path = os.path.join(directory, 'test.db')
+    with sqlite3.connect(path) as con:
+        for statement in statements:
+            con.execute(statement)
+    con.close()
+    return path
+
+
+class FastPathTranslateTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.db_path = create_database(cls.temp_dir.name, [
+            "CREATE TABLE employee (id INTEGER PRIMARY KEY, first_name TEXT, department TEXT, "
+            "salary REAL, hire_date DATE)",
+            "CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price REAL, stock INTEGER)",
+        ])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+        super().tearDownClass()
+
+    def translate(self, question):
+        return fast_path.translate(question, self.db_path)
+
+    def assertTranslates(self, question, template, sql):
+        result = self.translate(question)
+        self.assertIsNotNone(result, question)
+        self.assertEqual(result['template'], template)
+        self.assertEqual(result['sql'], sql)
+
+    def test_count(self):
+        self.assertTranslates("How many employees are there?", 'count', "SELECT COUNT(*) FROM employee")
+        self.assertTranslates(
+            "How many employees per department?", 'count',
+            "SELECT department, COUNT(*) FROM employee GROUP BY department",
+        )
+
+    def test_aggregate(self):
+        self.assertTranslates("What is the average salary of employees?", 'aggregate', "SELECT AVG(salary) FROM employee")
+        self.assertTranslates(
+            "Average salary per department", 'aggregate',
+            "SELECT department, AVG(salary) FROM employee GROUP BY department",
+        )
+
+    def test_aggregate_rejects_sum_of_text(self):
+        self.assertIsNone(self.translate("What is the total first name of employees?"))
+
+    def test_top_ranks_highest_first(self):
+        self.assertTranslates(
+            "Top 5 products by price", 'top', "SELECT * FROM product ORDER BY price DESC LIMIT 5",
+        )
+        self.assertTranslates(
+            "Bottom 3 products by price", 'top', "SELECT * FROM product ORDER BY price ASC LIMIT 3",
+        )
+
+    def test_top_follows_the_extreme(self):
+        self.assertTranslates(
+            "Show the top 3 products with the lowest price", 'top',
+            "SELECT * FROM product ORDER BY price ASC LIMIT 3",
+        )
+        self.assertTranslates(
+            "First 2 products with the highest stock", 'top',
+            "SELECT * FROM product ORDER BY stock DESC LIMIT 2",
+        )
+        self.assertTranslates(
+            "Last 2 products with the highest stock", 'top',
+            "SELECT * FROM product ORDER BY stock ASC LIMIT 2",
+        )
+
+    def test_first_and_last_read_the_column_in_order(self):
+        self.assertTranslates(
+            "First 10 employees by hire date", 'top', "SELECT * FROM employee ORDER BY hire_date ASC LIMIT 10",
+        )
+        self.assertTranslates(
+            "Last 10 employees by hire date", 'top', "SELECT * FROM employee ORDER BY hire_date DESC LIMIT 10",
+        )
+        self.assertTranslates(
+            "List the first five products sorted by name", 'top', "SELECT * FROM product ORDER BY name ASC LIMIT 5",
+        )
+
+    def test_top_by_text_column_is_not_confident(self):
+        self.assertIsNone(self.translate("Top 5 products by name"))
+
+    def test_distinct(self):
+        self.assertTranslates(
+            "List the distinct departments of employees", 'distinct', "SELECT DISTINCT department FROM employee",
+        )
+
+    def test_list_columns(self):
+        self.assertTranslates(
+            "Show the name and price of all products", 'list_columns', "SELECT name, price FROM product",
+        )
+
+    def test_list(self):
+        self.assertTranslates("List all employees", 'list', "SELECT * FROM employee")
+
+    def test_unknown_names_go_to_the_model(self):
+        self.assertIsNone(self.translate("How many invoices are there?"))
+        self.assertIsNone(self.translate("Which employees earn more than their manager?"))
+
+
+def parse(sql: str):
+    return sqlglot.parse_one(sql, read="sqlite")
+
+
+class BenchmarkScoringTests(SimpleTestCase):
+    def test_percentile_interpolates(self):
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertEqual(percentile([10, 20], 50), 15)
+        self.assertEqual(percentile([10, 20, 30, 40], 100), 40)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_results_match_ignores_order_unless_the_gold_query_sorts(self):
+        gold = (2, [(1, 'a'), (2, 'b')], False)
+        reversed_rows = (2, [(2, 'b'), (1, 'a')], False)
+        self.assertTrue(results_match(gold, reversed_rows, ordered=False))
+        self.assertFalse(results_match(gold, reversed_rows, ordered=True))
+
+    def test_results_match_compares_duplicates_and_column_counts(self):
+        gold = (1, [(1,), (1,), (2,)], False)
+        self.assertFalse(results_match(gold, (1, [(1,), (2,), (2,)], False), ordered=False))
+        self.assertFalse(results_match(gold, (2, [(1, 1), (1, 1), (2, 2)], False), ordered=False))
+
+
+class PaginationTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.db_path = create_database(cls.temp_dir.name, [
+            "CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT, price REAL)",
+            "CREATE VIEW cheap_item AS SELECT * FROM item WHERE price < 100",
+        ] + [f"INSERT INTO item VALUES ({i}, 'item {i}', {i * 1.5})" for i in range(1, 251)])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+        super().tearDownClass()
+
+    def test_row_listings_use_keyset_pages(self):
+        first = execute_query("SELECT id, name FROM item", self.db_path, page_size=100)
+        self.assertIsNone(first['error'])
+        self.assertEqual(first['columns'], ['id', 'name'])
+        self.assertEqual(first['page']['mode'], 'keyset')
+        self.assertEqual([row[0] for row in first['results']], list(range(1, 101)))
+        self.assertTrue(first['page']['has_next'])
+        self.assertEqual(first['page']['next_after'], 100)
+
+        second = execute_query("SELECT id, name FROM item", self.db_path, page=2, page_size=100, after=100)
+        self.assertEqual(second['page']['mode'], 'keyset')
+        self.assertEqual([row[0] for row in second['results']], list(range(101, 201)))
+
+        last = execute_query("SELECT id, name FROM item", self.db_path, page=3, page_size=100, after=200)
+        self.assertEqual(len(last['results']), 50)
+        self.assertFalse(last['page']['has_next'])
+        self.assertEqual(last['page']['total_rows'], 250)
+        self.assertTrue(last['page']['total_exact'])
+
+    def test_keyset_pages_keep_the_where_clause(self):
+        result = execute_query("SELECT id FROM item WHERE id % 2 = 0", self.db_path, page_size=10, after=100)
+        self.assertEqual([row[0] for row in result['results']], list(range(102, 122, 2)))
+
+    def test_sorted_queries_use_offset_pages(self):
+        result = execute_query("SELECT id FROM item ORDER BY price DESC", self.db_path, page=2, page_size=100)
+        self.assertEqual(result['page']['mode'], 'offset')
+        self.assertEqual([row[0] for row in result['results']], list(range(150, 50, -1)))
+        self.assertTrue(result['page']['has_next'])
+
+    def test_offset_pages_respect_the_query_limit(self):
+        result = execute_query("SELECT id FROM item ORDER BY id LIMIT 150", self.db_path, page=2, page_size=100)
+        self.assertEqual([row[0] for row in result['results']], list(range(101, 151)))
+        self.assertFalse(result['page']['has_next'])
+        beyond = execute_query("SELECT id FROM item ORDER BY id LIMIT 150", self.db_path, page=3, page_size=100)
+        self.assertEqual(beyond['results'], [])
+
+    def test_views_fall_back_to_offset_pages(self):
+        result = execute_query("SELECT id FROM cheap_item", self.db_path, page_size=10)
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['page']['mode'], 'offset')
+        self.assertEqual([row[0] for row in result['results']], list(range(1, 11)))
+
+    def test_headers_follow_the_sql_as_written(self):
+        result = execute_query("SELECT COUNT(*), MAX(price) AS top_price FROM item", self.db_path)
+        self.assertEqual(result['columns'], ['COUNT(*)', 'top_price'])
+        self.assertEqual(result['results'], [(250, 375.0)])
+
+    def test_headers_keep_duplicates_and_expression_text(self):
+        result = execute_query("SELECT name, name, max( price ) FROM item WHERE id < 3 LIMIT 1 -- first", self.db_path)
+        self.assertEqual(result['columns'], ['name', 'name', 'max( price )'])
+        rows = stream_query("SELECT id, id, count(*) FROM item;", self.db_path)
+        try:
+            self.assertEqual(next(rows), ['id', 'id', 'count(*)'])
+            self.assertEqual(next(rows), [(1, 1, 250)])
+        finally:
+            rows.close()
+
+    def test_export_time_limit_ignores_time_spent_waiting_on_the_client(self):
+        rows = stream_query("SELECT id FROM item", self.db_path, batch_size=100)
+        with mock.patch('query_interface.core_nlp.sql_interpreter.EXPORT_TIME_LIMIT', 0.2):
+            batches = [next(rows)]
+            for batch in rows:
+                batches.append(batch)
+                time.sleep(0.15)
+        self.assertEqual([len(batch) for batch in batches[1:]], [100, 100, 50])
+
+    def test_plan_check_covers_the_page_that_runs(self):
+        with mock.patch.object(query_guard, 'PLAN_POLICY', 'reject'), mock.patch.object(query_guard, 'MAX_PLAN_ROWS', 120):
+            listing = execute_query("SELECT * FROM item", self.db_path, page_size=50)
+            self.assertIsNone(listing['error'])
+            limited = execute_query("SELECT name FROM item LIMIT 50", self.db_path, page=2, page_size=20)
+            self.assertIsNone(limited['error'])
+            with self.assertLogs('query_interface.core_nlp.sql_interpreter', 'WARNING'):
+                sorted_page = execute_query("SELECT name FROM item ORDER BY name LIMIT 50", self.db_path)
+            self.assertEqual(sorted_page['error_type'], 'guardrail')
+
+    def test_only_single_selects_run(self):
+        for sql in ("DELETE FROM item", "SELECT 1; SELECT 2", "UPDATE item SET price = 0"):
+            with self.assertLogs('query_interface.core_nlp.sql_interpreter', 'ERROR'):
+                result = execute_query(sql, self.db_path)
+            self.assertEqual(result['error_type'], 'interpreter', sql)
+
+
+class DuckDBEngineTests(SimpleTestCase):
+    ROWS = [('east', 3), (None, 1), ('west', None), ('east', None), (None, 2)]
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.db_path = create_database(self.temp_dir.name, [
+            "CREATE TABLE sale (id INTEGER PRIMARY KEY, region TEXT, amount INTEGER)",
+            "CREATE TABLE region (name TEXT)",
+        ])
+        self.con = sqlite3.connect(self.db_path)
+        self.addCleanup(self.con.close)
+        self.con.executemany("INSERT INTO sale (region, amount) VALUES (?, ?)", self.ROWS)
+
+    def engine(self, sql, available=True):
+        row_counts = {'sale': 2_000_000, 'region': 10}
+        with mock.patch.object(duckdb_engine, 'is_available', return_value=available):
+            return choose_engine(self.con.cursor(), sqlglot.parse_one(sql, read="sqlite"), row_counts)
+
+    def test_large_analytical_queries_go_to_duckdb(self):
+        self.assertEqual(self.engine("SELECT region, SUM(amount) FROM sale GROUP BY region"), 'duckdb')
+        self.assertEqual(self.engine("SELECT * FROM sale ORDER BY amount"), 'duckdb')
+        self.assertEqual(self.engine("SELECT region, SUM(amount) FROM sale GROUP BY region", available=False), 'sqlite')
+
+    def test_listings_small_tables_and_sqlite_semantics_stay_on_sqlite(self):
+        self.assertEqual(self.engine("SELECT * FROM sale WHERE region = 'east'"), 'sqlite')
+        self.assertEqual(self.engine("SELECT name, COUNT(*) FROM region GROUP BY name"), 'sqlite')
+        self.assertEqual(self.engine("SELECT region, SUM(amount) / 2 FROM sale GROUP BY region"), 'sqlite')
+        self.assertEqual(self.engine("SELECT date(MAX(amount), '+1 day') FROM sale"), 'sqlite')
+
+    @skipIf(duckdb_engine.duckdb is None, "DuckDB is not installed.")
+    def test_null_order_matches_sqlite(self):
+        duck = duckdb_engine.duckdb.connect(':memory:')
+        self.addCleanup(duck.close)
+        duck.execute("CREATE TABLE sale (id INTEGER, region VARCHAR, amount INTEGER)")
+        duck.executemany("INSERT INTO sale VALUES (?, ?, ?)", [(i, *row) for i, row in enumerate(self.ROWS, 1)])
+        for sql in (
+            "SELECT amount FROM sale ORDER BY amount",
+            "SELECT amount FROM sale ORDER BY amount DESC",
+            "SELECT region, COUNT(*) FROM sale GROUP BY region",
+            "SELECT region, SUM(amount) FROM sale GROUP BY region ORDER BY 2 DESC",
+        ):
+            query = duckdb_engine.stable_order(sqlglot.parse_one(sql, read="sqlite"))
+            expected = self.con.execute(query.sql(dialect="sqlite")).fetchall()
+            self.assertEqual(duck.execute(duckdb_engine.transpile(query)).fetchall(), expected, sql)
+
+
+class QueryRewriterTests(SimpleTestCase):
+    def test_page_limit_folds_into_a_literal_limit(self):
+        paged = apply_page_limit(parse("SELECT a FROM t LIMIT 10 OFFSET 5"), 4, 8)
+        self.assertEqual(paged.sql(dialect="sqlite"), "SELECT a FROM t LIMIT 2 OFFSET 13")
+        self.assertEqual(apply_page_limit(parse("SELECT a FROM t"), 4).sql(dialect="sqlite"), "SELECT a FROM t LIMIT 4")
+
+    def test_page_past_the_query_limit_is_empty(self):
+        self.assertIsNone(apply_page_limit(parse("SELECT a FROM t LIMIT 10"), 4, 12))
+
+    def test_computed_limit_is_paged_as_a_subquery(self):
+        paged = apply_page_limit(parse("SELECT a FROM t LIMIT (SELECT 3)"), 4)
+        self.assertEqual(
+            paged.sql(dialect="sqlite"), "SELECT * FROM (SELECT a FROM t LIMIT (SELECT 3)) AS page_source LIMIT 4",
+        )
+
+    def test_streamed_row_limit(self):
+        self.assertEqual(streamed_row_limit(parse("SELECT a FROM t WHERE b > 1 LIMIT 10 OFFSET 5")), 15)
+        self.assertIsNone(streamed_row_limit(parse("SELECT a FROM t")))
+        self.assertIsNone(streamed_row_limit(parse("SELECT a, COUNT(*) FROM t GROUP BY a LIMIT 10")))
+        self.assertIsNone(streamed_row_limit(parse("SELECT MAX(a) FROM t LIMIT 10")))
+
+    def test_limit_is_pushed_into_a_projected_cte(self):
+        query = push_limit_into_cte(parse("WITH c AS (SELECT a FROM t) SELECT a FROM c LIMIT 5 OFFSET 2"))
+        self.assertEqual(query.sql(dialect="sqlite"), "WITH c AS (SELECT a FROM t LIMIT 7) SELECT a FROM c LIMIT 5 OFFSET 2")
+
+    def test_limit_is_not_pushed_past_an_order_by(self):
+        sql = "WITH c AS (SELECT a FROM t) SELECT a FROM c ORDER BY a LIMIT 5"
+        self.assertEqual(push_limit_into_cte(parse(sql)).sql(dialect="sqlite"), sql)
+
+    def test_optimizer_merges_subqueries_and_drops_unused_ctes(self):
+        tables = {'t': ['a', 'b']}
+        merged = optimize_select(parse("SELECT * FROM (SELECT a, b FROM t) AS s WHERE s.a > 1 AND 1 = 1"), tables)
+        self.assertEqual(merged.sql(dialect="sqlite"), "SELECT t.a AS a, t.b AS b FROM t AS t WHERE t.a > 1")
+        pruned = optimize_select(parse("WITH c AS (SELECT a FROM t), d AS (SELECT b FROM t) SELECT a FROM c"), tables)
+        self.assertEqual(pruned.sql(dialect="sqlite"), "SELECT t.a AS a FROM t AS t")
+
+
+class QueryGuardTests(SimpleTestCase):
+    def setUp(self):
+        self.con = sqlite3.connect(':memory:')
+        self.con.executescript(
+            "CREATE TABLE a (id INTEGER PRIMARY KEY, x INTEGER);"
+            "CREATE TABLE b (id INTEGER PRIMARY KEY, y INTEGER);"
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 50) INSERT INTO a (x) SELECT i FROM n;"
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 40) INSERT INTO b (y) SELECT i FROM n;"
+        )
+        self.cursor = self.con.cursor()
+
+    def tearDown(self):
+        self.con.close()
+
+    def test_table_rows_prefer_known_counts(self):
+        self.assertEqual(query_guard.estimate_table_rows(self.cursor, 'a'), 50)
+        self.assertEqual(query_guard.estimate_table_rows(self.cursor, 'a', {'a': 7}), 7)
+        self.assertIsNone(query_guard.estimate_table_rows(self.cursor, 'missing'))
+
+    def test_views_are_not_estimated(self):
+        self.con.execute("CREATE VIEW heavy AS SELECT a.x, b.y, c.x AS z FROM a, b, a AS c")
+        steps = []
+        self.con.set_progress_handler(lambda: steps.append(1), 1000)
+        self.assertIsNone(query_guard.estimate_table_rows(self.cursor, 'heavy'))
+        self.assertEqual(query_guard.estimate_table_rows(self.cursor, 'A'), 50)
+        self.con.set_progress_handler(None, 1000)
+        # Computing the view (50 * 40 * 50 rows) would take far more VM steps.
+        self.assertLess(len(steps), 10)
+
+    def test_plan_multiplies_nested_scans(self):
+        report = query_guard.inspect_query_plan(self.cursor, "SELECT * FROM a, b", {})
+        self.assertGreaterEqual(report['estimated_rows'], 50 * 40)
+        self.assertTrue(any('Cartesian product' in warning for warning in report['warnings']))
+
+    def test_indexed_lookups_are_not_multiplied(self):
+        report = query_guard.inspect_query_plan(self.cursor, "SELECT * FROM a JOIN b ON b.id = a.x", {})
+        self.assertLess(report['estimated_rows'], 2 * 50)
+        self.assertEqual(report['warnings'], [])
+
+    def test_expensive_plans_are_rejected(self):
+        with mock.patch.object(query_guard, 'PLAN_POLICY', 'reject'), mock.patch.object(query_guard, 'MAX_PLAN_ROWS', 100):
+            with self.assertRaises(query_guard.QueryTooExpensive):
+                query_guard.check_query_plan(self.cursor, "SELECT * FROM a, b", {})
+            self.assertEqual(query_guard.check_query_plan(self.cursor, "SELECT * FROM a", {}), [])
+        with mock.patch.object(query_guard, 'PLAN_POLICY', 'warn'), mock.patch.object(query_guard, 'MAX_PLAN_ROWS', 100):
+            self.assertTrue(query_guard.check_query_plan(self.cursor, "SELECT * FROM a, b", {}))
+
+    def test_literal_limit_caps_streaming_plans(self):
+        with mock.patch.object(query_guard, 'PLAN_POLICY', 'reject'), mock.patch.object(query_guard, 'MAX_PLAN_ROWS', 100):
+            self.assertEqual(query_guard.check_query_plan(self.cursor, "SELECT * FROM a, b LIMIT 50", {}, limit=50), [
+                "Cartesian product: b is scanned once for every row of a.",
+            ])
+            # A sort reads every row before the first one comes out.
+            with self.assertRaises(query_guard.QueryTooExpensive):
+                query_guard.check_query_plan(self.cursor, "SELECT * FROM a, b ORDER BY a.x + b.y LIMIT 50", {}, limit=50)
+
+    def test_step_budget_stops_runaway_queries(self):
+        runaway = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+        with self.assertRaises(query_guard.QueryBudgetExceeded):
+            with query_guard.execution_budget(self.con, max_steps=100_000):
+                self.cursor.execute(runaway).fetchall()
+        # The handler is removed afterwards, so the connection is usable again.
+        self.assertEqual(self.cursor.execute("SELECT COUNT(*) FROM a").fetchone(), (50,))
+
+    def test_time_budget_stops_runaway_queries(self):
+        runaway = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+        started = time.monotonic()
+        with self.assertRaises(query_guard.QueryBudgetExceeded):
+            with query_guard.execution_budget(self.con, time_limit=0.2):
+                self.cursor.execute(runaway).fetchall()
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_time_spent_by_earlier_steps_counts_against_the_limit(self):
+        with self.assertRaises(query_guard.QueryBudgetExceeded):
+            with query_guard.execution_budget(self.con, time_limit=1, time_spent=1.5):
+                self.cursor.execute("SELECT COUNT(*) FROM a").fetchall()
+
+
+class SqlGrammarTests(SimpleTestCase):
+    def setUp(self):
+        self.grammar = build_select_grammar({'employee': ['id', 'salary'], 'pay grade': ['max pay']})
+        self.rules = dict(line.split(' ::= ', 1) for line in self.grammar.splitlines() if ' ::= ' in line)
+
+    def test_every_referenced_rule_is_defined(self):
+        for name, body in self.rules.items():
+            # Rule names are what remains once literals and character classes are removed.
+            body = re.sub(r'"(\\.|[^"\\])*"|\[(\\.|[^\]\\])*\]', '', body)
+            for reference in re.findall(r'[a-z][a-z0-9-]*', body):
+                self.assertIn(reference, self.rules, f"{name} refers to {reference}")
+
+    def test_schema_names_are_quoted_when_needed(self):
+        self.assertEqual(self.rules['table-name'], '"employee" | "\\"employee\\"" | "\\"pay grade\\""')
+
+    def test_declared_names_can_be_referenced(self):
+        # CTE names, table aliases and result column aliases all use the rule column references admit.
+        for rule, declaration in (('cte', 'alias-name ws1 "AS"'), ('alias', 'alias-name'), ('result-column', '"AS" ws1 alias-name')):
+            self.assertIn(declaration, self.rules[rule])
+        self.assertIn('alias-name', self.rules['column-ref'])
+        # Free identifiers are only the fallback for an empty schema.
+        self.assertEqual([name for name, body in self.rules.items() if 'free-name' in body], [])
+
+    def test_set_operations_are_not_generated(self):
+        # parse_select only runs a single SELECT.
+        for operator in ('UNION', 'INTERSECT', 'EXCEPT'):
+            self.assertNotIn(operator, self.grammar)
+
+
+class SchemaIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.db_path = create_database(self.temp_dir.name, [
+            "CREATE TABLE department (id INTEGER PRIMARY KEY, name TEXT)",
+            "CREATE TABLE employee (id INTEGER PRIMARY KEY, first_name TEXT, salary REAL, "
+            "department_id INTEGER REFERENCES department (id))",
+            "CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price REAL)",
+            "CREATE TABLE warehouse (id INTEGER PRIMARY KEY, city TEXT)",
+            "INSERT INTO warehouse (city) VALUES ('Lisbon'), ('Oslo')",
+        ])
+        patcher = mock.patch.object(schema_index, 'index_cache', LRUCache(max_entries=4))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = schema_index.build_schema_index(self.db_path)
+
+    def select(self, question, top_k=1, token_budget=1000):
+        schema = schema_index.select_relevant_schema(self.index, question, top_k, token_budget)
+        return re.findall(r'CREATE TABLE (\w+)', schema)
+
+    def test_best_table_comes_with_its_foreign_key_neighbors(self):
+        self.assertEqual(self.select("What is the average salary of employees?"), ['employee', 'department'])
+
+    def test_sampled_values_identify_a_table(self):
+        self.assertEqual(self.select("Which stock is held in Lisbon?"), ['warehouse'])
+
+    def test_token_budget_drops_lower_ranked_tables(self):
+        self.assertEqual(self.select("What is the average salary of employees?", token_budget=1), ['employee'])
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.db_path = create_database(self.temp_dir.name, [
+            "CREATE TABLE employee (id INTEGER PRIMARY KEY, department TEXT, salary REAL)",
+            "INSERT INTO employee (department, salary) VALUES ('Sales', 50000), ('Sales', 70000), ('R&D', NULL)",
+        ])
+        self.addCleanup(db_pool.close_database, self.db_path)
+        patcher = mock.patch.object(db_profile, 'profile_cache', LRUCache(max_entries=4))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_profile_is_built_once_and_loaded_from_its_sidecar(self):
+        with self.assertLogs('query_interface.core_nlp.db_profile', 'INFO'):
+            built = db_profile.build_profile(self.db_path)
+        self.assertTrue(os.path.exists(self.db_path + PROFILE_SUFFIX))
+        self.assertEqual(built['tables']['employee']['rows'], 3)
+        self.assertEqual(built['tables']['employee']['columns']['department']['top_values'], [['Sales', 2], ['R&D', 1]])
+        self.assertEqual(
+            {key: built['tables']['employee']['columns']['salary'][key] for key in ('nulls', 'min', 'max')},
+            {'nulls': 1, 'min': 50000.0, 'max': 70000.0},
+        )
+
+        db_profile.profile_cache.clear()  # As in a new process.
+        with mock.patch.object(db_profile, '_read_profile') as read_profile:
+            self.assertEqual(db_profile.get_profile(self.db_path), built)
+            self.assertEqual(db_profile.build_profile(self.db_path), built)
+        read_profile.assert_not_called()
+        self.assertEqual(db_profile.get_row_counts(self.db_path), {'employee': 3})
+        self.assertIn("- employee.department: 'Sales', 'R&D'", db_profile.describe_relevant_values(self.db_path, "Staff in sales"))
+
+    def test_profile_of_an_earlier_version_of_the_file_is_ignored(self):
+        with self.assertLogs('query_interface.core_nlp.db_profile', 'INFO'):
+            db_profile.build_profile(self.db_path)
+        with sqlite3.connect(self.db_path) as con:
+            con.execute("INSERT INTO employee (department) VALUES ('HR')")
+        con.close()
+        db_profile.profile_cache.clear()
+        self.assertIsNone(db_profile.get_profile(self.db_path))
+        with self.assertLogs('query_interface.core_nlp.db_profile', 'INFO'):
+            self.assertEqual(db_profile.build_profile(self.db_path)['tables']['employee']['rows'], 4)
+
+
+class SqlBoundaryDetectorTests(SimpleTestCase):
+    def feed(self, chunks):
+        detector = llm_handler.SqlBoundaryDetector()
+        for i, chunk in enumerate(chunks):
+            statement = detector.feed(chunk)
+            if statement is not None:
+                return statement, i
+        return None, None
+
+    def test_stops_at_the_semicolon_that_closes_a_select(self):
+        chunks = ["Here is the query:\nSEL", "ECT name FROM ", "employee WHERE id = 1", ";", "\nThis query"]
+        self.assertEqual(self.feed(chunks), ("SELECT name FROM employee WHERE id = 1", 3))
+
+    def test_semicolons_inside_literals_do_not_stop(self):
+        chunks = ["SELECT name FROM employee WHERE note = 'a;", " b'", ";"]
+        self.assertEqual(self.feed(chunks), ("SELECT name FROM employee WHERE note = 'a; b'", 2))
+
+    def test_blank_line_and_code_fence_close_a_statement(self):
+        self.assertEqual(self.feed(["SELECT id FROM item\n", "\nThe query"]), ("SELECT id FROM item", 1))
+        self.assertEqual(self.feed(["```sql\nSELECT id FROM item\n", "```"]), ("SELECT id FROM item", 1))
+
+    def test_incomplete_statements_keep_generating(self):
+        # The first boundary ends a fragment sqlglot cannot parse, so generation goes on.
+        self.assertEqual(self.feed(["SELECT id FROM item WHERE", "\n\n", "id > 2;"]), ("SELECT id FROM item WHERE\n\nid > 2", 2))
+        self.assertEqual(self.feed(["WITH t AS (SELECT id FROM item)"]), (None, None))
+
+
+class SchemaCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.db_path = create_database(self.temp_dir.name, ["CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)"])
+        for patcher in (
+            mock.patch.object(prompt_builder, 'schema_cache', LRUCache(max_entries=4)),
+            mock.patch.object(llm_handler, 'count_tokens', return_value=None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_schema_is_read_once_until_the_file_changes(self):
+        with mock.patch.object(prompt_builder, '_read_schema', wraps=prompt_builder._read_schema) as read_schema:
+            first = prompt_builder.get_schema_info(self.db_path)
+            self.assertIs(prompt_builder.get_schema_info(self.db_path), first)
+            self.assertEqual(read_schema.call_count, 1)
+
+            with sqlite3.connect(self.db_path) as con:
+                con.execute("ALTER TABLE item ADD COLUMN price REAL")
+            con.close()
+            changed = prompt_builder.get_schema_info(self.db_path)
+            self.assertEqual(read_schema.call_count, 2)
+        self.assertNotEqual(changed['fingerprint'], first['fingerprint'])
+        self.assertEqual(changed['tables'], {'item': ['id', 'name', 'price']})
+
+
+class QuestionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        for patcher in (
+            mock.patch.object(question_cache, 'memory_cache', LRUCache(max_entries=16)),
+            mock.patch.object(question_cache, 'terms_cache', LRUCache(max_entries=4)),
+            mock.patch.object(question_cache, '_disk_connection', None),
+            mock.patch.object(question_cache, '_disk_writes', 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: question_cache._disk_connection and question_cache._disk_connection.close())
+
+    def test_normalize_question(self):
+        normalize = question_cache.normalize_question
+        self.assertEqual(normalize("How many  employees earn over 1,000?"), "how many employees earn over 1000")
+        self.assertEqual(normalize("how many employees earn over one thousand"), normalize("How many employees earn over 1 thousand?"))
+        self.assertEqual(normalize("Price above 2.50"), normalize("price above 2.5"))
+        self.assertEqual(normalize("Films titled 'ALIEN CENTER'"), "films titled 'ALIEN CENTER'")
+        self.assertEqual(normalize("What's the Sales total?", {'sales'}), "what s the Sales total")
+
+    def test_schema_names_and_profiled_values_keep_their_case(self):
+        db_path = create_database(self.temp_dir.name, ["CREATE TABLE employee (id INTEGER PRIMARY KEY, department TEXT)"])
+        profile = {'tables': {'employee': {'columns': {'department': {'top_values': [['Sales', 3], ['R&D', 1]]}}}}}
+        with mock.patch.object(llm_handler, 'count_tokens', return_value=None), \
+                mock.patch.object(question_cache.db_profile, 'get_profile', return_value=profile):
+            terms = question_cache.case_sensitive_terms(db_path, 'fp')
+            question_cache.store_sql("Employees in Sales", 'fp', "SELECT 1", db_path)
+            self.assertEqual(question_cache.get_cached_sql("employees in Sales?", 'fp', db_path), "SELECT 1")
+            self.assertIsNone(question_cache.get_cached_sql("Employees in sales", 'fp', db_path))
+        self.assertEqual(terms, {'employee', 'id', 'department', 'sales', 'r', 'd'})
+
+    def test_disk_store_is_trimmed_every_few_writes(self):
+        path = os.path.join(self.temp_dir.name, 'questions.db')
+        with self.settings(LEXIBASE_QUESTION_CACHE_PATH=path, LEXIBASE_QUESTION_CACHE_DISK_ENTRIES=2), \
+                mock.patch.object(question_cache, 'PRUNE_EVERY', 3):
+            for i in range(4):
+                question_cache.store_sql(f"question {i}", 'fp', f"SELECT {i}")
+            keys = question_cache._disk_connection.execute("SELECT sql FROM question_cache ORDER BY created_at").fetchall()
+        # Only the first and the fourth write trimmed the store.
+        self.assertEqual(keys, [('SELECT 2',), ('SELECT 3',)])
+
+
+class FakeLlama:
+    """Records what the prefix cache asks of a llama context."""
+
+    def __init__(self):
+        self.input_ids, self.n_tokens, self.calls = [], 0, []
+
+    def tokenize(self, text, add_bos=True, special=True):
+        return [ord(char) for char in text.decode('utf-8')]
+
+    def reset(self):
+        self.input_ids, self.n_tokens = [], 0
+
+    def eval(self, tokens):
+        self.calls.append('eval')
+        self.input_ids += list(tokens)
+        self.n_tokens = len(self.input_ids)
+
+    def save_state(self):
+        return mock.Mock(llama_state_size=len(self.input_ids), tokens=list(self.input_ids))
+
+    def load_state(self, state):
+        self.calls.append('load_state')
+        self.input_ids, self.n_tokens = list(state.tokens), len(state.tokens)
+
+
+class PromptPrefixCacheTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(llm_handler, 'prefix_cache', LRUCache(max_entries=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prefix_is_evaluated_once_and_restored_on_other_contexts(self):
+        prefix, _ = llm_handler.split_prompt("<|system|>schema<|end|>\n<|user|>How many?<|end|>")
+        self.assertEqual(prefix, "<|system|>schema<|end|>\n")
+        first, second = FakeLlama(), FakeLlama()
+        self.assertFalse(llm_handler.restore_prompt_prefix(first, prefix))
+        self.assertTrue(llm_handler.restore_prompt_prefix(second, prefix))
+        self.assertEqual((first.calls, second.calls), (['eval'], ['load_state']))
+        self.assertEqual(second.input_ids, first.input_ids)
+
+    def test_context_already_holding_the_prefix_is_not_restored(self):
+        llm = FakeLlama()
+        llm_handler.restore_prompt_prefix(llm, "schema")
+        llm.eval([ord('?')])  # The previous question, after the prefix.
+        self.assertTrue(llm_handler.restore_prompt_prefix(llm, "schema"))
+        self.assertEqual(llm.calls, ['eval', 'eval'])
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.db_path = create_database(self.temp_dir.name, ["CREATE TABLE item (id INTEGER PRIMARY KEY)"])
+        patcher = mock.patch.object(db_pool, '_pools', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db_pool.close_database, self.db_path)
+
+    def test_connections_are_reused_and_read_only(self):
+        with db_pool.connection(self.db_path) as first:
+            with db_pool.connection(self.db_path) as second:
+                self.assertIsNot(first, second)  # A borrowed connection is never shared.
+        with db_pool.connection(self.db_path) as again:
+            self.assertIn(again, (first, second))
+            with self.assertRaises(sqlite3.OperationalError):
+                again.execute("INSERT INTO item DEFAULT VALUES")
+
+    def test_changed_file_gets_a_new_pool(self):
+        with db_pool.connection(self.db_path) as old:
+            pass
+        with sqlite3.connect(self.db_path) as con:
+            con.execute("INSERT INTO item DEFAULT VALUES")
+        con.close()
+        with db_pool.connection(self.db_path) as new:
+            self.assertEqual(new.execute("SELECT COUNT(*) FROM item").fetchone(), (1,))
+        self.assertIsNot(new, old)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            old.execute("SELECT 1")
+
+    def test_close_database_closes_idle_and_returned_connections(self):
+        with db_pool.connection(self.db_path) as borrowed:
+            with db_pool.connection(self.db_path) as idle:
+                pass
+            db_pool.close_database(self.db_path)
+            borrowed.execute("SELECT 1")  # Still usable until it is returned.
+        for con in (idle, borrowed):
+            with self.assertRaises(sqlite3.ProgrammingError):
+                con.execute("SELECT 1")
+
+
+class HotTierTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.paths = []
+        for name in ('a', 'b', 'c'):
+            directory = os.path.join(self.temp_dir.name, name)
+            os.mkdir(directory)
+            self.paths.append(create_database(directory, [f"CREATE TABLE {name} (id INTEGER PRIMARY KEY)"]))
+        size = os.path.getsize(self.paths[0])
+        self.tier = hot_tier.HotTier(budget_bytes=2 * size, max_db_bytes=size, min_accesses=2)
+        self.addCleanup(lambda: [self.tier.discard(path) for path in self.paths])
+
+    def test_database_is_promoted_once_it_is_hot(self):
+        a = self.paths[0]
+        self.assertIsNone(self.tier.lookup(a))
+        hot = self.tier.lookup(a)
+        self.assertIsNotNone(hot)
+        reader = sqlite3.connect(hot.uri, uri=True)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.execute("SELECT name FROM sqlite_master").fetchall(), [('a',)])
+        self.assertIs(self.tier.lookup(a), hot)
+        self.assertEqual(
+            {key: self.tier.stats()[key] for key in ('databases', 'hits', 'misses', 'promotions')},
+            {'databases': 1, 'hits': 1, 'misses': 2, 'promotions': 1},
+        )
+
+    def test_least_recently_used_database_is_demoted_for_room(self):
+        a, b, c = self.paths
+        for path in (a, a, b, b, a, c, c):
+            self.tier.lookup(path)
+        self.assertEqual([self.tier.is_resident(path) for path in self.paths], [True, False, True])
+        self.assertEqual(self.tier.stats()['demotions'], 1)
+
+    def test_changed_file_replaces_the_stale_copy(self):
+        a = self.paths[0]
+        self.tier.lookup(a)
+        stale = self.tier.lookup(a)
+        with sqlite3.connect(a) as con:
+            con.execute("INSERT INTO a DEFAULT VALUES")
+        con.close()
+        fresh = self.tier.lookup(a)
+        self.assertIsNot(fresh, stale)
+        reader = sqlite3.connect(fresh.uri, uri=True)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM a").fetchone(), (1,))
+        self.assertEqual(self.tier.stats()['demotions'], 1)
+
+
+class InferenceJobTests(SimpleTestCase):
+    def test_waiter_timing_out_cancels_the_job(self):
+        job = inference_scheduler.InferenceJob("Question: how many?", None, timeout=-0.9)
+        with self.assertRaises(inference_scheduler.InferenceTimeout):
+            job.result()
+        self.assertTrue(job.cancelled.is_set())
+
+    def test_cancelled_async_waiter_cancels_the_job(self):
+        job = inference_scheduler.InferenceJob("Question: how many?", None, timeout=60)
+
+        async def disconnect():
+            waiter = asyncio.ensure_future(job.aresult())
+            await asyncio.sleep(0)
+            waiter.cancel()  # What Django does to the view when the client goes away.
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(disconnect())
+        self.assertTrue(job.cancelled.is_set())
+        # The worker still picks the job up, records the cancellation and skips generation.
+        self.assertFalse(job.future.done())
+
+
+class UploadStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        upload_dir = os.path.join(self.temp_dir.name, 'uploads')
+        patcher = mock.patch.multiple(
+            upload_store,
+            UPLOAD_DIR=upload_dir,
+            OBJECTS_DIR=os.path.join(upload_dir, 'objects'),
+            INCOMING_DIR=os.path.join(upload_dir, 'incoming'),
+            METADATA_PATH=os.path.join(upload_dir, 'store.sqlite3'),
+            GLOBAL_QUOTA_BYTES=None,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def upload(self, rows: int):
+        path = os.path.join(self.temp_dir.name, f'source-{rows}.db')
+        if not os.path.exists(path):
+            with sqlite3.connect(path) as con:
+                con.execute("CREATE TABLE t (v TEXT)")
+                con.executemany("INSERT INTO t VALUES (?)", [(f"row {i}",) for i in range(rows)])
+            con.close()
+        with open(path, 'rb') as f:
+            return SimpleUploadedFile('upload.db', f.read())
+
+    def test_identical_uploads_share_one_file(self):
+        first_path, first_hash = upload_store.store_upload(self.upload(10), 'session-a')
+        second_path, second_hash = upload_store.store_upload(self.upload(10), 'session-b')
+        self.assertEqual((first_path, first_hash), (second_path, second_hash))
+        stats = upload_store.get_store_stats()
+        self.assertEqual((stats['objects'], stats['references']), (1, 2))
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        deleted = []
+        db_path, content_hash = upload_store.store_upload(self.upload(10), 'session-a')
+        upload_store.store_upload(self.upload(10), 'session-b')
+        self.assertEqual(upload_store.release(content_hash, 'session-a', on_delete=deleted.append), 1)
+        self.assertTrue(os.path.exists(db_path))
+        self.assertEqual(upload_store.release(content_hash, 'session-b', on_delete=deleted.append), 0)
+        self.assertFalse(os.path.exists(db_path))
+        self.assertEqual(deleted, [db_path])
+
+    def test_non_sqlite_uploads_are_rejected(self):
+        with self.assertRaises(upload_store.InvalidDatabase):
+            upload_store.store_upload(SimpleUploadedFile('notes.db', b'definitely not a database'), 'session-a')
+        self.assertEqual(os.listdir(upload_store.INCOMING_DIR), [])
+
+    def test_oversized_uploads_are_rejected(self):
+        with mock.patch.object(upload_store, 'SESSION_QUOTA_BYTES', 1024):
+            with self.assertRaises(upload_store.UploadTooLarge):
+                upload_store.store_upload(self.upload(1000), 'session-a')
+
+    def test_quota_evicts_least_recently_used_first(self):
+        old_path, old_hash = upload_store.store_upload(self.upload(10), 'session-a')
+        new_path, new_hash = upload_store.store_upload(self.upload(20), 'session-b')
+        con = upload_store._metadata()
+        con.execute("UPDATE objects SET last_used = 0 WHERE content_hash = ?", (old_hash,))
+        con.close()
+        with self.assertLogs('query_interface.core_nlp.upload_store', 'INFO'):
+            self.assertEqual(upload_store.evict_to_quota(os.path.getsize(new_path)), [old_hash])
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(new_path))
+
+    def test_quota_evicts_unreferenced_databases_first(self):
+        in_use_path, in_use_hash = upload_store.store_upload(self.upload(10), 'session-a')
+        idle_path, idle_hash = upload_store.store_upload(self.upload(20), 'session-b')
+        upload_store.store_upload(self.upload(30), 'session-c')
+        con = upload_store._metadata()
+        con.execute("UPDATE objects SET last_used = 0 WHERE content_hash = ?", (in_use_hash,))
+        con.execute("DELETE FROM refs WHERE content_hash = ?", (idle_hash,))
+        con.close()
+        quota = upload_store.get_store_stats()['stored_bytes'] - 1
+        with self.assertLogs('query_interface.core_nlp.upload_store', 'INFO'):
+            self.assertEqual(upload_store.evict_to_quota(quota), [idle_hash])
+        self.assertTrue(os.path.exists(in_use_path))
+
+    def test_sweep_removes_unreferenced_and_untracked_files(self):
+        db_path, content_hash = upload_store.store_upload(self.upload(10), 'session-a')
+        con = upload_store._metadata()
+        con.execute("DELETE FROM refs")
+        con.close()
+        stray = os.path.join(upload_store.OBJECTS_DIR, 'f' * 64 + '.sqlite3')
+        for path in (stray, stray + '-wal'):
+            open(path, 'w').close()
+        report = upload_store.sweep_orphans()
+        self.assertEqual((report['unreferenced'], report['untracked']), (1, 2))
+        self.assertFalse(os.path.exists(db_path) or os.path.exists(stray) or os.path.exists(stray + '-wal'))
+
+    def test_sweep_keeps_side_files_writes_in_progress_and_foreign_names(self):
+        db_path, content_hash = upload_store.store_upload(self.upload(10), 'session-a')
+        kept = [
+            db_path + '-wal', db_path + '-shm',
+            f"{db_path}{PROFILE_SUFFIX}.{'0' * 32}.tmp",
+            os.path.join(upload_store.OBJECTS_DIR, 'notes.txt'),
+        ]
+        for path in kept:
+            open(path, 'w').close()
+        report = upload_store.sweep_orphans()
+        self.assertEqual(report['untracked'], 0)
+        self.assertTrue(all(os.path.exists(path) for path in [db_path] + kept))
+        # Deleting the database takes its side files along.
+        upload_store.release(content_hash, 'session-a')
+        self.assertFalse(os.path.exists(db_path + '-wal') or os.path.exists(db_path + '-shm'))
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_byte_budget(self):
+        cache = LRUCache(max_entries=10, max_bytes=100)
+        cache.put('a', 'x', size=60)
+        cache.put('b', 'y', size=30)
+        cache.put('c', 'z', size=30)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.stats()['bytes'], 60)
+
+    def test_oversized_value_is_refused_without_flushing(self):
+        cache = LRUCache(max_entries=10, max_bytes=100)
+        cache.put('a', 'x', size=60)
+        self.assertFalse(cache.put('b', 'y', size=101))
+        self.assertEqual(cache.get('a'), 'x')
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=10)
+        with mock.patch('query_interface.core_nlp.cache.time.monotonic', return_value=1000.0):
+            cache.put('a', 1)
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('query_interface.core_nlp.cache.time.monotonic', return_value=1011.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_invalidate_and_pop(self):
+        cache = LRUCache()
+        for key in [('db1', 1), ('db1', 2), ('db2', 1)]:
+            cache.put(key, key, size=1)
+        self.assertEqual(cache.invalidate(lambda key: key[0] == 'db1'), 2)
+        self.assertEqual(cache.pop(('db2', 1)), ('db2', 1))
+        self.assertEqual((len(cache), cache.stats()['bytes']), (0, 0))
+
+
+class FixtureGeneratorTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def generate(self, name, seed, **options):
+        path = os.path.join(self.temp_dir.name, name)
+        call_command('generate_fixture_db', path, rows=2000, seed=seed, stdout=io.StringIO(), **options)
+        con = sqlite3.connect(path)
+        self.addCleanup(con.close)
+        return con
+
+    def test_same_seed_produces_the_same_database(self):
+        first, second, other = self.generate('a.db', 7), self.generate('b.db', 7), self.generate('c.db', 8)
+        self.assertEqual(list(first.iterdump()), list(second.iterdump()))
+        self.assertNotEqual(list(first.iterdump()), list(other.iterdump()))
+
+    def test_tables_are_sized_and_consistent(self):
+        con = self.generate('a.db', 7)
+        for table, rows in table_sizes(2000).items():
+            self.assertEqual(con.execute(f"SELECT COUNT(*) FROM {table}").fetchone(), (rows,))
+        mismatched = con.execute(
+            "SELECT COUNT(*) FROM orders o JOIN (SELECT order_id, SUM(quantity * unit_price) AS total "
+            "FROM order_items GROUP BY order_id) i ON i.order_id = o.id WHERE abs(o.total - i.total) > 0.01"
+        ).fetchone()
+        self.assertEqual(mismatched, (0,))
+        self.assertEqual(con.execute("PRAGMA foreign_key_check").fetchall(), [])
+
+    def test_existing_output_is_kept_without_overwrite(self):
+        self.generate('a.db', 7)
+        with self.assertRaises(CommandError):
+            self.generate('a.db', 8)
+        self.generate('a.db', 8, overwrite=True)
+
+
+class BatchApiAccessTests(SimpleTestCase):
+    def post(self, csrf_token=None, **headers):
+        client = Client(enforce_csrf_checks=True)
+        if csrf_token:
+            client.cookies['csrftoken'] = csrf_token
+            headers['X-CSRFToken'] = csrf_token
+        return client.post('/batch/', '{"questions": ["How many items?"]}', content_type='application/json', headers=headers)
+
+    def test_api_token_or_csrf_token_is_required(self):
+        with self.settings(LEXIBASE_BATCH_API_TOKEN='secret'):
+            # Past the access check, the request fails for want of an uploaded database.
+            self.assertEqual(self.post(Authorization='Bearer secret').status_code, 400)
+            self.assertEqual(self.post(Authorization='Bearer guess').status_code, 401)
+            self.assertEqual(self.post().status_code, 403)
+            self.assertEqual(self.post(csrf_token='a' * 32).status_code, 400)
+
+    def test_tokens_are_refused_when_none_is_configured(self):
+        with self.settings(LEXIBASE_BATCH_API_TOKEN=None):
+            self.assertEqual(self.post(Authorization='Bearer ').status_code, 401)
+
+
+class BatchLinesTests(SimpleTestCase):
+    def lines(self, records, total):
+        with mock.patch.object(metrics, 'count_request') as count_request:
+            lines = [json.loads(line) for line in views._batch_lines(iter(records), total)]
+        return [call.args for call in count_request.call_args_list], lines
+
+    def test_outcomes_follow_the_stage_that_failed(self):
+        results = {'error': None, 'results': [[1]]}
+        failed = {'error': "Interpreter Error: no such column: x", 'error_type': 'interpreter', 'results': []}
+        records = [
+            {'index': 0, 'sql': "SELECT 1", 'error': None, 'error_stage': None, 'busy': False, 'results': results},
+            {'index': 1, 'sql': "SELECT x", 'error': failed['error'], 'error_stage': 'execution', 'busy': False,
+             'results': failed},
+            batch_runner._failure(2, "q", RuntimeError("pool closed"), 'execution', "SELECT 1"),
+            batch_runner._failure(3, "q", inference_scheduler.InferenceTimeout("too slow"), 'generation'),
+            batch_runner._failure(4, "q", inference_scheduler.SchedulerBusy(retry_after=1), 'generation'),
+        ]
+        counted, lines = self.lines(records, len(records))
+        self.assertEqual(counted, [
+            ('batch', 'ok'), ('batch', 'sql_error'), ('batch', 'sql_error'), ('batch', 'error'), ('batch', 'busy'),
+        ])
+        self.assertEqual(lines[-1], {'done': True, 'questions': 5, 'errors': 4})
+
+    def test_pipeline_failure_ends_with_an_error_line(self):
+        def records():
+            yield batch_runner._failure(0, "q", RuntimeError("model crashed"), 'generation')
+            raise RuntimeError("scheduler stopped")
+
+        with self.assertLogs('query_interface.views', 'ERROR'):
+            counted, lines = self.lines(records(), 1)
+        self.assertEqual(counted, [('batch', 'error')])
+        self.assertEqual(lines[1:], [
+            {'error': "A system error occurred: scheduler stopped"}, {'done': True, 'questions': 1, 'errors': 1},
+        ])
+
+
+class MetricsRenderTests(SimpleTestCase):
+    def test_render_uses_the_prometheus_text_format(self):
+        requests = metrics.Counter('test_requests_total', "Requests.", ['endpoint'])
+        latency = metrics.Histogram('test_seconds', "Latency.", buckets=(0.1, 1))
+        depth = metrics.Gauge('test_depth', "Depth.", lambda: 3)
+        requests.inc(endpoint='query')
+        requests.inc(2, endpoint='query')
+        requests.inc(endpoint='say "hi"')
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+        with mock.patch.object(metrics, '_registry', [requests, latency, depth]):
+            lines = metrics.render().splitlines()
+        self.assertEqual(lines, [
+            "# HELP test_requests_total Requests.",
+            "# TYPE test_requests_total counter",
+            'test_requests_total{endpoint="query"} 3',
+            'test_requests_total{endpoint="say \\"hi\\""} 1',
+            "# HELP test_seconds Latency.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            "test_seconds_sum 5.55",
+            "test_seconds_count 3",
+            "# HELP test_depth Depth.",
+            "# TYPE test_depth gauge",
+            "test_depth 3",
+        ])
+
+    def test_failing_gauge_is_skipped(self):
+        broken = metrics.Gauge('test_broken', "Broken.", lambda: 1 / 0)
+        with mock.patch.object(metrics, '_registry', [broken]), self.assertLogs('query_interface.core_nlp.metrics', 'WARNING'):
+            self.assertEqual(metrics.render(), "# HELP test_broken Broken.\n# TYPE test_broken gauge\n")
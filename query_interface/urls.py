@@ -4,4 +4,9 @@ from . import views
 
 urlpatterns = [
     path('', views.query_view, name='query_view'),
+    path('stream/', views.query_stream_view, name='query_stream'),
+    path('export/', views.export_view, name='export_results'),
+    path('batch/', views.batch_view, name='query_batch'),
+    path('stats/', views.stats_view, name='stats'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,73 +1,546 @@
 # query_interface/views.py
 from django.shortcuts import render
 from django.conf import settings
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+import asyncio
+import csv
+import hmac
+import io
+import json
+import logging
 import os
-import uuid
+import time
 
 from .forms import DatabaseQueryForm
-from .core_nlp.prompt_builder import create_text_to_sql_prompt
-from .core_nlp.llm_handler import generate_sql_from_prompt
-from .core_nlp.sql_interpreter import execute_query
+from .core_nlp.prompt_builder import create_text_to_sql_prompt, get_sql_grammar
+from .core_nlp import inference_scheduler
+from .core_nlp.inference_scheduler import SchedulerBusy
+from .core_nlp.sql_interpreter import execute_query, result_cache, stream_query
+from .core_nlp.db_fingerprint import get_db_fingerprint
+from .core_nlp import fast_path, question_cache
+from .core_nlp.schema_index import build_schema_index
+from .core_nlp import batch_runner, db_profile, hot_tier, llm_handler, metrics, upload_janitor, upload_store
+from .core_nlp.upload_janitor import release_database
 
-def query_view(request):
-    print("\n--- [View] New request received ---")
-    form = DatabaseQueryForm()
-    context = {'form': form}
+logger = logging.getLogger(__name__)
+
+DATABASE_EXPIRED_MESSAGE = "Your database was removed from the server to free disk space. Please upload it again."
+
+def _upload_owner(request) -> str:
+    """The session key that holds a reference to the session's uploaded database."""
+    if request.session.session_key is None:
+        request.session.create()
+    return request.session.session_key
+
+def _drop_session_database(request):
+    """Releases the session's reference to its database; the file is deleted once no session uses it."""
+    db_path = request.session.pop('db_path', None)
+    content_hash = request.session.pop('db_hash', None)
+    request.session.pop('db_name', None)
+    if not db_path:
+        return
+    if content_hash:
+        remaining = upload_store.release(content_hash, _upload_owner(request), on_delete=release_database)
+        logger.debug("Released database %s. Remaining references: %s", content_hash[:12], remaining)
+        return
+    # Sessions from before uploads were content-addressed own their file outright.
+    release_database(db_path)
+    try:
+        os.remove(db_path)
+        logger.debug("Deleted temp DB file: %s", db_path)
+    except OSError as e:
+        logger.error("Could not delete temp DB file: %s", e)
+
+def _session_database(request):
+    """
+    Returns the session's database path (None if there is none), recording the
+    access for quota eviction. Raises ValueError if the janitor has removed it.
+    """
+    db_path = request.session.get('db_path')
+    if db_path and not os.path.exists(db_path):
+        logger.warning("Session database %s no longer exists.", db_path)
+        _drop_session_database(request)
+        raise ValueError(DATABASE_EXPIRED_MESSAGE)
+    if db_path:
+        upload_store.touch(db_path)
+    return db_path
+
+# Result pages and exports re-run a query the server generated, identified by a
+# signed token so clients cannot submit SQL of their own.
+RESULT_TOKEN_SALT = 'query_interface.results'
+
+def make_result_token(sql_query: str) -> str:
+    return signing.dumps(sql_query, salt=RESULT_TOKEN_SALT)
+
+def read_result_token(token: str) -> str:
+    return signing.loads(token, salt=RESULT_TOKEN_SALT)
+
+def _page_request(params) -> tuple:
+    """Reads (page, after) from query parameters, defaulting to the first page."""
+    try:
+        page = max(1, int(params.get('page', 1)))
+        after = int(params['after']) if params.get('after') else None
+    except ValueError:
+        page, after = 1, None
+    return page, after
+
+def _read_query_request(request, context: dict):
+    """
+    The blocking part of query_view: serves result pages, clears the session,
+    stores uploads and validates the form, filling `context` as it goes. Returns
+    (form, user_query, db_path) when a question should be answered, else None.
+    """
+    # Background work starts with the first request, so manage.py commands never pay for it.
+    upload_janitor.start()
+    if llm_handler.MODEL_STARTUP == 'lazy':
+        inference_scheduler.warm_up()
+
+    if request.method == 'GET' and request.GET.get('q'):
+        logger.debug("Result page requested.")
+        try:
+            sql_query = read_result_token(request.GET['q'])
+            db_path = _session_database(request)
+            if not db_path:
+                raise ValueError("You must upload a database file before making a query.")
+            page, after = _page_request(request.GET)
+            context['sql_query'] = sql_query
+            context['results_data'] = execute_query(sql_query, db_path, page=page, after=after)
+            context['result_token'] = request.GET['q']
+        except signing.BadSignature:
+            context['system_error'] = "This results link is invalid."
+        except ValueError as e:
+            context['system_error'] = str(e)
 
     if request.GET.get('new_session'):
-        print("DEBUG: [View] 'new_session' parameter found. Clearing session data.")
-        if 'db_path' in request.session:
+        logger.debug("'new_session' parameter found. Clearing session data.")
+        _drop_session_database(request)
+
+    if request.method != 'POST':
+        return None
+    logger.debug("Request method is POST.")
+    form = DatabaseQueryForm(request.POST, request.FILES)
+    if not form.is_valid():
+        logger.error("Form is invalid. Errors: %s", form.errors)
+        return None
+    logger.debug("Form is valid.")
+    user_query = form.cleaned_data['query']
+    uploaded_file = request.FILES.get('db_file')
+    db_path = None
+
+    if uploaded_file:
+        logger.debug("New file uploaded: %s", uploaded_file.name)
+        owner = _upload_owner(request)
+        try:
+            new_path, content_hash = upload_store.store_upload(uploaded_file, owner, on_delete=release_database)
+        except upload_store.UploadRejected as e:
+            logger.warning("Rejected upload %s: %s", uploaded_file.name, e)
+            context['system_error'] = str(e)
+            new_path = None
+        if new_path:
+            # Re-uploading the same file keeps the reference that was just recorded.
+            if request.session.get('db_hash') != content_hash:
+                _drop_session_database(request)
+            db_path = new_path
+            request.session['db_path'] = db_path
+            request.session['db_hash'] = content_hash
+            request.session['db_name'] = uploaded_file.name
+            logger.debug("File saved to session. Path: %s", db_path)
             try:
-                os.remove(request.session['db_path'])
-                print(f"DEBUG: [View] Deleted temp DB file: {request.session['db_path']}")
-            except OSError as e:
-                print(f"ERROR: [View] Could not delete temp DB file: {e}")
-            del request.session['db_path']
-        if 'db_name' in request.session:
-            del request.session['db_name']
-
-    if request.method == 'POST':
-        print("DEBUG: [View] Request method is POST.")
-        form = DatabaseQueryForm(request.POST, request.FILES)
-        if form.is_valid():
-            print("DEBUG: [View] Form is valid.")
-            user_query = form.cleaned_data['query']
-            uploaded_file = request.FILES.get('db_file')
-            db_path = request.session.get('db_path')
-
-            if uploaded_file:
-                print(f"DEBUG: [View] New file uploaded: {uploaded_file.name}")
-                unique_filename = f"{uuid.uuid4()}_{uploaded_file.name}"
-                db_path = os.path.join(settings.BASE_DIR, 'temp_uploads', unique_filename)
-                
-                with open(db_path, 'wb+') as destination:
-                    for chunk in uploaded_file.chunks():
-                        destination.write(chunk)
-                
-                request.session['db_path'] = db_path
-                request.session['db_name'] = uploaded_file.name
-                print(f"DEBUG: [View] File saved to session. Path: {db_path}")
-
-            context['user_query'] = user_query
-            
-            if db_path:
-                print("DEBUG: [View] DB path found. Proceeding with NLP pipeline.")
-                try:
-                    prompt = create_text_to_sql_prompt(user_query, db_path)
-                    sql_query = generate_sql_from_prompt(prompt)
-                    context['sql_query'] = sql_query
-
-                    results_data = execute_query(sql_query, db_path)
-                    context['results_data'] = results_data
-                except Exception as e:
-                    print(f"ERROR: [View] Unhandled exception in NLP pipeline: {e}")
-                    context['system_error'] = f"A system error occurred: {str(e)}"
-            else:
-                print("WARNING: [View] Query submitted but no database in session.")
-                context['system_error'] = "You must upload a database file before making a query."
-        else:
-            print(f"ERROR: [View] Form is invalid. Errors: {form.errors}")
-    
+                build_schema_index(db_path)
+            except Exception as e:
+                # The index is rebuilt lazily if it is needed, so a failure here is not fatal.
+                logger.error("Could not index uploaded database: %s", e)
+            try:
+                db_profile.build_profile(db_path)
+            except Exception as e:
+                # Without a profile, prompts carry no value hints and row counts come from the file.
+                logger.error("Could not profile uploaded database: %s", e)
+    else:
+        try:
+            db_path = _session_database(request)
+        except ValueError as e:
+            context['system_error'] = str(e)
+
+    context['user_query'] = user_query
+    if not db_path:
+        if 'system_error' not in context:
+            logger.warning("Query submitted but no database in session.")
+            context['system_error'] = "You must upload a database file before making a query."
+        return None
+    return form, user_query, db_path
+
+def _render_query_page(request, context: dict, retry_after=None):
     context['db_name'] = request.session.get('db_name')
-    print("DEBUG: [View] Rendering template...")
-    return render(request, 'query_interface/index.html', context)
\ No newline at end of file
+    logger.debug("Rendering template...")
+    if retry_after is not None:
+        response = render(request, 'query_interface/index.html', context, status=503)
+        response['Retry-After'] = str(retry_after)
+        return response
+    return render(request, 'query_interface/index.html', context)
+
+async def query_view(request):
+    """
+    Renders the query page and answers a submitted question. The view is async so
+    that waiting on the model holds no worker thread, and a client that disconnects
+    while the model is generating cancels its job.
+    """
+    logger.debug("New request received.")
+    context = {'form': DatabaseQueryForm()}
+    retry_after = None
+    question = await sync_to_async(_read_query_request)(request, context)
+    if question is None:
+        return await sync_to_async(_render_query_page)(request, context)
+
+    form, user_query, db_path = question
+    logger.debug("DB path found. Proceeding with NLP pipeline.")
+    outcome = 'disconnected'
+    try:
+        with metrics.trace('query'):
+            try:
+                fingerprint = await sync_to_async(get_db_fingerprint)(db_path)
+                routed_at = time.perf_counter()
+                # "Regenerate" asks the model again, so it skips the cache and the fast path.
+                regenerate = form.cleaned_data.get('bypass_cache')
+                sql_query, sql_route = await sync_to_async(fast_path.route)(
+                    user_query, db_path, fingerprint, use_cache=not regenerate, use_fast_path=not regenerate
+                )
+                context['sql_route'] = sql_route
+
+                if sql_query is None:
+                    with metrics.span('prompt_build'):
+                        prompt = await sync_to_async(create_text_to_sql_prompt)(user_query, db_path)
+                        grammar = await sync_to_async(get_sql_grammar)(db_path)
+                    job = inference_scheduler.submit(prompt, grammar=grammar)
+                    with metrics.span('inference'):
+                        # Cancels the job if the client goes away (Django cancels this task).
+                        sql_query = await job.aresult()
+                    metrics.record_route('llm', time.perf_counter() - routed_at)
+                else:
+                    logger.debug("Answered by the %s route. Skipping the LLM.", sql_route)
+                context['sql_query'] = sql_query
+
+                context['results_data'] = await sync_to_async(_run_and_cache_results)(
+                    user_query, db_path, fingerprint, sql_query, generated=sql_route == 'llm'
+                )
+                context['result_token'] = context['results_data'].get('token')
+                outcome = 'sql_error' if context['results_data']['error'] else 'ok'
+            except SchedulerBusy as e:
+                logger.warning("Inference queue full. Rejecting request: %s", e)
+                context['system_error'] = str(e)
+                retry_after = e.retry_after
+                outcome = 'busy'
+            except Exception as e:
+                logger.exception("Unhandled exception in NLP pipeline: %s", e)
+                context['system_error'] = f"A system error occurred: {str(e)}"
+                outcome = 'error'
+    finally:
+        metrics.count_request('query', outcome)
+    return await sync_to_async(_render_query_page)(request, context, retry_after)
+
+def _format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _busy_response(error: SchedulerBusy) -> JsonResponse:
+    response = JsonResponse({'error': str(error)}, status=503)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+def _run_and_cache_results(user_query: str, db_path: str, fingerprint: str, sql_query: str, generated: bool) -> dict:
+    results_data = execute_query(sql_query, db_path)
+    if not results_data['error']:
+        results_data['token'] = make_result_token(sql_query)
+        # Only memoize model output that actually ran, so a bad generation is not
+        # replayed; fast-path SQL is cheaper to rebuild than a cache slot.
+        if generated:
+            question_cache.store_sql(user_query, fingerprint, sql_query, db_path)
+    return results_data
+
+def _stream_events(job, sql_query, route, finish):
+    """Yields the pipeline's Server-Sent Events, blocking on the inference job (WSGI)."""
+    yield _format_sse('status', {'stage': 'generating'})
+    outcome = 'disconnected'
+    try:
+        if job is not None:
+            for text in job.iter_tokens():
+                yield _format_sse('token', {'text': text})
+            sql_query = job.result()
+        yield _format_sse('sql', {'sql': sql_query, 'cached': route == 'cache', 'route': route})
+        results_data = finish(sql_query)
+        outcome = 'sql_error' if results_data['error'] else 'ok'
+        yield _format_sse('results', results_data)
+    except Exception as e:
+        logger.exception("Unhandled exception in streaming pipeline: %s", e)
+        outcome = 'error'
+        yield _format_sse('error', {'message': f"A system error occurred: {str(e)}"})
+    finally:
+        # A closed stream means the client went away; stop generating for it.
+        if job is not None:
+            job.cancel()
+        metrics.count_request('stream', outcome)
+    yield _format_sse('done', {})
+
+async def _astream_events(job, sql_query, route, finish):
+    """Async variant of _stream_events, so the ASGI server sends each event as it is produced."""
+    yield _format_sse('status', {'stage': 'generating'})
+    outcome = 'disconnected'
+    try:
+        if job is not None:
+            async for text in job.aiter_tokens():
+                yield _format_sse('token', {'text': text})
+            sql_query = await asyncio.wrap_future(job.future)
+        yield _format_sse('sql', {'sql': sql_query, 'cached': route == 'cache', 'route': route})
+        results_data = await sync_to_async(finish)(sql_query)
+        outcome = 'sql_error' if results_data['error'] else 'ok'
+        yield _format_sse('results', results_data)
+    except Exception as e:
+        logger.exception("Unhandled exception in streaming pipeline: %s", e)
+        outcome = 'error'
+        yield _format_sse('error', {'message': f"A system error occurred: {str(e)}"})
+    finally:
+        # Django cancels the response on client disconnect; stop generating for it.
+        if job is not None:
+            job.cancel()
+        metrics.count_request('stream', outcome)
+    yield _format_sse('done', {})
+
+async def query_stream_view(request):
+    """
+    Streaming variant of query_view for a session that already has a database.
+    Tokens are pushed to the browser as the model produces them, followed by the
+    cleaned SQL and the query results.
+    """
+    logger.debug("New streaming request received.")
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    form = DatabaseQueryForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Invalid form submission.', 'details': form.errors}, status=400)
+    try:
+        db_path = await sync_to_async(_session_database)(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not db_path:
+        return JsonResponse({'error': 'You must upload a database file before making a query.'}, status=400)
+
+    user_query = form.cleaned_data['query']
+    job = None
+    try:
+        fingerprint = await sync_to_async(get_db_fingerprint)(db_path)
+        routed_at = time.perf_counter()
+        regenerate = form.cleaned_data.get('bypass_cache')
+        sql_query, route = await sync_to_async(fast_path.route)(
+            user_query, db_path, fingerprint, use_cache=not regenerate, use_fast_path=not regenerate
+        )
+        if sql_query is None:
+            prompt = await sync_to_async(create_text_to_sql_prompt)(user_query, db_path)
+            grammar = await sync_to_async(get_sql_grammar)(db_path)
+            job = inference_scheduler.submit(prompt, grammar=grammar, stream=True)
+    except SchedulerBusy as e:
+        logger.warning("Inference queue full. Rejecting request: %s", e)
+        metrics.count_request('stream', 'busy')
+        return _busy_response(e)
+    except Exception as e:
+        logger.exception("Unhandled exception in streaming pipeline: %s", e)
+        metrics.count_request('stream', 'error')
+        return JsonResponse({'error': f"A system error occurred: {str(e)}"}, status=500)
+
+    def finish(sql):
+        if route == 'llm':
+            metrics.record_route('llm', time.perf_counter() - routed_at)
+        return _run_and_cache_results(user_query, db_path, fingerprint, sql, generated=route == 'llm')
+
+    if isinstance(request, ASGIRequest):
+        events = _astream_events(job, sql_query, route, finish)
+    else:
+        events = _stream_events(job, sql_query, route, finish)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+def _export_chunks(rows, export_format: str):
+    """Renders an open stream_query() generator (past its header) as CSV or JSON Lines, one batch per chunk."""
+    columns = next(rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(columns)
+    for batch in rows:
+        if export_format == 'csv':
+            writer.writerows(batch)
+        else:
+            for row in batch:
+                buffer.write(json.dumps(dict(zip(columns, row)), default=str))
+                buffer.write("\n")
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def _aiter_chunks(chunks):
+    """Drives a blocking chunk generator from a worker thread, one chunk at a time."""
+    end = object()
+    try:
+        while True:
+            chunk = await sync_to_async(next, thread_sensitive=False)(chunks, end)
+            if chunk is end:
+                return
+            yield chunk
+    finally:
+        # Releases the pooled connection if the client disconnected mid-export.
+        await sync_to_async(chunks.close, thread_sensitive=False)()
+
+async def export_view(request):
+    """
+    Streams the full result of a previously generated query as CSV or JSON Lines.
+    Rows are fetched in batches, so memory stays flat however large the result is.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': f"Unsupported export format: {export_format}"}, status=400)
+    try:
+        db_path = await sync_to_async(_session_database)(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not db_path:
+        return JsonResponse({'error': 'You must upload a database file before making a query.'}, status=400)
+    try:
+        sql_query = read_result_token(request.GET.get('q', ''))
+    except signing.BadSignature:
+        return JsonResponse({'error': 'This results link is invalid.'}, status=400)
+
+    rows = stream_query(sql_query, db_path)
+    try:
+        # Run validation and the first fetch up front so errors become a proper status code.
+        columns = await sync_to_async(next, thread_sensitive=False)(rows)
+    except Exception as e:
+        logger.error("Export failed: %s", e)
+        return JsonResponse({'error': f"Interpreter Error: {str(e)}"}, status=400)
+
+    def with_header():
+        yield columns
+        yield from rows
+
+    chunks = _export_chunks(with_header(), export_format)
+    logger.debug("Streaming %s export.", export_format)
+    content_type, extension = EXPORT_FORMATS[export_format]
+    # Under ASGI a sync iterator would be buffered whole before sending, defeating the point.
+    body = _aiter_chunks(chunks) if isinstance(request, ASGIRequest) else chunks
+    response = StreamingHttpResponse(body, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="results.{extension}"'
+    return response
+
+def _batch_outcome(record: dict) -> str:
+    """The request outcome of one batch result, named as for the single-question views."""
+    if not record['error']:
+        return 'ok'
+    if record['error_stage'] == 'execution':
+        return 'sql_error'
+    return 'busy' if record['busy'] else 'error'
+
+def _batch_lines(results, total: int):
+    """Renders batch results as JSON Lines, followed by a summary line."""
+    errors = 0
+    try:
+        for record in results:
+            if record['error']:
+                errors += 1
+            metrics.count_request('batch', _batch_outcome(record))
+            yield json.dumps(record, default=str) + "\n"
+    except Exception as e:
+        logger.exception("Unhandled exception in batch pipeline: %s", e)
+        yield json.dumps({'error': f"A system error occurred: {str(e)}"}) + "\n"
+        errors = total
+    yield json.dumps({'done': True, 'questions': total, 'errors': errors}) + "\n"
+
+def _batch_access_error(request):
+    """
+    The batch API's access policy. A request with `Authorization: Bearer <token>`
+    must carry LEXIBASE_BATCH_API_TOKEN and then skips the CSRF check, since
+    scripts cannot obtain a CSRF token the way a page does. Any other request is
+    a browser session and must pass the CSRF check. Returns the rejection, or None.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer':
+        expected = getattr(settings, 'LEXIBASE_BATCH_API_TOKEN', None)
+        if expected and hmac.compare_digest(token.strip().encode('utf-8'), expected.encode('utf-8')):
+            return None
+        return JsonResponse({'error': 'Invalid API token.'}, status=401)
+    if CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {}) is not None:
+        return JsonResponse({'error': 'CSRF verification failed. Send the CSRF token or an API token.'}, status=403)
+    return None
+
+@csrf_exempt  # The CSRF check is part of _batch_access_error.
+async def batch_view(request):
+    """
+    Translates and runs many questions against the session's database. Expects a
+    JSON body {"questions": [...], "bypass_cache": false} and streams back one
+    JSON line per question as it completes (each with its `index`), then a
+    summary line. See _batch_access_error for who may call it.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    rejection = await sync_to_async(_batch_access_error)(request)
+    if rejection is not None:
+        return rejection
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'The request body must be JSON.'}, status=400)
+    questions = payload.get('questions') if isinstance(payload, dict) else None
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return JsonResponse({'error': 'Expected "questions": a non-empty list of questions.'}, status=400)
+    if len(questions) > batch_runner.BATCH_MAX_QUESTIONS:
+        return JsonResponse(
+            {'error': f"A batch can hold at most {batch_runner.BATCH_MAX_QUESTIONS} questions."}, status=400
+        )
+    try:
+        db_path = await sync_to_async(_session_database)(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not db_path:
+        return JsonResponse({'error': 'You must upload a database file before making a query.'}, status=400)
+
+    questions = [question.strip() for question in questions]
+    fingerprint = await sync_to_async(get_db_fingerprint)(db_path)
+
+    def execute(question, sql, generated):
+        return _run_and_cache_results(question, db_path, fingerprint, sql, generated)
+
+    results = batch_runner.run_batch(
+        questions, db_path, fingerprint, execute, use_cache=not payload.get('bypass_cache', False)
+    )
+    lines = _batch_lines(results, len(questions))
+    body = _aiter_chunks(lines) if isinstance(request, ASGIRequest) else lines
+    response = StreamingHttpResponse(body, content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def stats_view(request):
+    """Reports cache, hot-tier, upload-store and scheduler counters as JSON for operators."""
+    return JsonResponse({
+        'hot_tier': hot_tier.get_hot_tier_stats(),
+        'upload_store': upload_store.get_store_stats(),
+        'result_cache': result_cache.stats(),
+        'prefix_cache': llm_handler.get_prefix_cache_stats(),
+        'generation': llm_handler.get_generation_stats(),
+        'model': llm_handler.get_model_status(),
+        'scheduler': inference_scheduler.scheduler.stats(),
+    })
+
+def metrics_view(request):
+    """Exposes pipeline latency, token, cache and request metrics in the Prometheus text format."""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')